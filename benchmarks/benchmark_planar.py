@@ -0,0 +1,80 @@
+# coding=utf-8
+
+"""
+Compares the planar (atan2) and SVD registration solvers, for single
+registrations, batches and incremental registration, on fiducials
+with z = 0 as placed in FRED.
+
+Usage: python benchmarks/benchmark_planar.py
+"""
+
+import timeit
+
+import numpy as np
+from sksurgerycore.algorithms.procrustes import orthogonal_procrustes
+
+from sksurgeryfred.algorithms.procrustes import batch_orthogonal_procrustes, \
+                batch_planar_procrustes, planar_procrustes, \
+                rotations_from_covariances, planar_rotations
+
+
+def _planar_fiducials(batch_size, no_fids, random):
+    """Returns stacks of fixed and moving fiducials with z = 0"""
+    moving = random.uniform(0.0, 512.0, size=(batch_size, no_fids, 3))
+    moving[:, :, 2] = 0.0
+    fixed = moving + random.normal(scale=2.0, size=moving.shape)
+    fixed[:, :, 2] = 0.0
+    return fixed, moving
+
+
+def _best_time(function, repeats=5, number=None):
+    """Returns the best time per call of function, in seconds"""
+    timer = timeit.Timer(function)
+    if number is None:
+        number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeats, number=number)) / number
+
+
+def run_benchmarks(no_fids=10, batch_sizes=(1, 100, 10000), seed=0):
+    """
+    Times each solver pair
+
+    :returns: a list of (case, svd time, planar time) tuples, in seconds
+    """
+    random = np.random.default_rng(seed)
+    results = []
+
+    fixed, moving = _planar_fiducials(1, no_fids, random)
+    results.append((
+        f'single, {no_fids} fiducials',
+        _best_time(lambda: orthogonal_procrustes(fixed[0], moving[0])),
+        _best_time(lambda: planar_procrustes(fixed[0], moving[0]))))
+
+    for batch_size in batch_sizes:
+        fixed, moving = _planar_fiducials(batch_size, no_fids, random)
+        results.append((
+            f'batch of {batch_size}',
+            _best_time(lambda fixed=fixed, moving=moving:
+                       batch_orthogonal_procrustes(fixed, moving)),
+            _best_time(lambda fixed=fixed, moving=moving:
+                       batch_planar_procrustes(fixed, moving))))
+
+    covariance = np.einsum('ni,nj->ij', moving[0], fixed[0])
+    results.append((
+        'incremental rotation',
+        _best_time(lambda: rotations_from_covariances(covariance)),
+        _best_time(lambda: planar_rotations(covariance))))
+
+    return results
+
+
+def main():
+    """Prints the benchmark results as a table"""
+    print(f"{'case':<24}{'svd (us)':>14}{'planar (us)':>14}{'speedup':>10}")
+    for case, svd_time, planar_time in run_benchmarks():
+        print(f'{case:<24}{svd_time * 1e6:>14.1f}{planar_time * 1e6:>14.1f}'
+              f'{svd_time / planar_time:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# coding=utf-8
+
+"""
+Compares the general rotation solvers, sksurgerycore's SVD and Horn's
+quaternion method, for batches of 3D registrations. Shows the solver
+PointBasedRegistration.register_batch uses, procrustes.default_solver,
+next to the one timed fastest here, to check QUATERNION_BATCH_SIZE.
+The batch sizes step through powers of two around it. When it was
+set SVD was faster up to 32 registrations, the two were within noise
+at 64, and the quaternion method was faster from 128, so 128 is the
+smallest batch it is chosen for.
+
+Usage: python benchmarks/benchmark_solvers.py
+"""
+
+import timeit
+
+import numpy as np
+
+from sksurgeryfred.algorithms.procrustes import batch_orthogonal_procrustes, \
+                default_solver, fastest_solver, GENERAL_SOLVERS
+
+
+def _fiducials(batch_size, no_fids, random):
+    """Returns stacks of fixed and moving fiducials in 3D"""
+    moving = random.uniform(0.0, 512.0, size=(batch_size, no_fids, 3))
+    fixed = moving + random.normal(scale=2.0, size=moving.shape)
+    return fixed, moving
+
+
+def run_benchmarks(no_fids=10, batch_sizes=(1, 16, 32, 64, 128, 256, 1024, 10000),
+                   repeats=5, seed=0):
+    """
+    Times batch registration with each general solver
+
+    :returns: a list of (batch size, dictionary of time per registration
+        in seconds by solver, default solver, fastest solver) tuples
+    """
+    random = np.random.default_rng(seed)
+    results = []
+    for batch_size in batch_sizes:
+        fixed, moving = _fiducials(batch_size, no_fids, random)
+        times = {}
+        for solver in GENERAL_SOLVERS:
+            timer = timeit.Timer(
+                lambda solver=solver, fixed=fixed, moving=moving:
+                batch_orthogonal_procrustes(fixed, moving, solver))
+            number, _ = timer.autorange()
+            times[solver] = min(timer.repeat(repeat=repeats, number=number)
+                                ) / number / batch_size
+        results.append((batch_size, times, default_solver(batch_size),
+                        fastest_solver(batch_size)))
+    return results
+
+
+def main():
+    """Prints the benchmark results as a table"""
+    header = f"{'batch':>8}"
+    for solver in GENERAL_SOLVERS:
+        header += f"{solver + ' (us)':>18}"
+    print(header + f"{'default':>12}{'fastest':>12}")
+    for batch_size, times, default, fastest in run_benchmarks():
+        row = f'{batch_size:>8}'
+        for solver in GENERAL_SOLVERS:
+            row += f'{times[solver] * 1e6:>18.2f}'
+        print(row + f'{default:>12}{fastest:>12}')
+
+
+if __name__ == '__main__':
+    main()
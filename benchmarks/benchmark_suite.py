@@ -0,0 +1,326 @@
+# coding=utf-8
+
+"""
+Times the core algorithms and every Flask endpoint in main.py,
+reporting p50, p95 and p99 latency and throughput. Results can be
+saved as a JSON baseline and later runs compared against it, flagging
+cases that got slower by more than a threshold.
+
+Usage, from the repository root:
+    PYTHONPATH=. python benchmarks/benchmark_suite.py --save baseline.json
+    PYTHONPATH=. python benchmarks/benchmark_suite.py --compare baseline.json
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from sksurgeryfred.algorithms.fle import FLE
+from sksurgeryfred.algorithms.fred import make_target_point
+from sksurgeryfred.algorithms.point_based_reg import PointBasedRegistration
+from sksurgeryfred.algorithms.scores import calculate_score
+from sksurgeryfred.utilities.binary_transport import OCTET_STREAM, \
+                encode_values
+
+#: The fiducial counts to time registration for
+FIDUCIAL_COUNTS = (3, 4, 6, 10, 20, 50)
+
+#: The statistics reported for each case
+STATISTICS = ('p50', 'p95', 'p99', 'mean', 'throughput')
+
+#: The most calls for slow cases. Without credentials firestore spends
+#: seconds looking for them on every call.
+MAX_CALLS = {'POST /initdatabase': 3}
+
+
+def latency_statistics(times):
+    """
+    Summarises the times of single calls
+
+    :param times: 1D array of times in seconds
+    :returns: dictionary of p50, p95, p99 and mean latency in seconds
+        and throughput in calls per second
+    """
+    times = np.asarray(times, dtype=np.float64)
+    p50, p95, p99 = np.percentile(times, [50, 95, 99])
+    return {
+        'p50': float(p50),
+        'p95': float(p95),
+        'p99': float(p99),
+        'mean': float(np.mean(times)),
+        'throughput': float(times.size / np.sum(times))
+        }
+
+
+def time_calls(function, number, warmup=5):
+    """
+    Times number single calls of function, after some untimed calls
+    to fill caches
+
+    :returns: 1D array of the time of each call in seconds
+    """
+    for _ in range(min(warmup, number)):
+        function()
+    times = np.empty(number, dtype=np.float64)
+    for i in range(number):
+        start = time.perf_counter()
+        function()
+        times[i] = time.perf_counter() - start
+    return times
+
+
+def algorithm_cases(seed=0):
+    """
+    Returns the algorithm benchmarks
+
+    :returns: dictionary of functions taking no arguments, by case name
+    """
+    random = np.random.default_rng(seed)
+    outline = np.load('static/brain512.npy')
+    target = np.array([[250.0, 250.0, 0.0]])
+    cases = {}
+
+    for no_fids in FIDUCIAL_COUNTS:
+        moving = np.zeros((no_fids, 3), dtype=np.float64)
+        moving[:, 0:2] = random.uniform(150.0, 350.0, size=(no_fids, 2))
+        fixed = moving + random.normal(scale=2.0, size=moving.shape)
+        registerer = PointBasedRegistration(target, 12.0, 0.0)
+        cases[f'register, {no_fids} fiducials'] = \
+            lambda registerer=registerer, fixed=fixed, moving=moving: \
+                registerer.register(fixed, moving)
+
+    fle = FLE(independent_fle=2.0, systematic_fle=[1.0, 0.0, 0.0])
+    cases['perturb_fiducial'] = \
+        lambda: fle.perturb_fiducial(np.array([250.0, 250.0, 0.0]))
+
+    est_target = np.array([[252.0], [249.0], [0.0]])
+    cases['calculate_score'] = \
+        lambda: calculate_score(target[0], est_target, 10.0, 2.0)
+
+    cases['make_target_point'] = lambda: make_target_point(outline)
+
+    return cases
+
+
+def _post(client, route, payload=None):
+    """Returns a function posting payload as json to route"""
+    if payload is None:
+        return lambda: client.post(route)
+    data = json.dumps(payload)
+    return lambda: client.post(route, data=data,
+                               content_type='application/json')
+
+
+def _post_binary(client, route, payload=None):
+    """Returns a function posting payload as a binary message to route,
+    accepting a binary message back"""
+    if payload is None:
+        return lambda: client.post(route, headers={'Accept': OCTET_STREAM})
+    data = encode_values(payload)
+    return lambda: client.post(route, data=data, content_type=OCTET_STREAM,
+                               headers={'Accept': OCTET_STREAM})
+
+
+def endpoint_cases(client):
+    """
+    Returns the endpoint benchmarks, one or more for every route in
+    main.py, driven through a Flask test client
+
+    :returns: dictionary of functions taking no arguments, by case name
+    """
+    outline = np.load('static/brain512.npy').tolist()
+    preop_fids = [[200.0, 250.0, 0.0], [300.0, 250.0, 0.0],
+                  [250.0, 150.0, 0.0], [250.0, 320.0, 0.0]]
+    intraop_fids = [[x_pos + 1.0, y_pos - 1.0, z_pos]
+                    for x_pos, y_pos, z_pos in preop_fids]
+    registration = {
+        'target': [[250.0, 250.0, 0.0]],
+        'preop_fids': preop_fids,
+        'intraop_fids': intraop_fids,
+        'preop_fle': 0.0,
+        'intraop_fle': 4.5
+        }
+
+    session = json.loads(client.post(
+        '/initsession', data=json.dumps({'target': [250.0, 250.0, 0.0],
+                                         'intraop_fle': 4.5}),
+        content_type='application/json').data.decode())
+    reference = session.get('reference')
+    for x_pos, y_pos, _z_pos in preop_fids:
+        client.post('/placefiducial', data=json.dumps({
+            'x_pos': x_pos, 'y_pos': y_pos, 'reference': reference}),
+                    content_type='application/json')
+
+    return {
+        'GET /': lambda: client.get('/'),
+        'GET /favicon.ico': lambda: client.get('/favicon.ico'),
+        'GET /metrics': lambda: client.get('/metrics'),
+        'POST /startfred': _post(client, '/startfred'),
+        'POST /defaultcontour': _post(client, '/defaultcontour'),
+        'POST /defaultcontour, binary': _post_binary(client,
+                                                     '/defaultcontour'),
+        'POST /gettarget': _post(client, '/gettarget', {'outline': outline}),
+        'POST /gettarget, anatomy': _post(client, '/gettarget',
+                                          {'anatomy': 'brain512'}),
+        'POST /anatomies': _post(client, '/anatomies'),
+        'POST /getfle': _post(client, '/getfle'),
+        'POST /initsession': _post(client, '/initsession', {
+            'target': [250.0, 250.0, 0.0], 'intraop_fle': 4.5}),
+        'POST /placefiducial': _post(client, '/placefiducial', {
+            'x_pos': 250.0, 'y_pos': 250.0,
+            'intra_op_ind_fle': [2.0, 2.0, 2.0]}),
+        'POST /placefiducial, binary': _post_binary(client, '/placefiducial', {
+            'x_pos': 250.0, 'y_pos': 250.0,
+            'intra_op_ind_fle': [2.0, 2.0, 2.0]}),
+        'POST /register': _post(client, '/register', registration),
+        'POST /register, binary': _post_binary(client, '/register',
+                                               registration),
+        'POST /register, session': _post(client, '/register',
+                                         {'reference': reference}),
+        'POST /fiducialinfluence': _post(client, '/fiducialinfluence',
+                                         registration),
+        'POST /expectedtremap': _post(client, '/expectedtremap', {
+            'preop_fids': preop_fids, 'intraop_fle': 4.5}),
+        'POST /suggestfiducial': _post(client, '/suggestfiducial', {
+            'preop_fids': preop_fids, 'target': [250.0, 250.0, 0.0],
+            'intraop_fle': 4.5}),
+        'POST /initdatabase': _post(client, '/initdatabase'),
+        'POST /writeresults': _post(client, '/writeresults', {
+            'reference': 0, 'actual_tre': 0.0, 'fre': 0.0,
+            'expected_tre': 0.0, 'expected_fre': 0.0, 'mean_fle': 0.0,
+            'number_of_fids': 0, 'teststring': 'testing'}),
+        'POST /writegameresults': _post(client, '/writegameresults', {
+            'state': 'Actual TRE', 'score': -222, 'reg_reference': 0,
+            'teststring': 'testing'}),
+        'POST /gethighscores': _post(client, '/gethighscores', {
+            'score': -222, 'teststring': 'empty'}),
+        'POST /addhighscore': _post(client, '/addhighscore', {
+            'score': -222, 'name': 'Alice', 'teststring': 'empty'}),
+        'POST /correlation': _post(client, '/correlation', [
+            [0.0, 0.0], [1.0, 1.0], [1.2, 1.3], [0.9, 2.1]]),
+        'POST /calculatescore': _post(client, '/calculatescore', {
+            'target': [[0.0, 0.0, 0.0]], 'est_target': [[1.0], [0.0], [0.0]],
+            'target_radius': 5.0, 'margin': 1.0}),
+        'POST /optimalmargin': _post(client, '/optimalmargin', {
+            'expected_tre': 2.0}),
+        }
+
+
+def untimed_routes(app, cases):
+    """
+    Returns the routes of app that no case times, so the suite can
+    warn when an endpoint is added without a benchmark
+    """
+    timed = {name.split(' ')[1].rstrip(',') for name in cases}
+    return sorted(rule.rule for rule in app.url_map.iter_rules()
+                  if rule.endpoint != 'static' and rule.rule not in timed)
+
+
+def run_suite(number=200, endpoints=True, seed=0):
+    """
+    Runs every benchmark
+
+    :param number: the number of timed calls per case
+    :param endpoints: whether to time the Flask endpoints, which
+        imports main.py and so needs Flask and firestore
+    :returns: dictionary of latency_statistics by case name
+    """
+    cases = algorithm_cases(seed)
+    if endpoints:
+        import main as fred #pylint: disable=import-outside-toplevel
+        with fred.app.test_client() as client:
+            app_cases = endpoint_cases(client)
+            for route in untimed_routes(fred.app, app_cases):
+                print(f'warning: no benchmark for {route}', file=sys.stderr)
+            cases.update(app_cases)
+            return _time_cases(cases, number)
+
+    return _time_cases(cases, number)
+
+
+def _time_cases(cases, number):
+    """Returns latency_statistics for each case"""
+    return {name: latency_statistics(time_calls(
+        function, min(number, MAX_CALLS.get(name, number))))
+            for name, function in cases.items()}
+
+
+def compare(results, baseline, threshold=0.1, statistic='p50'):
+    """
+    Compares results against a baseline
+
+    :param results: dictionary of latency_statistics by case name
+    :param baseline: a previous results dictionary
+    :param threshold: the fractional slow down counted as a regression
+    :param statistic: the latency statistic to compare
+    :returns: a list of (case, baseline, current, ratio, regressed)
+        tuples for the cases in both
+    """
+    comparison = []
+    for name, statistics in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name][statistic]
+        new = statistics[statistic]
+        ratio = new / old if old > 0.0 else float('inf')
+        comparison.append((name, old, new, ratio, ratio > 1.0 + threshold))
+    return comparison
+
+
+def main(args=None):
+    """
+    Runs the suite, prints the results and saves or compares against
+    a baseline. Exits with status 1 if any case regressed.
+    """
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the FRED algorithms and endpoints')
+    parser.add_argument('-n', '--number', type=int, default=200,
+                        help='The number of timed calls per case')
+    parser.add_argument('-s', '--save', default=None,
+                        help='Save the results as a JSON baseline')
+    parser.add_argument('-c', '--compare', default=None,
+                        help='A JSON baseline to compare against')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help='The fractional slow down that is a '
+                             'regression, default 0.1')
+    parser.add_argument('--statistic', default='p50',
+                        choices=('p50', 'p95', 'p99', 'mean'),
+                        help='The latency statistic to compare')
+    parser.add_argument('--algorithms_only', action='store_true',
+                        help='Skip the Flask endpoints')
+    parsed = parser.parse_args(args)
+
+    results = run_suite(parsed.number, not parsed.algorithms_only)
+
+    print(f"{'case':<34}{'p50 (us)':>11}{'p95 (us)':>11}{'p99 (us)':>11}"
+          f"{'calls/s':>11}")
+    for name, statistics in results.items():
+        print(f"{name:<34}{statistics['p50'] * 1e6:>11.1f}"
+              f"{statistics['p95'] * 1e6:>11.1f}"
+              f"{statistics['p99'] * 1e6:>11.1f}"
+              f"{statistics['throughput']:>11.0f}")
+
+    if parsed.save is not None:
+        with open(parsed.save, 'w', encoding='utf-8') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+
+    if parsed.compare is not None:
+        with open(parsed.compare, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        comparison = compare(results, baseline, parsed.threshold,
+                             parsed.statistic)
+        print(f"\n{'case':<34}{'baseline':>11}{'current':>11}{'ratio':>8}")
+        for name, old, new, ratio, regressed in comparison:
+            print(f'{name:<34}{old * 1e6:>11.1f}{new * 1e6:>11.1f}'
+                  f"{ratio:>8.2f}{'  REGRESSION' if regressed else ''}")
+        if any(regressed for *_values, regressed in comparison):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,26 +2,296 @@
 Module to handle communication between client (static/main.js) and
 sksurgeryfred server
 """
+import base64
+import functools
+import gzip
+import io
 import json
 import math
 import datetime
+import threading
+import time
+import uuid
 # Flask
-from flask import Flask, request, render_template, jsonify, send_file
+from flask import Flask, request, render_template, jsonify, send_file, \
+                g, Response
 import numpy as np
+from werkzeug.exceptions import BadRequest
 from google.cloud import firestore
 from google.auth.exceptions import DefaultCredentialsError
-from sksurgeryfred.algorithms.point_based_reg import PointBasedRegistration
-from sksurgeryfred.algorithms.fred import make_target_point, is_valid_fiducial
-from sksurgeryfred.algorithms.errors import expected_absolute_value
+from sksurgeryfred.algorithms.point_based_reg import PointBasedRegistration, \
+                combine_fle
+from sksurgeryfred.algorithms.fred import make_target_point
+from sksurgeryfred.algorithms.contour import contour_hash, bounded_outline
+from sksurgeryfred.algorithms.errors import expected_absolute_value, \
+                compute_tre_map, quantise, fle_covariance
 from sksurgeryfred.algorithms.fle import FLE
-from sksurgeryfred.algorithms.scores import calculate_score
+from sksurgeryfred.algorithms.planning import candidate_grid, \
+                suggest_fiducials
+from sksurgeryfred.algorithms.scores import calculate_score, optimal_margin
 from sksurgeryfred.utilities.results_database import ResultsDatabase
+from sksurgeryfred.utilities.sessions import SessionStore, make_session
+from sksurgeryfred.utilities.metrics import RequestMetrics, CONTENT_TYPE
+from sksurgeryfred.utilities.anatomy import AnatomyRegistry
+from sksurgeryfred.utilities.binary_transport import OCTET_STREAM, \
+                encode_arrays, encode_values, decode_values, delta_encode
 from sksurgeryfred import __version__ as fredversion
 
 # Declare a flask app
 app = Flask(__name__)
 
-# Load model
+# The anatomy outlines, static/<anatomy id>.npy, loaded when first used
+ANATOMIES = AnatomyRegistry('static', max_cached=16)
+# The anatomy used when a request doesn't name one
+DEFAULT_ANATOMY = 'brain512'
+# The size of the images, rows then columns
+DEFAULT_CONTOUR_SHAPE = (512, 512)
+# The most fiducials /suggestfiducial will suggest at once
+MAX_SUGGESTIONS = 10
+# The most points an outline sent by a client may have
+MAX_OUTLINE_POINTS = 4096
+# How long clients may reuse the default contour without checking
+CONTOUR_MAX_AGE = 24 * 3600
+
+# Registration sessions, keyed by the database reference
+SESSIONS = SessionStore(max_sessions=2000, time_to_live=2 * 3600.0)
+
+# Per endpoint request counts, latencies and sizes, served at /metrics
+METRICS = RequestMetrics()
+
+# Each thread gets its own random generator, spawned from one seed
+# sequence, so threads don't share numpy's global random state
+_SEED_SEQUENCE = np.random.SeedSequence()
+_SEED_LOCK = threading.Lock()
+_THREAD_RANDOM = threading.local()
+
+
+def _spawn_seed_sequence():
+    """
+    Returns a new child of the server's seed sequence
+    """
+    with _SEED_LOCK:
+        return _SEED_SEQUENCE.spawn(1)[0]
+
+
+def _random_generator():
+    """
+    Returns the random generator for the current thread
+    """
+    generator = getattr(_THREAD_RANDOM, 'generator', None)
+    if generator is None:
+        generator = np.random.default_rng(_spawn_seed_sequence())
+        _THREAD_RANDOM.generator = generator
+    return generator
+
+
+def _registration_dict(registration):
+    """
+    Converts the list returned by PointBasedRegistration.register to
+    a dictionary ready to return as json
+    """
+    [success, fre, mean_fle_sq, expected_tre_sq,
+            expected_fre_sq, transformed_target, actual_tre,
+            no_fids] = registration
+
+    expected_tre = 0.0
+    expected_fre = 0.0
+    mean_fle = 0.0
+
+    if success:
+        mean_fle = math.sqrt(mean_fle_sq)
+        expected_tre = math.sqrt(expected_tre_sq)
+        expected_fre = math.sqrt(expected_fre_sq)
+
+    return {
+            'success': success,
+            'fre': fre,
+            'mean_fle': mean_fle,
+            'expected_tre': expected_tre,
+            'expected_fre': expected_fre,
+            'transformed_target': transformed_target.tolist(),
+            'actual_tre': actual_tre,
+            'no_fids': no_fids
+            }
+
+
+def _fle_covariances(fle_json):
+    """
+    Returns the intra-op (fixed) and pre-op (moving) fle covariances
+    from a request, or None for any not given
+    """
+    fixed_fle_cov = fle_json.get("intraop_fle_covariance")
+    moving_fle_cov = fle_json.get("preop_fle_covariance")
+    if fixed_fle_cov is not None:
+        fixed_fle_cov = np.array(fixed_fle_cov, dtype=np.float64)
+    if moving_fle_cov is not None:
+        moving_fle_cov = np.array(moving_fle_cov, dtype=np.float64)
+    return fixed_fle_cov, moving_fle_cov
+
+
+def _gzip(body):
+    """
+    Returns body gzipped with no timestamp, so the bytes are the same
+    on every start up. gzip.compress only takes mtime from Python 3.8.
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as gzip_file:
+        gzip_file.write(body)
+    return buffer.getvalue()
+
+
+def _contour_bodies(contour):
+    """
+    Returns the /defaultcontour response bodies, serialised once, as
+    json or a binary message, each plain and gzipped, with a strong
+    ETag, keyed by mime type and content encoding. The binary message
+    holds the contour delta encoded as int16, 'contour_delta', or as
+    float32, 'contour', if it can't be.
+    """
+    etag = contour_hash(contour)
+    try:
+        binary_body = encode_arrays({'contour_delta': delta_encode(contour)})
+    except ValueError:
+        binary_body = encode_values({'contour': contour})
+    bodies = {}
+    for mimetype, body in (
+            ('application/json',
+             json.dumps({'contour': contour.tolist()}).encode()),
+            (OCTET_STREAM, binary_body)):
+        tag = etag if mimetype == 'application/json' else etag + '-binary'
+        bodies[(mimetype, 'identity')] = (body, tag)
+        bodies[(mimetype, 'gzip')] = (_gzip(body),
+                                      tag + '-gzip')
+    return bodies
+
+
+def _wants_binary():
+    """
+    Returns true if the client prefers a binary message to json
+    """
+    return request.accept_mimetypes.best_match(
+        ['application/json', OCTET_STREAM]) == OCTET_STREAM
+
+
+def _request_values():
+    """
+    Returns the request body, json or a binary message, as a
+    dictionary. Arrays in binary messages are not copied.
+
+    :raises ValueError: If a binary message is malformed
+    """
+    if request.mimetype == OCTET_STREAM:
+        return decode_values(request.get_data())
+    return request.get_json()
+
+
+def _respond(values):
+    """
+    Returns values as json, or as a binary message of float32 arrays
+    if the client prefers it
+    """
+    if _wants_binary():
+        return Response(encode_values(values), content_type=OCTET_STREAM)
+    return jsonify(values)
+
+
+def _session_reference(values):
+    """
+    Returns the session reference given in a request, or None
+
+    :raises BadRequest: If the reference is not a string, which Flask
+        returns as a 400
+    """
+    reference = values.get('reference')
+    if reference is not None and not isinstance(reference, str):
+        raise BadRequest("reference should be a string")
+    return reference
+
+
+def _anatomy_id(values):
+    """
+    Returns the anatomy id given in a request's json or query string,
+    or the default anatomy. Ids that aren't strings are returned as
+    strings, so the registry finds no such anatomy rather than
+    failing to hash them.
+    """
+    anatomy_id = (values or {}).get('anatomy')
+    if anatomy_id is None:
+        anatomy_id = request.args.get('anatomy', DEFAULT_ANATOMY)
+    return str(anatomy_id)
+
+
+@functools.lru_cache(maxsize=64)
+def _tre_map(fiducial_bytes, mean_fle_squared, covariance_bytes, stride):
+    """
+    Returns the quantised expected TRE map for a fiducial set and FLE,
+    cached on their bytes so repeated requests for the same fiducials
+    are not recomputed. covariance_bytes is None for isotropic FLE.
+    """
+    fiducials = np.frombuffer(fiducial_bytes, dtype=np.float64).reshape(-1, 3)
+    fle_cov = None if covariance_bytes is None else np.frombuffer(
+        covariance_bytes, dtype=np.float64).reshape(3, 3)
+    tre_map = np.sqrt(compute_tre_map(fiducials, mean_fle_squared,
+                                      shape=DEFAULT_CONTOUR_SHAPE,
+                                      stride=stride,
+                                      fle_cov=fle_cov))
+    return quantise(tre_map)
+
+
+def _combined_fle(fle_json):
+    """
+    Returns a request's intra-op and pre-op FLE combined as /register
+    combines them, the mean FLE squared and covariance or None
+
+    :raises TypeError, ValueError: If the FLE are invalid
+    """
+    fixed_fle_cov, moving_fle_cov = _fle_covariances(fle_json)
+    return combine_fle(float(fle_json.get("intraop_fle", 0.0)),
+                       float(fle_json.get("preop_fle", 0.0)),
+                       fixed_fle_cov, moving_fle_cov)
+
+
+@functools.lru_cache(maxsize=16)
+def _candidate_fiducials(anatomy_id, stride):
+    """
+    Returns the candidate fiducial positions inside an anatomy at a
+    grid spacing of stride. The stride comes from the client, so the
+    grids are kept in a least recently used cache of bounded size.
+
+    :raises ValueError: If there is no anatomy anatomy_id
+    """
+    return candidate_grid(ANATOMIES.geometry(anatomy_id), stride)
+
+
+@app.before_request
+def _start_timer():
+    """
+    Notes when the request started, for the metrics
+    """
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def _record_metrics(response):
+    """
+    Records the request's latency, sizes and status in the metrics
+    """
+    start = g.get('request_start')
+    if start is not None:
+        METRICS.record(request.endpoint or 'unmatched', request.method,
+                       response.status_code, time.perf_counter() - start,
+                       request.content_length or 0,
+                       response.content_length or 0)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Returns the request metrics in Prometheus text format
+    """
+    return Response(METRICS.render(), content_type=CONTENT_TYPE)
+
 
 @app.route('/favicon.ico', methods=['GET'])
 def favicon():
@@ -49,21 +319,69 @@ def startfred():
 def defaultcontour():
     """
     Returns a pre-calculated contour image to represent the
-    intraoperative image.
+    intraoperative image, the anatomy named by 'anatomy' in the json
+    or query string, or the default. The response is serialised once
+    per anatomy, sent gzipped if the client accepts it, and has an
+    ETag so clients holding the contour get a 304 Not Modified.
+    Clients accepting application/octet-stream get a binary message.
     """
-    contour = np.load('static/brain512.npy')
-    returnjson = jsonify({'contour': contour.tolist()})
-    return returnjson
+    anatomy_id = _anatomy_id(request.get_json(silent=True))
+    try:
+        bodies = ANATOMIES.derived(anatomy_id, 'contour_bodies',
+                                   _contour_bodies)
+    except ValueError:
+        return jsonify({'success': False})
+    mimetype = OCTET_STREAM if _wants_binary() else 'application/json'
+    encoding = 'gzip' if 'gzip' in request.accept_encodings else 'identity'
+    body, etag = bodies[(mimetype, encoding)]
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, content_type=mimetype)
+        if encoding == 'gzip':
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=' + \
+                    str(CONTOUR_MAX_AGE)
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return response
+
+
+@app.route('/anatomies', methods=['POST'])
+def anatomies():
+    """
+    Returns the ids of the anatomies /defaultcontour and /gettarget
+    can use, and the default
+    """
+    return jsonify({'anatomies': ANATOMIES.ids,
+                    'default': DEFAULT_ANATOMY})
 
 
 @app.route('/gettarget', methods=['POST'])
 def gettarget():
     """
-    Returns a target point for the simulated intervention
+    Returns a target point for the simulated intervention, inside
+    the anatomy named by 'anatomy', or the 'outline' given, or the
+    default anatomy. Outlines must have at most MAX_OUTLINE_POINTS
+    points, all within the image, and targets must be drawable from
+    them, otherwise they are a bad request.
     """
-    jsonstring = json.dumps(request.json)
-    outline =json.loads(jsonstring).get('outline')
-    target = make_target_point(outline, edge_buffer=0.9)
+    target_json = request.get_json(silent=True) or {}
+    outline = target_json.get('outline')
+    if outline is not None and target_json.get('anatomy') is None:
+        try:
+            target = make_target_point(
+                bounded_outline(outline, MAX_OUTLINE_POINTS,
+                                DEFAULT_CONTOUR_SHAPE), edge_buffer=0.9)
+        except ValueError as error:
+            raise BadRequest(str(error)) from error
+    else:
+        try:
+            target = ANATOMIES.target_pool(_anatomy_id(target_json),
+                                           edge_buffer=0.9).pop()
+        except ValueError:
+            return jsonify({'success': False})
 
     returnjson = jsonify({'target': target.tolist()})
     return returnjson
@@ -74,103 +392,347 @@ def getfle():
     """
     Returns values for fiducial localisation errors
     Values are randomly selected from a uniform
-    distribution from 0.5 to 5.0 pixels
+    distribution from 0.5 to 5.0 pixels. Optionally
+    takes fle_ratio, the relative standard deviation
+    along each axis for anisotropic fle, and
+    moving_fle_ratio, the moving (pre-op) image fle
+    relative to the fixed (intra-op) image fle.
     """
-    fle_sd = np.random.uniform(low=0.5, high=5.0)
-    #change fle_ratio if you want anisotropic fle
-    fle_ratio = np.array([1.0, 1.0, 1.0], dtype=np.float64)
+    fle_json = request.get_json(silent=True) or {}
+    fle_sd = _random_generator().uniform(low=0.5, high=5.0)
+    fle_ratio = np.array(fle_json.get('fle_ratio', [1.0, 1.0, 1.0]),
+                         dtype=np.float64)
+    moving_fle_ratio = fle_json.get('moving_fle_ratio', 0.0)
+    if fle_ratio.shape != (3,) or np.any(fle_ratio < 0.0) or \
+            np.linalg.norm(fle_ratio) == 0.0 or moving_fle_ratio < 0.0:
+        return jsonify({'success': False})
+
+    #scale so the expected squared fle is 3 * fle_sd^2 whatever the ratio
     anis_scale = math.sqrt(3.0 / (np.linalg.norm(fle_ratio) ** 2))
     fixed_fle = fle_ratio * fle_sd * anis_scale
 
-    moving_fle = np.array([0., 0., 0.], dtype=np.float64)
+    moving_fle = fixed_fle * moving_fle_ratio
     fixed_fle_eavs = expected_absolute_value(fixed_fle)
     moving_fle_eavs = expected_absolute_value(moving_fle)
 
     returnjson = jsonify({
+            'success': True,
             'fixed_fle_sd': fixed_fle.tolist(),
             'moving_fle_sd': moving_fle.tolist(),
             'fixed_fle_eav': fixed_fle_eavs.tolist(),
-            'moving_fle_eav': moving_fle_eavs.tolist()
+            'moving_fle_eav': moving_fle_eavs.tolist(),
+            'fixed_fle_covariance': fle_covariance(fixed_fle).tolist(),
+            'moving_fle_covariance': fle_covariance(moving_fle).tolist()
             })
     return returnjson
 
 
+@app.route('/initsession', methods=['POST'])
+def initsession():
+    """
+    Starts a registration session holding the target and fiducial
+    localisation errors, so that /placefiducial can register each new
+    fiducial without the client resending the others. Uses the
+    reference from /initdatabase if given, unless it already has a
+    session, which is a bad request, otherwise makes one.
+    """
+    session_json = request.json
+    if session_json.get("target") is None:
+        return jsonify({'success': False})
+    reference = _session_reference(session_json)
+    if not reference:
+        reference = uuid.uuid4().hex
+
+    fixed_fle_cov, moving_fle_cov = _fle_covariances(session_json)
+    try:
+        session = make_session(
+            session_json.get("target"),
+            session_json.get("intraop_fle", 0.0),
+            session_json.get("preop_fle", 0.0),
+            session_json.get("intra_op_ind_fle", [0., 0., 0.]),
+            session_json.get("pre_op_ind_fle", [0., 0., 0.]),
+            session_json.get("intra_op_sys_fle", [0., 0., 0.]),
+            session_json.get("pre_op_sys_fle", [0., 0., 0.]),
+            seed_sequence=_spawn_seed_sequence(),
+            fixed_fle_covariance=fixed_fle_cov,
+            moving_fle_covariance=moving_fle_cov)
+    except ValueError:
+        return jsonify({'success': False})
+    try:
+        SESSIONS.add(reference, session)
+    except ValueError as error:
+        raise BadRequest("reference already has a session") from error
+
+    return jsonify({'success': True,
+                    'reference': reference})
+
+
 @app.route('/placefiducial', methods=['POST'])
 def placefiducial():
     """
     Returns the location of a fiducial marker on the pre-
     and intra-operative images. FLE is added to each
-    marker location.
+    marker location. If a session reference is given the
+    fiducial is added to the session and the registration
+    result is returned too. Takes and returns json or, with
+    application/octet-stream, binary messages.
     """
-    x_pos = request.json.get("x_pos")
-    y_pos = request.json.get("y_pos")
-    position = [x_pos, y_pos, 0.0]
-    if is_valid_fiducial(position):
-        moving_ind_fle = request.json.get("pre_op_ind_fle", [0., 0., 0.])
-        fixed_ind_fle = request.json.get("intra_op_ind_fle", [0., 0., 0.])
-        moving_sys_fle = request.json.get("pre_op_sys_fle", [0., 0., 0.])
-        fixed_sys_fle = request.json.get("intra_op_sys_fle", [0., 0., 0.])
-
+    try:
+        fid_json = _request_values()
+    except ValueError:
+        return _respond({'valid_fid': False})
+    try:
+        position = np.array([fid_json.get("x_pos"), fid_json.get("y_pos"),
+                             0.0], dtype=np.float64)
+        geometry = ANATOMIES.geometry(_anatomy_id(fid_json))
+    except (TypeError, ValueError):
+        return _respond({'valid_fid': False})
+    #the outline is row (y) first, fiducials are x first
+    if np.all(position >= 0) and geometry.contains(position[1::-1]):
+        reference = _session_reference(fid_json)
+        if reference is not None:
+            session = SESSIONS.get(reference)
+            if session is not None:
+                fixed_fid, moving_fid, registration = \
+                                session.add_fiducial(position)
+                if registration is None:
+                    return _respond({'valid_fid': False, 'session': True})
+                returnjson = _respond({
+                    'valid_fid': True,
+                    'session': True,
+                    'fixed_fid': fixed_fid.tolist(),
+                    'moving_fid': moving_fid.tolist(),
+                    'registration': _registration_dict(registration)
+                    })
+                return returnjson
+
+        moving_ind_fle = fid_json.get("pre_op_ind_fle", [0., 0., 0.])
+        fixed_ind_fle = fid_json.get("intra_op_ind_fle", [0., 0., 0.])
+        moving_sys_fle = fid_json.get("pre_op_sys_fle", [0., 0., 0.])
+        fixed_sys_fle = fid_json.get("intra_op_sys_fle", [0., 0., 0.])
+
+        generator = _random_generator()
         fixed_fle = FLE(independent_fle = fixed_ind_fle,
-                        systematic_fle = fixed_sys_fle)
+                        systematic_fle = fixed_sys_fle,
+                        random_generator = generator)
         moving_fle = FLE(independent_fle = moving_ind_fle,
-                         systematic_fle = moving_sys_fle)
+                         systematic_fle = moving_sys_fle,
+                         random_generator = generator)
 
         fixed_fid = fixed_fle.perturb_fiducial(position)
         moving_fid = moving_fle.perturb_fiducial(position)
 
-        returnjson = jsonify({
+        returnjson = _respond({
             'valid_fid': True,
+            'session': False,
             'fixed_fid': fixed_fid.tolist(),
             'moving_fid': moving_fid.tolist(),
             })
         return returnjson
 
-    return jsonify({'valid_fid': False})
+    return _respond({'valid_fid': False})
 
 
 @app.route('/register', methods=['POST'])
 def register():
     """
     Performs point based registration and returns
-    registration data as json.
+    registration data as json, or as a binary message with
+    application/octet-stream. If a session reference is given
+    without fiducials, registers the session's fiducials.
     """
-    jsonstring = json.dumps(request.json)
-    reg_json = json.loads(jsonstring)
-    target = np.array(reg_json.get("target"))
+    try:
+        reg_json = _request_values()
+    except ValueError:
+        return _respond({'success': False})
+    reference = _session_reference(reg_json)
+    if reference is not None and reg_json.get("intraop_fids") is None:
+        session = SESSIONS.get(reference)
+        if session is None:
+            return _respond({'success': False, 'session': False})
+        return _respond(_registration_dict(session.register()))
+
+    target = np.array(reg_json.get("target"), dtype=np.float64)
     target = target.reshape(1,3)
     moving_fle_eav = reg_json.get("preop_fle")
     fixed_fle_eav = reg_json.get("intraop_fle")
-    moving_fids = np.array(reg_json.get("preop_fids"))
-    fixed_fids = np.array(reg_json.get("intraop_fids"))
-    registerer = PointBasedRegistration(target,
-                    fixed_fle_eav, moving_fle_eav)
+    moving_fids = np.array(reg_json.get("preop_fids"), dtype=np.float64)
+    fixed_fids = np.array(reg_json.get("intraop_fids"), dtype=np.float64)
+    fixed_fle_cov, moving_fle_cov = _fle_covariances(reg_json)
+    try:
+        registerer = PointBasedRegistration(target,
+                        fixed_fle_eav, moving_fle_eav,
+                        fixed_fle_covariance = fixed_fle_cov,
+                        moving_fle_covariance = moving_fle_cov)
+    except ValueError:
+        return _respond({'success': False})
 
-    [success, fre, mean_fle_sq, expected_tre_sq,
-            expected_fre_sq, transformed_target, actual_tre,
-            no_fids] = registerer.register(fixed_fids, moving_fids)
+    returnjson = _respond(_registration_dict(
+        registerer.register(fixed_fids, moving_fids)))
 
-    expected_tre = 0.0
-    expected_fre = 0.0
-    mean_fle = 0.0
+    return returnjson
 
-    if success:
-        mean_fle = math.sqrt(mean_fle_sq)
-        expected_tre = math.sqrt(expected_tre_sq)
-        expected_fre = math.sqrt(expected_fre_sq)
 
-    returnjson = jsonify({
-            'success': success,
-            'fre': fre,
-            'mean_fle': mean_fle,
-            'expected_tre': expected_tre,
-            'expected_fre': expected_fre,
-            'transformed_target': transformed_target.tolist(),
-            'actual_tre': actual_tre,
-            'no_fids': no_fids
-            })
+@app.route('/fiducialinfluence', methods=['POST'])
+def fiducialinfluence():
+    """
+    Performs point based registration with each fiducial left out
+    in turn and returns the fre, expected tre, transformed target
+    and actual tre without each, as lists in fiducial order. Uses
+    the session's fiducials if a reference is given.
+    """
+    jsonstring = json.dumps(request.json)
+    reg_json = json.loads(jsonstring)
+    reference = _session_reference(reg_json)
+    if reference is not None and reg_json.get("intraop_fids") is None:
+        session = SESSIONS.get(reference)
+        if session is None:
+            return jsonify({'success': False, 'session': False})
+        with session.lock:
+            target = session.registration.target
+            #the session holds the fle of both images combined
+            fixed_fle_eav = session.registration.mean_fle_squared
+            moving_fle_eav = 0.0
+            fixed_fle_cov = session.registration.fle_covariance
+            moving_fle_cov = None
+            moving_fids = np.array(session.moving_fids, dtype=np.float64)
+            fixed_fids = np.array(session.fixed_fids, dtype=np.float64)
+    else:
+        target = np.array(reg_json.get("target"), dtype=np.float64)
+        moving_fle_eav = reg_json.get("preop_fle", 0.0)
+        fixed_fle_eav = reg_json.get("intraop_fle", 0.0)
+        fixed_fle_cov, moving_fle_cov = _fle_covariances(reg_json)
+        moving_fids = np.array(reg_json.get("preop_fids", []),
+                               dtype=np.float64)
+        fixed_fids = np.array(reg_json.get("intraop_fids", []),
+                              dtype=np.float64)
 
-    return returnjson
+    try:
+        registerer = PointBasedRegistration(
+            target.reshape(1, 3), fixed_fle_eav, moving_fle_eav,
+            fixed_fle_covariance = fixed_fle_cov,
+            moving_fle_covariance = moving_fle_cov)
+        results = registerer.leave_one_out(fixed_fids.reshape(-1, 3),
+                                           moving_fids.reshape(-1, 3))
+    except (TypeError, ValueError):
+        return jsonify({'success': False})
+
+    if not np.all(results['success']) or results.shape[0] == 0:
+        return jsonify({'success': False})
+
+    return jsonify({'success': True,
+                    'fre': results['fre'].tolist(),
+                    'expected_tre': np.sqrt(
+                        results['expected_tre_squared']).tolist(),
+                    'transformed_target':
+                        results['transformed_target'].tolist(),
+                    'actual_tre': results['actual_tre'].tolist(),
+                    'no_fids': int(results.shape[0])})
+
+
+@app.route('/expectedtremap', methods=['POST'])
+def expectedtremap():
+    """
+    Returns the expected TRE at every stride'th pixel of the image
+    for the pre-operative fiducials, or a session's fiducials if a
+    reference is given. The FLE of both images, and their covariances
+    if given, are combined as /register does. The map is quantised to
+    8 bits and base64 encoded; multiply by scale to get the expected
+    TRE in pixels.
+    """
+    jsonstring = json.dumps(request.json)
+    map_json = json.loads(jsonstring)
+    reference = _session_reference(map_json)
+    stride = map_json.get("stride", 4)
+
+    try:
+        if reference is not None:
+            session = SESSIONS.get(reference)
+            if session is None:
+                return jsonify({'success': False, 'session': False})
+            with session.lock:
+                fiducials = np.array(session.moving_fids, dtype=np.float64)
+                mean_fle_squared = session.registration.mean_fle_squared
+                fle_cov = session.registration.fle_covariance
+        else:
+            fiducials = np.array(map_json.get("preop_fids", []),
+                                 dtype=np.float64)
+            mean_fle_squared, fle_cov = _combined_fle(map_json)
+
+        stride = int(stride)
+        if stride < 1:
+            raise ValueError("stride should be at least 1")
+        fiducials = np.ascontiguousarray(fiducials.reshape(-1, 3))
+        covariance_bytes = None if fle_cov is None else \
+            np.ascontiguousarray(fle_cov, dtype=np.float64).tobytes()
+        quantised, scale = _tre_map(fiducials.tobytes(),
+                                    float(mean_fle_squared),
+                                    covariance_bytes, stride)
+    except (TypeError, ValueError):
+        return jsonify({'success': False})
+
+    return jsonify({'success': True,
+                    'shape': list(quantised.shape),
+                    'stride': stride,
+                    'scale': scale,
+                    'data': base64.b64encode(quantised.tobytes()).decode(
+                        'ascii')})
+
+
+@app.route('/suggestfiducial', methods=['POST'])
+def suggestfiducial():
+    """
+    Suggests where to place the next fiducials to give the lowest
+    expected TRE, choosing from a grid of positions inside the
+    anatomy. Uses the session's fiducials and target if a reference
+    is given, otherwise the pre-operative fiducials and target, with
+    the FLE of both images combined as /register does. At most
+    MAX_SUGGESTIONS fiducials are suggested, asking for more is a bad
+    request.
+    """
+    jsonstring = json.dumps(request.json)
+    suggest_json = json.loads(jsonstring)
+    reference = _session_reference(suggest_json)
+    stride = suggest_json.get("stride", 8)
+    try:
+        number = int(suggest_json.get("number", 1))
+    except (TypeError, ValueError):
+        return jsonify({'success': False})
+    if number < 1:
+        return jsonify({'success': False})
+    if number > MAX_SUGGESTIONS:
+        raise BadRequest("number should be at most " + str(MAX_SUGGESTIONS))
+
+    try:
+        if reference is not None:
+            session = SESSIONS.get(reference)
+            if session is None:
+                return jsonify({'success': False, 'session': False})
+            with session.lock:
+                fiducials = np.array(session.moving_fids, dtype=np.float64)
+                target = session.registration.target
+                mean_fle_squared = session.registration.mean_fle_squared
+                fle_cov = session.registration.fle_covariance
+        else:
+            fiducials = np.array(suggest_json.get("preop_fids", []),
+                                 dtype=np.float64)
+            target = suggest_json.get("target")
+            mean_fle_squared, fle_cov = _combined_fle(suggest_json)
+
+        stride = int(stride)
+        if stride < 1:
+            raise ValueError("stride should be at least 1")
+        target = np.array(target, dtype=np.float64).reshape(3)
+        suggestions, tre_squared = suggest_fiducials(
+            fiducials.reshape(-1, 3), target, float(mean_fle_squared),
+            _candidate_fiducials(_anatomy_id(suggest_json), stride),
+            number, fle_cov)
+    except (TypeError, ValueError):
+        return jsonify({'success': False})
+
+    return jsonify({'success': True,
+                    'suggestions': suggestions.tolist(),
+                    'expected_tre': np.sqrt(tre_squared).tolist()})
 
 
 @app.route('/initdatabase', methods=['POST'])
@@ -405,6 +967,32 @@ def calculatescore():
                     'score': score})
 
 
+@app.route('/optimalmargin', methods=['POST'])
+def optimalmargin():
+    """
+    Delegates to sksurgery.alogorithms.score to find the
+    ablation margin with the highest expected score for
+    the registration's expected TRE.
+    """
+    jsonstring = json.dumps(request.json)
+    margin_json = json.loads(jsonstring)
+
+    expected_tre = margin_json.get("expected_tre")
+    target_radius = margin_json.get("target_radius", 10.0)
+    margins = margin_json.get("margins", None)
+
+    try:
+        margins, scores, best_margin, best_score = optimal_margin(
+            expected_tre, target_radius, margins)
+    except (TypeError, ValueError):
+        return jsonify({'success': False})
+
+    return jsonify({'success': True,
+                    'margins': margins.tolist(),
+                    'expected_scores': scores.tolist(),
+                    'optimal_margin': best_margin,
+                    'optimal_score': best_score})
+
 
 if __name__ == '__main__':
     app.run(port=5002, threaded=True)
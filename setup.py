@@ -57,5 +57,10 @@ setup(
             'Flask==1.1.2',
     ],
 
-    entry_points={},
+    entry_points={
+        'console_scripts': [
+            'sksurgeryfred-sim='
+            'sksurgeryfred.ui.sksurgeryfred_sim_command_line:main',
+        ],
+    },
 )
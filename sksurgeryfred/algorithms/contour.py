@@ -0,0 +1,312 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Geometry of anatomy outlines, computed once per outline, for
+sampling target points and checking fiducial positions.
+"""
+
+import hashlib
+import threading
+
+import numpy as np
+
+#: The most rounds of drawing and rejecting points before sampling
+#: gives up, so outlines almost nothing can be drawn from fail rather
+#: than loop forever
+MAX_SAMPLING_ROUNDS = 64
+
+
+def points_in_polygon(points, polygon):
+    """
+    Checks which points lie inside a polygon, using the even-odd rule
+
+    :param points: ...x2 ndarray of points
+    :param polygon: Nx2 ndarray, the polygon's vertices in order
+    :returns: ... boolean ndarray, True inside the polygon
+    """
+    points = np.asarray(points, dtype=np.float64)
+    polygon = np.asarray(polygon, dtype=np.float64)
+    first = points[..., 0]
+    second = points[..., 1]
+
+    inside = np.zeros(first.shape, dtype=bool)
+    for start, end in zip(polygon, np.roll(polygon, -1, axis=0)):
+        if start[1] == end[1]:
+            continue
+        crosses = (start[1] > second) != (end[1] > second)
+        intersect = start[0] + (second - start[1]) * \
+                        (end[0] - start[0]) / (end[1] - start[1])
+        inside ^= crosses & (first < intersect)
+    return inside
+
+
+def rasterise_polygon(polygon, origin, shape):
+    """
+    Rasterises a polygon onto a grid with unit spacing, giving the
+    same result as points_in_polygon at every grid point, by finding
+    where each grid line crosses the polygon.
+
+    :param polygon: Nx2 ndarray, the polygon's vertices in order
+    :param origin: the coordinates of grid point [0, 0]
+    :param shape: the shape of the grid
+    :returns: boolean ndarray of shape, True inside the polygon
+    """
+    polygon = np.asarray(polygon, dtype=np.float64)
+    starts = polygon
+    ends = np.roll(polygon, -1, axis=0)
+    sloped = starts[:, 1] != ends[:, 1]
+    starts = starts[sloped]
+    ends = ends[sloped]
+
+    firsts = np.arange(shape[0]) + origin[0]
+    mask = np.zeros(shape, dtype=bool)
+    for column in range(shape[1]):
+        second = column + origin[1]
+        crosses = (starts[:, 1] > second) != (ends[:, 1] > second)
+        intersects = np.sort(starts[crosses, 0] + (second - starts[crosses, 1])
+                             * (ends[crosses, 0] - starts[crosses, 0]) /
+                             (ends[crosses, 1] - starts[crosses, 1]))
+        #inside if an odd number of crossings lie beyond the point
+        beyond = intersects.size - np.searchsorted(intersects, firsts,
+                                                   side='right')
+        mask[:, column] = (beyond % 2) == 1
+    return mask
+
+
+def contour_hash(outline):
+    """
+    Returns a hash of an outline's coordinates, to use as a cache key
+    """
+    outline = np.ascontiguousarray(outline, dtype=np.float64)
+    return hashlib.sha1(outline.tobytes() +
+                        str(outline.shape).encode()).hexdigest()
+
+
+def bounded_outline(outline, max_points, shape):
+    """
+    Returns an outline from an untrusted source, such as a client, as
+    an Nx2 ndarray, checking it is small enough and lies within an
+    image, so it can't make an arbitrarily large mask
+
+    :param outline: the outline, anything numpy can make an array of
+    :param max_points: the most points the outline may have
+    :param shape: the image shape, in the outline's order
+    :raises ValueError: If the outline is not Nx2 with 2 < N <=
+        max_points, or has a point outside the image
+    """
+    try:
+        outline = np.asarray(outline, dtype=np.float64)
+    except TypeError as error:
+        raise ValueError("outline should be an N x 2 array") from error
+    if outline.ndim != 2 or outline.shape[1] != 2 or \
+            not 3 <= outline.shape[0] <= max_points:
+        raise ValueError("outline should be an N x 2 array, 2 < N <= " +
+                         str(max_points))
+    if not np.all((outline >= 0) & (outline <= shape)):
+        raise ValueError("outline should lie within the image")
+    return outline
+
+
+class ContourGeometry:
+    """
+    The geometry of a closed outline: its centroid, bounds and a
+    boolean mask rasterised at one unit spacing, so that containment
+    checks are a single lookup.
+
+    :param outline: Nx2 ndarray, the vertices of the outline in order
+    :raises ValueError: If the outline is not Nx2 with N > 2, or has
+        points that are not finite
+    """
+
+    def __init__(self, outline):
+        outline = np.asarray(outline, dtype=np.float64)
+        if outline.ndim != 2 or outline.shape[1] != 2 or \
+                outline.shape[0] < 3:
+            raise ValueError("outline should be an N x 2 array, N > 2")
+        if not np.all(np.isfinite(outline)):
+            raise ValueError("outline points should be finite")
+
+        self.outline = outline
+        self.centre = np.mean(outline, 0)
+        self.minimum = np.min(outline, 0)
+        self.maximum = np.max(outline, 0)
+
+        #the mask covers whole units from below the minimum to above
+        #the maximum, with mask[i, j] for the point origin + (i, j)
+        self.origin = np.floor(self.minimum).astype(np.intp)
+        shape = np.ceil(self.maximum).astype(np.intp) - self.origin + 1
+        self.mask = rasterise_polygon(outline, self.origin, shape)
+        self._inside_indices = np.flatnonzero(self.mask)
+
+    @property
+    def area(self):
+        """The area of the outline, by counting mask points"""
+        return self._inside_indices.size
+
+    def contains(self, points):
+        """
+        Checks which points lie inside the outline, by looking up the
+        nearest point of the mask
+
+        :param points: ...x2 (or ...x3, ignoring the third column)
+            ndarray of points
+        :returns: ... boolean ndarray, True inside the outline
+        """
+        points = np.asarray(points, dtype=np.float64)
+        indices = np.rint(points[..., 0:2]).astype(np.intp) - self.origin
+        valid = np.all((indices >= 0) & (indices < self.mask.shape), axis=-1)
+        inside = np.zeros(valid.shape, dtype=bool)
+        inside[valid] = self.mask[indices[valid, 0], indices[valid, 1]]
+        return inside
+
+    def sample(self, number, random_generator=None):
+        """
+        Draws points uniformly from inside the outline, choosing mask
+        points at random, jittering them by up to half a unit and
+        rejecting any jittered outside the outline.
+
+        :param number: the number of points to draw
+        :param random_generator: a numpy Generator, defaults to None,
+            using numpy's global random state
+        :returns: number x 2 ndarray of points
+        :raises ValueError: If the outline has no inside mask points, or
+            too few points were drawn in MAX_SAMPLING_ROUNDS rounds
+        """
+        if self.area == 0:
+            raise ValueError("The outline contains no mask points")
+        random = np.random if random_generator is None else random_generator
+
+        samples = np.empty((0, 2), dtype=np.float64)
+        rounds = 0
+        while samples.shape[0] < number:
+            if rounds == MAX_SAMPLING_ROUNDS:
+                raise ValueError("Too few points drawn inside the outline")
+            rounds += 1
+            wanted = number - samples.shape[0]
+            if random_generator is None:
+                picks = random.randint(self.area, size=wanted)
+            else:
+                picks = random.integers(self.area, size=wanted)
+            candidates = np.stack(np.unravel_index(
+                self._inside_indices[picks], self.mask.shape),
+                                  axis=-1) + self.origin + \
+                            random.uniform(-0.5, 0.5, size=(wanted, 2))
+            samples = np.concatenate([samples, candidates[
+                points_in_polygon(candidates, self.outline)]])
+
+        return samples
+
+
+class TargetPool:
+    """
+    A pool of target points drawn from inside an outline, scaled about
+    its centre by edge_buffer to keep targets away from the edge. The
+    pool is filled in bulk, so most targets are a constant time pop.
+
+    :param geometry: the ContourGeometry of the outline
+    :param edge_buffer: the scale of the region targets are drawn from
+    :param pool_size: the number of targets to draw at once
+    :param random_generator: a numpy Generator, defaults to None, using
+        a new Generator with fresh entropy
+    """
+
+    def __init__(self, geometry, edge_buffer=0.9, pool_size=256,
+                 random_generator=None):
+        self.geometry = geometry
+        self.edge_buffer = edge_buffer
+        self.pool_size = pool_size
+        if random_generator is None:
+            random_generator = np.random.default_rng()
+        self.random_generator = random_generator
+        self.region = ContourGeometry(
+            geometry.centre + edge_buffer * (geometry.outline -
+                                             geometry.centre))
+        self._targets = []
+        self._lock = threading.Lock()
+
+    def _fill(self):
+        """
+        Draws pool_size new targets, inside both region and outline
+
+        :raises ValueError: If too few targets were drawn in
+            MAX_SAMPLING_ROUNDS rounds, as when the region barely
+            overlaps the outline
+        """
+        targets = np.empty((0, 2), dtype=np.float64)
+        rounds = 0
+        while targets.shape[0] < self.pool_size:
+            if rounds == MAX_SAMPLING_ROUNDS:
+                raise ValueError("Too few targets drawn inside the "
+                                 "outline and the region scaled by "
+                                 "edge_buffer")
+            rounds += 1
+            candidates = self.region.sample(self.pool_size,
+                                            self.random_generator)
+            targets = np.concatenate([targets, candidates[
+                points_in_polygon(candidates, self.geometry.outline)]])
+        self._targets = list(targets[0:self.pool_size])
+
+    def pop(self):
+        """
+        Returns a target point
+
+        :returns: 1x3 ndarray, with a zero third coordinate
+        :raises ValueError: If targets can't be drawn, see _fill
+        """
+        with self._lock:
+            if not self._targets:
+                self._fill()
+            target = self._targets.pop()
+        return np.array([[target[0], target[1], 0.0]])
+
+
+_GEOMETRY_CACHE = {}
+_TARGET_POOLS = {}
+_CACHE_LOCK = threading.Lock()
+_MAX_CACHED = 32
+
+
+def get_contour_geometry(outline):
+    """
+    Returns the ContourGeometry for an outline, computing it only the
+    first time the outline is seen. A ContourGeometry is returned as
+    it is, so callers holding one, such as the AnatomyRegistry, are
+    not cached twice.
+
+    :param outline: Nx2 ndarray, the vertices of the outline in order,
+        or its ContourGeometry
+    :returns: the ContourGeometry
+    """
+    if isinstance(outline, ContourGeometry):
+        return outline
+    key = contour_hash(outline)
+    with _CACHE_LOCK:
+        geometry = _GEOMETRY_CACHE.get(key)
+    if geometry is None:
+        geometry = ContourGeometry(outline)
+        with _CACHE_LOCK:
+            if len(_GEOMETRY_CACHE) >= _MAX_CACHED:
+                _GEOMETRY_CACHE.clear()
+            _GEOMETRY_CACHE[key] = geometry
+    return geometry
+
+
+def get_target_pool(outline, edge_buffer=0.9):
+    """
+    Returns the TargetPool for an outline and edge buffer, making it
+    only the first time they are seen
+
+    :param outline: Nx2 ndarray, the vertices of the outline in order
+    :param edge_buffer: the scale of the region targets are drawn from
+    :returns: the TargetPool
+    """
+    key = (contour_hash(outline), edge_buffer)
+    with _CACHE_LOCK:
+        pool = _TARGET_POOLS.get(key)
+    if pool is None:
+        pool = TargetPool(get_contour_geometry(outline), edge_buffer)
+        with _CACHE_LOCK:
+            if len(_TARGET_POOLS) >= _MAX_CACHED:
+                _TARGET_POOLS.clear()
+            _TARGET_POOLS[key] = pool
+    return pool
@@ -1,7 +1,8 @@
 #  -*- coding: utf-8 -*-
 
 """
-Functions for point based registration using Orthogonal Procrustes.
+Functions for registration errors: expected absolute values and
+expected target registration errors.
 """
 
 import numpy as np
@@ -16,3 +17,238 @@ def expected_absolute_value(std_devs):
     onedsd = np.linalg.norm(std_devs)
     variance = onedsd * onedsd
     return variance
+
+
+def compute_tre_from_moments(centroids, scatters, no_fids, mean_fle_squared,
+                             targets):
+    """
+    Computes Fitzpatrick's (1998) expected TRE squared (equation 46)
+    from the centroid and scatter matrix of the fiducials. The
+    principal axes are found once per scatter matrix, and all inputs
+    broadcast, so this works for many targets, stacks of fiducial
+    sets, or running totals.
+
+    :param centroids: ...x3 ndarray of fiducial centroids
+    :param scatters: ...x3x3 ndarray of the sum of the outer products
+        of the centred fiducials
+    :param no_fids: the number of fiducials
+    :param mean_fle_squared: expected (mean) FLE squared
+    :param targets: ...x3 ndarray of target points
+    :returns: ... ndarray of mean TRE squared
+    """
+    eigen_values, eigen_vectors = np.linalg.eigh(scatters)
+
+    #rms distance of the fiducials from each principal axis
+    f_k_squared = (np.sum(eigen_values, axis=-1)[..., np.newaxis] -
+                   eigen_values) / no_fids
+
+    #distance of the targets from each principal axis
+    offsets = np.asarray(targets, dtype=np.float64)[..., 0:3] - centroids
+    projections = np.einsum('...i,...ik->...k', offsets, eigen_vectors)
+    d_k_squared = np.sum(np.square(offsets), axis=-1)[..., np.newaxis] - \
+                    np.square(projections)
+
+    return (mean_fle_squared / no_fids) * \
+            (1 + (1./3.) * np.sum(d_k_squared / f_k_squared, axis=-1))
+
+
+#: The Levi-Civita symbol, so that the cross product matrix of x is
+#: -np.einsum('ijk,k->ij', LEVI_CIVITA, x)
+LEVI_CIVITA = np.zeros((3, 3, 3), dtype=np.float64)
+LEVI_CIVITA[0, 1, 2] = LEVI_CIVITA[1, 2, 0] = LEVI_CIVITA[2, 0, 1] = 1.0
+LEVI_CIVITA[0, 2, 1] = LEVI_CIVITA[2, 1, 0] = LEVI_CIVITA[1, 0, 2] = -1.0
+
+
+def fle_covariance(std_devs):
+    """
+    Returns the covariance matrix of independent normal FLE with
+    standard deviations std_devs along each axis. Its trace is
+    expected_absolute_value(std_devs).
+
+    :param std_devs: a single value or the 3 standard deviations
+    :returns: 3x3 ndarray
+    """
+    std_devs = np.broadcast_to(np.asarray(std_devs, dtype=np.float64), (3,))
+    return np.diag(np.square(std_devs))
+
+
+def _rotation_moments(scatters, fle_covariances):
+    """
+    Internal function giving the first order normal matrix of the
+    rotation and the covariance of its right hand side, for fiducials
+    with scatter matrix scatters and FLE covariance fle_covariances
+    """
+    traces = np.trace(scatters, axis1=-2, axis2=-1)
+    normals = traces[..., np.newaxis, np.newaxis] * np.eye(3) - scatters
+    #sum over fiducials of the cross product matrices either side of
+    #the FLE covariance, which depends only on the scatter matrix
+    rhs_covariances = np.einsum('bac,edf,...be,...cf->...ad',
+                                LEVI_CIVITA, LEVI_CIVITA,
+                                fle_covariances, scatters)
+    return normals, rhs_covariances
+
+
+def compute_tre_from_fle_covariance(centroids, scatters, no_fids,
+                                    fle_covariances, targets):
+    """
+    Computes the first order expected TRE squared for FLE with any
+    3x3 covariance, the same for every fiducial, following Danilchenko
+    and Fitzpatrick (2011). The rotation and translation are linearised
+    about the true registration, giving
+
+        TRE^2 = trace(X K X^T) + trace(C) / N
+
+    where C is the FLE covariance, X the cross product matrix of the
+    target relative to the centroid and K the covariance of the
+    rotation, M^-1 (sum X_i^T C X_i) M^-1 with M = trace(S) I - S.
+    For isotropic FLE this is Fitzpatrick's (1998) equation 46. FLE
+    on both images adds, so pass the sum of their covariances. All
+    inputs broadcast, as compute_tre_from_moments.
+
+    :param centroids: ...x3 ndarray of fiducial centroids
+    :param scatters: ...x3x3 ndarray of the sum of the outer products
+        of the centred fiducials
+    :param no_fids: the number of fiducials
+    :param fle_covariances: ...x3x3 ndarray of FLE covariance
+    :param targets: ...x3 ndarray of target points
+    :returns: ... ndarray of mean TRE squared
+    """
+    fle_covariances = np.asarray(fle_covariances, dtype=np.float64)
+    normals, rhs_covariances = _rotation_moments(scatters, fle_covariances)
+    inverse_normals = np.linalg.inv(normals)
+    rotation_covariances = np.matmul(np.matmul(inverse_normals,
+                                               rhs_covariances),
+                                     inverse_normals)
+
+    offsets = np.asarray(targets, dtype=np.float64)[..., 0:3] - centroids
+    cross_matrices = -np.einsum('ijk,...k->...ij', LEVI_CIVITA, offsets)
+    return np.einsum('...ij,...jk,...ik->...', cross_matrices,
+                     rotation_covariances, cross_matrices) + \
+                np.trace(fle_covariances, axis1=-2, axis2=-1) / no_fids
+
+
+def compute_fre_from_fle_covariance(scatters, no_fids, fle_covariances):
+    """
+    Computes the first order expected FRE squared for FLE with any
+    3x3 covariance, the same for every fiducial, as
+    compute_tre_from_fle_covariance. For isotropic FLE this is
+    Fitzpatrick's (1998) equation 10.
+
+    :param scatters: ...x3x3 ndarray of the sum of the outer products
+        of the centred fiducials
+    :param no_fids: the number of fiducials
+    :param fle_covariances: ...x3x3 ndarray of FLE covariance
+    :returns: ... ndarray of mean FRE squared
+    """
+    fle_covariances = np.asarray(fle_covariances, dtype=np.float64)
+    normals, rhs_covariances = _rotation_moments(scatters, fle_covariances)
+    #the residuals lose the 6 degrees of freedom of the registration
+    rotation_loss = np.trace(np.linalg.solve(normals, rhs_covariances),
+                             axis1=-2, axis2=-1)
+    return ((no_fids - 1) * np.trace(fle_covariances, axis1=-2, axis2=-1) -
+            rotation_loss) / no_fids
+
+
+def _validate_fiducials(fiducials):
+    """
+    Checks fiducials are an Nx3 ndarray with N > 2
+
+    :raises TypeError, ValueError: If they are not
+    """
+    if not isinstance(fiducials, np.ndarray):
+        raise TypeError("fiducials is not a numpy array")
+    if fiducials.ndim != 2 or fiducials.shape[1] != 3:
+        raise ValueError("fiducials should be an N x 3 array")
+    if fiducials.shape[0] < 3:
+        raise ValueError("fiducials should have at least 3 rows")
+
+
+def compute_tre_from_fle(fiducials, mean_fle_squared, target_points):
+    """
+    Computes Fitzpatrick's (1998) expected TRE squared (equation 46)
+    for many targets, finding the fiducials' principal axes only once.
+    Unlike sksurgerycore's version, which uses the rows of the
+    eigenvector matrix, this uses its columns as the principal axes,
+    so agrees with equation 46 for any fiducial layout.
+
+    :param fiducials: Nx3 ndarray of fiducial points
+    :param mean_fle_squared: expected (mean) FLE squared
+    :param target_points: Mx3 ndarray of target points
+    :returns: length M ndarray of mean TRE squared
+    :raises TypeError, ValueError: If the inputs are invalid
+    """
+    _validate_fiducials(fiducials)
+    if not isinstance(target_points, np.ndarray):
+        raise TypeError("target_points is not a numpy array")
+    if target_points.ndim != 2 or target_points.shape[1] != 3:
+        raise ValueError("target_points should be an M x 3 array")
+
+    centroid = np.mean(fiducials, axis=0)
+    centred = fiducials - centroid
+    return compute_tre_from_moments(centroid,
+                                    np.matmul(centred.transpose(), centred),
+                                    fiducials.shape[0], mean_fle_squared,
+                                    target_points)
+
+
+def compute_fre_from_fle(fiducials, mean_fle_squared):
+    """
+    Computes Fitzpatrick's (1998) expected FRE squared (equation 10)
+
+    :param fiducials: Nx3 ndarray of fiducial points
+    :param mean_fle_squared: expected (mean) FLE squared
+    :returns: mean FRE squared
+    :raises TypeError, ValueError: If the fiducials are invalid
+    """
+    _validate_fiducials(fiducials)
+    return (1 - (2.0 / fiducials.shape[0])) * mean_fle_squared
+
+
+def compute_tre_map(fiducials, mean_fle_squared, shape=(512, 512),
+                    stride=1, fle_cov=None):
+    """
+    Computes the expected TRE squared over an image, in the plane z = 0.
+
+    :param fiducials: Nx3 ndarray of fiducial points, x, y, z
+    :param mean_fle_squared: expected (mean) FLE squared
+    :param shape: the image shape, rows (y) then columns (x)
+    :param stride: the spacing of the pixels to evaluate
+    :param fle_cov: 3x3 covariance of anisotropic FLE, used
+        instead of mean_fle_squared if given, defaults to None
+    :returns: ndarray of mean TRE squared, element [i, j] for the point
+        x = j * stride, y = i * stride
+    :raises ValueError: If there are fewer than 3 fiducials
+    """
+    fiducials = np.asarray(fiducials, dtype=np.float64)
+    _validate_fiducials(fiducials)
+
+    y_ords, x_ords = np.meshgrid(np.arange(0, shape[0], stride),
+                                 np.arange(0, shape[1], stride),
+                                 indexing='ij')
+    targets = np.stack([x_ords.ravel(), y_ords.ravel(),
+                        np.zeros(x_ords.size)], axis=-1)
+
+    if fle_cov is None:
+        return compute_tre_from_fle(fiducials, mean_fle_squared,
+                                    targets).reshape(x_ords.shape)
+    centroid = np.mean(fiducials, axis=0)
+    centred = fiducials - centroid
+    return compute_tre_from_fle_covariance(
+        centroid, np.matmul(centred.transpose(), centred),
+        fiducials.shape[0], fle_cov, targets).reshape(x_ords.shape)
+
+
+def quantise(values, levels=255):
+    """
+    Quantises non negative values to unsigned 8 bit integers
+
+    :param values: ndarray of non negative values
+    :param levels: the number of levels above zero, at most 255
+    :returns: uint8 ndarray and the scale, so that values are
+        approximately quantised * scale
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scale = float(np.max(values)) / levels if values.size > 0 else 0.0
+    if scale <= 0.0:
+        return np.zeros(values.shape, dtype=np.uint8), 0.0
+    return np.rint(values / scale).astype(np.uint8), scale
@@ -23,6 +23,19 @@ def _set_fle(fle, dims):
     assert fle_array.size == dims
     return fle_array
 
+def _make_generator(random_generator):
+    """
+    Internal function to make a numpy Generator and the SeedSequence
+    it was seeded from, which is None if we were given a Generator
+    """
+    if isinstance(random_generator, np.random.Generator):
+        return random_generator, None
+    if isinstance(random_generator, np.random.SeedSequence):
+        seed_sequence = random_generator
+    else:
+        seed_sequence = np.random.SeedSequence(random_generator)
+    return np.random.default_rng(seed_sequence), seed_sequence
+
 class FLE:
     """
     Provides methods to add Fiducial Localisation Error to a point
@@ -42,6 +55,11 @@ class FLE:
     :param sys_fle_function: the function to use for sampling the independent
         fle. Defaults to numpy.add
     :param dimension: the dimensions to use, defaults to 3.
+    :param random_generator: a numpy.random.Generator, SeedSequence or
+        integer seed to sample the default ind_fle_function from.
+        Defaults to None, which uses numpy's global random state. A
+        generator of its own makes each FLE reproducible and
+        independent of other threads.
 
     :raises ValueError: If independent_fle is not single value or array of
         length dimension.
@@ -51,14 +69,28 @@ class FLE:
     """
 
     def __init__(self, independent_fle=None, ind_fle_function=None,
-                 systematic_fle=None, sys_fle_function=None, dimension=3):
+                 systematic_fle=None, sys_fle_function=None, dimension=3,
+                 random_generator=None):
+
+        self.dimension = dimension
+        self.independent_fle = None
+        self.systematic_fle = None
+        self.random_generator = None
+        self.seed_sequence = None
+        normal = np.random.normal
+        if random_generator is not None:
+            self.random_generator, self.seed_sequence = _make_generator(
+                random_generator)
+            normal = self.random_generator.normal
+        self._normal = normal
 
         if ind_fle_function is None:
             if independent_fle is None:
                 independent_fle = 0.0
             ind_fle = _set_fle(independent_fle, dimension)
+            self.independent_fle = ind_fle
             def ind_fle_function():
-                return np.random.normal(loc=0.0, scale=ind_fle, size=dimension)
+                return normal(loc=0.0, scale=ind_fle, size=dimension)
         else:
             if independent_fle is not None:
                 raise ValueError("Set independent_fle and ind_fle_function, ",
@@ -75,6 +107,7 @@ class FLE:
             if systematic_fle is None:
                 systematic_fle = 0.0
             sys_fle = _set_fle(systematic_fle, dimension)
+            self.systematic_fle = sys_fle
             def sys_fle_function():
                 return sys_fle
         else:
@@ -98,3 +131,67 @@ class FLE:
         """
         return fiducial_marker + self.sys_fle_function() + \
                         self.ind_fle_function()
+
+    def perturb_fiducials(self, fiducial_markers):
+        """
+        Adds the FLE to many marker positions at once. When using the
+        default error functions the errors for all markers are drawn
+        in a single call, otherwise the error functions are called
+        once per marker.
+
+        :param fiducial_markers: the true positions of the markers, an
+            ... x dimension array, e.g. N x 3 or B x N x 3
+        :returns: The perturbed positions of the markers
+        :raises ValueError: If the last axis of fiducial_markers is not
+            the FLE's dimension
+        """
+        markers = np.asarray(fiducial_markers, dtype=np.float64)
+        if markers.ndim < 1 or markers.shape[-1] != self.dimension:
+            raise ValueError("Last axis of fiducial_markers must be of ",
+                             "length ", self.dimension)
+        no_markers = markers.size // self.dimension
+
+        if self.systematic_fle is not None:
+            sys_errors = self.systematic_fle
+        else:
+            sys_errors = np.reshape([self.sys_fle_function()
+                                     for _ in range(no_markers)],
+                                    markers.shape)
+
+        if self.independent_fle is not None:
+            ind_errors = self._normal(loc=0.0, scale=self.independent_fle,
+                                      size=markers.shape)
+        else:
+            ind_errors = np.reshape([self.ind_fle_function()
+                                     for _ in range(no_markers)],
+                                    markers.shape)
+
+        return markers + sys_errors + ind_errors
+
+    def spawn(self, number):
+        """
+        Makes copies of this FLE, each with an independent random
+        generator spawned from this FLE's seed sequence, for use in
+        parallel workers or batches. Copies spawned from the same seed
+        produce the same errors.
+
+        :param number: the number of copies to make
+        :returns: a list of FLE
+        :raises ValueError: If this FLE uses custom error functions
+        """
+        if self.independent_fle is None or self.systematic_fle is None:
+            raise ValueError("Can't spawn an FLE with custom error functions")
+
+        if self.seed_sequence is not None:
+            children = self.seed_sequence.spawn(number)
+        else:
+            if self.random_generator is not None:
+                entropy = self.random_generator.integers(2**63)
+            else:
+                entropy = np.random.randint(2**31)
+            children = np.random.SeedSequence(int(entropy)).spawn(number)
+
+        return [FLE(independent_fle=self.independent_fle,
+                    systematic_fle=self.systematic_fle,
+                    dimension=self.dimension, random_generator=child)
+                for child in children]
@@ -2,31 +2,49 @@
 calibration and tracking
 """
 
-import math
 import numpy as np
 
-def is_valid_fiducial(fiducial_location):
+from sksurgeryfred.algorithms.contour import get_target_pool, \
+                get_contour_geometry
+
+def is_valid_fiducial(fiducial_location, outline=None):
     """
     Checks the x, y, and z location of a fiducial
+    :param outline: the anatomy outline, (row, column) ordered
+        as static/brain512.npy, or its ContourGeometry. If given,
+        the fiducial must lie inside it.
     :returns: true if a valid fiducial
     """
     #no negatives allowed
-    if np.all(np.array(fiducial_location) >= 0):
+    if not np.all(np.array(fiducial_location) >= 0):
+        return False
+    if outline is None:
         return True
-    return False
+    return bool(are_valid_fiducials([fiducial_location], outline)[0])
+
+def are_valid_fiducials(fiducial_locations, outline):
+    """
+    Checks many fiducial locations at once against the anatomy
+    outline, using the outline's rasterised mask
+    :param fiducial_locations: ...x3 array of x, y, z locations
+    :param outline: the anatomy outline, (row, column) ordered
+        as static/brain512.npy, or its ContourGeometry
+    :returns: ... boolean array, true for valid fiducials
+    """
+    locations = np.asarray(fiducial_locations, dtype=np.float64)
+    geometry = get_contour_geometry(outline)
+    #the outline is row (y) first, fiducials are x first
+    return np.all(locations >= 0, axis=-1) & \
+                    geometry.contains(locations[..., 1::-1])
 
 def make_target_point(outline, edge_buffer=0.9):
     """
     returns a target point, that should lie
-    within the outline.
+    within the outline. Targets are drawn uniformly from
+    the outline, scaled about its centre by edge_buffer,
+    from a pool kept for each outline.
+
+    :raises ValueError: If the outline is invalid or targets
+        can't be drawn from it
     """
-    #let's assume the anatomy is a circle with
-    #centre, and radius
-    centre = np.mean(outline, 0)
-    max_radius = np.min((np.max(outline, 0) - np.min(outline, 0))/2)*edge_buffer
-    radius = np.random.uniform(low=0.0, high=max_radius)
-    radius = np.random.uniform(low=0.0, high=max_radius)
-    angle = np.random.uniform(low=0.0, high=math.pi*2.0)
-    x_ord = radius * math.cos(angle) + centre[0]
-    y_ord = radius * math.sin(angle) + centre[1]
-    return np.array([[x_ord, y_ord, 0.0]])
+    return get_target_pool(outline, edge_buffer).pop()
@@ -0,0 +1,132 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Fiducial placement planning: suggests where to put the next fiducial
+to most reduce the expected target registration error.
+"""
+
+import numpy as np
+
+from sksurgeryfred.algorithms.contour import get_contour_geometry
+from sksurgeryfred.algorithms.errors import compute_tre_from_moments, \
+                compute_tre_from_fle_covariance
+
+
+def candidate_grid(outline, stride=8):
+    """
+    Returns candidate fiducial positions on a regular grid inside
+    the anatomy outline
+
+    :param outline: the anatomy outline, (row, column) ordered
+        as static/brain512.npy, or its ContourGeometry
+    :param stride: the grid spacing
+    :returns: Kx3 ndarray of x, y, z candidate positions, z = 0
+    :raises ValueError: If stride is less than 1
+    """
+    if stride < 1:
+        raise ValueError("stride should be at least 1")
+    geometry = get_contour_geometry(outline)
+    rows, columns = np.nonzero(geometry.mask[::stride, ::stride])
+    #the outline is row (y) first, fiducials are x first
+    candidates = np.stack([columns * stride + geometry.origin[1],
+                           rows * stride + geometry.origin[0],
+                           np.zeros(rows.shape)], axis=-1).astype(np.float64)
+    return candidates[np.all(candidates >= 0, axis=-1)]
+
+
+def expected_tre_with_candidates(centroid, scatter, no_fids,
+                                 mean_fle_squared, target, candidates,
+                                 fle_cov=None):
+    """
+    Computes the expected TRE squared after adding each candidate to
+    a set of fiducials, from a rank one update of the fiducials'
+    centroid and scatter matrix, for all candidates at once.
+
+    :param centroid: the centroid of the current fiducials
+    :param scatter: 3x3 sum of the outer products of the centred
+        current fiducials
+    :param no_fids: the number of current fiducials
+    :param mean_fle_squared: expected (mean) FLE squared
+    :param target: the target point
+    :param candidates: Kx3 ndarray of candidate fiducial positions
+    :param fle_cov: 3x3 covariance of anisotropic FLE, used
+        instead of mean_fle_squared if given, defaults to None
+    :returns: length K ndarray of mean TRE squared, infinite where
+        the fiducials would not define a registration
+    """
+    offsets = np.asarray(candidates, dtype=np.float64) - centroid
+    new_centroids = centroid + offsets / (no_fids + 1)
+    new_scatters = scatter + (no_fids / (no_fids + 1)) * \
+                    np.einsum('ki,kj->kij', offsets, offsets)
+
+    target = np.asarray(target, dtype=np.float64).reshape(3)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tre_squared = compute_tre_from_moments(
+            new_centroids, new_scatters, no_fids + 1, mean_fle_squared,
+            target)
+    valid = np.isfinite(tre_squared)
+    if fle_cov is not None:
+        #only where the fiducials define a registration, as the
+        #anisotropic formula inverts a matrix that is singular otherwise
+        tre_squared[valid] = compute_tre_from_fle_covariance(
+            new_centroids[valid], new_scatters[valid], no_fids + 1,
+            fle_cov, target)
+    return np.where(valid, tre_squared, np.inf)
+
+
+def suggest_fiducials(fiducials, target, mean_fle_squared, candidates,
+                      number=1, fle_cov=None):
+    """
+    Greedily suggests fiducial positions, each the candidate giving
+    the lowest expected TRE when added to the fiducials and the
+    suggestions before it.
+
+    :param fiducials: Nx3 ndarray of the fiducials placed so far,
+        N > 1
+    :param target: the target point
+    :param mean_fle_squared: expected (mean) FLE squared
+    :param candidates: Kx3 ndarray of candidate fiducial positions
+    :param number: the number of fiducials to suggest
+    :param fle_cov: 3x3 covariance of anisotropic FLE, used
+        instead of mean_fle_squared if given, defaults to None
+    :returns: number x 3 ndarray of suggested positions and the
+        expected TRE squared after adding each
+    :raises ValueError: If there are fewer than 2 fiducials, no
+        candidates, or no candidate gives a registration
+    """
+    fiducials = np.asarray(fiducials, dtype=np.float64)
+    candidates = np.asarray(candidates, dtype=np.float64)
+    if fiducials.ndim != 2 or fiducials.shape[1] != 3:
+        raise ValueError("fiducials should be an N x 3 array")
+    if fiducials.shape[0] < 2:
+        raise ValueError("At least 2 fiducials are needed to suggest more")
+    if candidates.ndim != 2 or candidates.shape[1] != 3 or \
+            candidates.shape[0] < 1:
+        raise ValueError("candidates should be a K x 3 array, K > 0")
+
+    no_fids = fiducials.shape[0]
+    centroid = np.mean(fiducials, axis=0)
+    centred = fiducials - centroid
+    scatter = np.matmul(centred.transpose(), centred)
+
+    suggestions = np.zeros((number, 3), dtype=np.float64)
+    tre_squared = np.zeros(number, dtype=np.float64)
+    for index in range(number):
+        candidate_tre_sq = expected_tre_with_candidates(
+            centroid, scatter, no_fids, mean_fle_squared, target, candidates,
+            fle_cov)
+        best = int(np.argmin(candidate_tre_sq))
+        if not np.isfinite(candidate_tre_sq[best]):
+            raise ValueError("No candidate gives a valid registration")
+
+        suggestions[index] = candidates[best]
+        tre_squared[index] = candidate_tre_sq[best]
+
+        #the same rank one update, for the chosen candidate
+        offset = candidates[best] - centroid
+        scatter = scatter + (no_fids / (no_fids + 1)) * \
+                        np.outer(offset, offset)
+        centroid = centroid + offset / (no_fids + 1)
+        no_fids += 1
+
+    return suggestions, tre_squared
@@ -5,8 +5,71 @@ calibration and tracking
 import numpy as np
 
 from sksurgerycore.algorithms.procrustes import orthogonal_procrustes
-from sksurgerycore.algorithms.errors import compute_tre_from_fle, \
-                compute_fre_from_fle
+from sksurgeryfred.algorithms.errors import compute_tre_from_moments, \
+                compute_tre_from_fle, compute_fre_from_fle, \
+                compute_tre_from_fle_covariance, \
+                compute_fre_from_fle_covariance
+from sksurgeryfred.algorithms.procrustes import \
+                batch_orthogonal_procrustes, validate_batch_inputs, \
+                rotations_from_covariances, is_planar, planar_procrustes, \
+                planar_rotations, get_rotation_solver, default_solver
+
+#: The fields returned by PointBasedRegistration.register_batch, one
+#: record per registration, in the same order as register's list.
+BATCH_RESULT_DTYPE = np.dtype([
+    ('success', np.bool_),
+    ('fre', np.float64),
+    ('mean_fle_squared', np.float64),
+    ('expected_tre_squared', np.float64),
+    ('expected_fre_squared', np.float64),
+    ('transformed_target', np.float64, (3,)),
+    ('actual_tre', np.float64),
+    ('no_fids', np.int64)])
+
+
+def combine_fle(fixed_fle_esv, moving_fle_esv, fixed_fle_covariance=None,
+                moving_fle_covariance=None):
+    """
+    Combines the fixed and moving image FLE, which add for the
+    registration. An image's covariance is used if given, otherwise
+    its FLE is isotropic with expected squared value fle_esv.
+
+    :returns: the mean FLE squared and the combined 3x3 covariance, or
+        None for the covariance if the FLE is isotropic, when
+        Fitzpatrick's (1998) formulae apply
+    """
+    if fixed_fle_covariance is None and moving_fle_covariance is None:
+        return fixed_fle_esv + moving_fle_esv, None
+
+    if fixed_fle_covariance is None:
+        fixed_fle_covariance = np.eye(3) * fixed_fle_esv / 3.0
+    if moving_fle_covariance is None:
+        moving_fle_covariance = np.eye(3) * moving_fle_esv / 3.0
+    covariance = np.asarray(fixed_fle_covariance, dtype=np.float64) + \
+                    np.asarray(moving_fle_covariance, dtype=np.float64)
+    if covariance.shape != (3, 3):
+        raise ValueError("FLE covariances should be 3 x 3")
+
+    mean_fle_squared = float(np.trace(covariance))
+    if np.allclose(covariance, np.eye(3) * mean_fle_squared / 3.0):
+        return mean_fle_squared, None
+    return mean_fle_squared, covariance
+
+
+def _expected_errors_squared(centroids, scatters, no_fids, mean_fle_squared,
+                             fle_covariance, target):
+    """
+    Internal function giving the expected TRE and FRE squared from the
+    moving fiducials' centroids and scatter matrices
+    """
+    if fle_covariance is None:
+        return (compute_tre_from_moments(centroids, scatters, no_fids,
+                                         mean_fle_squared, target),
+                (1 - (2.0 / no_fids)) * mean_fle_squared)
+    return (compute_tre_from_fle_covariance(centroids, scatters, no_fids,
+                                            fle_covariance, target),
+            compute_fre_from_fle_covariance(scatters, no_fids,
+                                            fle_covariance))
 
 
 class PointBasedRegistration:
@@ -14,32 +77,61 @@ class PointBasedRegistration:
     Does the registration and assoctiated measures
     """
 
-    def __init__(self, target, fixed_fle_esv, moving_fle_esv):
+    def __init__(self, target, fixed_fle_esv, moving_fle_esv,
+                 fixed_fle_covariance=None, moving_fle_covariance=None,
+                 solver=None):
         """
         :params target: 1x3 target point
         :params fixed_fle_esv: the expected squared value of the fixed image fle
         :params moving_fle_esv: the expected squared value of the moving
             image fle
+        :params fixed_fle_covariance: 3x3 covariance of anisotropic
+            fixed image fle, used instead of fixed_fle_esv if given
+        :params moving_fle_covariance: 3x3 covariance of anisotropic
+            moving image fle, used instead of moving_fle_esv if given
+        :params solver: the name of the rotation solver to use, a key of
+            procrustes.ROTATION_SOLVERS. Defaults to None, using the
+            planar solver when every z is 0, otherwise sksurgerycore's
+            SVD for single registrations and procrustes.default_solver's
+            choice for the batch size for batches.
+        :raises ValueError: If there is no solver called solver
         """
-        if not moving_fle_esv == 0.0:
-            raise NotImplementedError("Currently we only support zero" +
-                                      "fle on moving image ")
-
+        if solver is not None:
+            get_rotation_solver(solver)
+        self.solver = solver
         self.target = None
         self.fixed_fle_esv = None
         self.moving_fle_esv = None
+        self.mean_fle_squared = None
+        self.fle_covariance = None
         self.transformed_target = None
-        self.reinit(target, fixed_fle_esv, moving_fle_esv)
+        self.reinit(target, fixed_fle_esv, moving_fle_esv,
+                    fixed_fle_covariance, moving_fle_covariance)
 
-    def reinit(self, target, fixed_fle_esv, moving_fle_esv):
+    def reinit(self, target, fixed_fle_esv, moving_fle_esv,
+               fixed_fle_covariance=None, moving_fle_covariance=None):
         """
         reinitiatilses the target and errors
         """
         self.target = target
         self.fixed_fle_esv = fixed_fle_esv
         self.moving_fle_esv = moving_fle_esv
+        self.mean_fle_squared, self.fle_covariance = combine_fle(
+            fixed_fle_esv, moving_fle_esv, fixed_fle_covariance,
+            moving_fle_covariance)
         self.transformed_target = None
 
+    @staticmethod
+    def _default_solver(fixed_points, moving_points, batch_size):
+        """
+        Returns the planar solver if every z is 0, as for fiducials
+        placed on the image, otherwise procrustes.default_solver's
+        choice for the batch size
+        """
+        if is_planar(fixed_points, moving_points):
+            return 'planar'
+        return default_solver(batch_size)
+
     def register(self, fixed_points, moving_points):
         """
         Does the registration
@@ -53,12 +145,38 @@ class PointBasedRegistration:
         no_fids = fixed_points.shape[0]
 
         if no_fids > 2:
-            rotation, translation, fre = orthogonal_procrustes(
-                fixed_points, moving_points)
-            expected_tre_squared = compute_tre_from_fle(
-                moving_points[:, 0:3], self.fixed_fle_esv, self.target[:, 0:3])
-            expected_fre_sq = compute_fre_from_fle(moving_points[:, 0:3],
-                                                   self.fixed_fle_esv)
+            solver = self.solver
+            if solver is None:
+                solver = self._default_solver(fixed_points, moving_points,
+                                              1)
+            if solver == 'svd':
+                rotation, translation, fre = orthogonal_procrustes(
+                    fixed_points, moving_points)
+            elif solver == 'planar':
+                rotation, translation, fre = planar_procrustes(
+                    fixed_points, moving_points)
+            else:
+                rotations, translations, fres = batch_orthogonal_procrustes(
+                    fixed_points[np.newaxis], moving_points[np.newaxis],
+                    solver)
+                rotation, translation, fre = \
+                                rotations[0], translations[0], fres[0]
+            if self.fle_covariance is None:
+                expected_tre_squared = float(compute_tre_from_fle(
+                    moving_points[:, 0:3], self.mean_fle_squared,
+                    self.target[:, 0:3])[0])
+                expected_fre_sq = compute_fre_from_fle(
+                    moving_points[:, 0:3], self.mean_fle_squared)
+            else:
+                centroid = np.mean(moving_points[:, 0:3], axis=0)
+                centred = moving_points[:, 0:3] - centroid
+                expected_tre_squared, expected_fre_sq = \
+                        _expected_errors_squared(
+                            centroid, np.matmul(centred.transpose(), centred),
+                            no_fids, self.mean_fle_squared,
+                            self.fle_covariance, self.target[0])
+                expected_tre_squared = float(expected_tre_squared)
+                expected_fre_sq = float(expected_fre_sq)
 
             self.transformed_target = np.matmul(rotation,
                                                 self.target.transpose()) + \
@@ -68,10 +186,313 @@ class PointBasedRegistration:
             success = True
 
 
-        return [success, fre, self.fixed_fle_esv, expected_tre_squared,
+        return [success, fre, self.mean_fle_squared, expected_tre_squared,
                 expected_fre_sq, self.transformed_target[:, 0:3], actual_tre,
                 no_fids]
 
+    def register_batch(self, fixed_points, moving_points):
+        """
+        Does the registration for a stack of fiducial sets at once,
+        giving the same measures as register for each.
+
+        :param fixed_points: BxNx3 ndarray of fixed fiducial sets
+        :param moving_points: BxNx3 ndarray of corresponding moving sets
+        :returns: a length B structured array of BATCH_RESULT_DTYPE
+        :raises TypeError, ValueError: If the inputs are invalid
+        """
+        validate_batch_inputs(fixed_points, moving_points)
+        batch_size, no_fids, _ = fixed_points.shape
+
+        results = np.zeros(batch_size, dtype=BATCH_RESULT_DTYPE)
+        results['mean_fle_squared'] = self.mean_fle_squared
+        results['no_fids'] = no_fids
+
+        if no_fids > 2:
+            solver = self.solver
+            if solver is None:
+                solver = self._default_solver(fixed_points, moving_points,
+                                              batch_size)
+            rotations, translations, fres = batch_orthogonal_procrustes(
+                fixed_points, moving_points, solver)
+
+            transformed_targets = np.einsum(
+                'bij,j->bi', rotations, self.target[0, 0:3]) + \
+                            translations[:, :, 0]
+
+            results['success'] = True
+            results['fre'] = fres
+            centroids = np.mean(moving_points, axis=1)
+            centred = moving_points - centroids[:, np.newaxis, :]
+            results['expected_tre_squared'], \
+                    results['expected_fre_squared'] = \
+                    _expected_errors_squared(
+                        centroids, np.einsum('bni,bnj->bij', centred,
+                                             centred),
+                        no_fids, self.mean_fle_squared, self.fle_covariance,
+                        self.target[0])
+            results['transformed_target'] = transformed_targets
+            results['actual_tre'] = np.linalg.norm(
+                transformed_targets - self.target[:, 0:3], axis=1)
+
+        return results
+
+    def leave_one_out(self, fixed_points, moving_points):
+        """
+        Does the registration with each fiducial left out in turn,
+        to show each fiducial's influence. The centroids and co-moment
+        matrices are found once for all fiducials, then downdated to
+        remove each fiducial, so only the N rotations are solved.
+
+        :param fixed_points: Nx3 ndarray of fixed fiducials
+        :param moving_points: Nx3 ndarray of corresponding moving fiducials
+        :returns: a length N structured array of BATCH_RESULT_DTYPE,
+            element k for the registration without fiducial k
+        :raises TypeError, ValueError: If the inputs are invalid
+        """
+        if not isinstance(fixed_points, np.ndarray) or \
+                not isinstance(moving_points, np.ndarray):
+            raise TypeError("fixed and moving points should be numpy arrays")
+        validate_batch_inputs(fixed_points[np.newaxis],
+                              moving_points[np.newaxis])
+        no_fids = fixed_points.shape[0]
+        no_left = no_fids - 1
+
+        results = np.zeros(no_fids, dtype=BATCH_RESULT_DTYPE)
+        results['mean_fle_squared'] = self.mean_fle_squared
+        results['no_fids'] = no_left
+
+        if no_left > 2:
+            fixed_centroid = np.mean(fixed_points, axis=0)
+            moving_centroid = np.mean(moving_points, axis=0)
+            fixed_centred = fixed_points - fixed_centroid
+            moving_centred = moving_points - moving_centroid
+
+            #removing point k changes the co-moments by
+            #n / (n - 1) times its outer product about the centroids
+            weight = no_fids / no_left
+            cross_covariances = np.matmul(moving_centred.transpose(),
+                                          fixed_centred) - weight * \
+                    np.einsum('ki,kj->kij', moving_centred, fixed_centred)
+            moving_scatters = np.matmul(moving_centred.transpose(),
+                                        moving_centred) - weight * \
+                    np.einsum('ki,kj->kij', moving_centred, moving_centred)
+            fixed_sum_squares = np.sum(np.square(fixed_centred)) - \
+                    weight * np.sum(np.square(fixed_centred), axis=1)
+
+            fixed_centroids = fixed_centroid - fixed_centred / no_left
+            moving_centroids = moving_centroid - moving_centred / no_left
+
+            solver = self.solver
+            if solver is None:
+                solver = self._default_solver(fixed_points, moving_points,
+                                              no_fids)
+            rotations = get_rotation_solver(solver)(cross_covariances)
+            translations = fixed_centroids - np.einsum(
+                'kij,kj->ki', rotations, moving_centroids)
+
+            sum_squared_errors = fixed_sum_squares + \
+                    np.trace(moving_scatters, axis1=1, axis2=2) - 2.0 * \
+                    np.einsum('kij,kji->k', rotations, cross_covariances)
+
+            transformed_targets = np.einsum(
+                'kij,j->ki', rotations, self.target[0, 0:3]) + translations
+
+            results['success'] = True
+            results['fre'] = np.sqrt(np.maximum(sum_squared_errors, 0.0) /
+                                     no_left)
+            results['expected_tre_squared'], \
+                    results['expected_fre_squared'] = \
+                    _expected_errors_squared(
+                        moving_centroids, moving_scatters, no_left,
+                        self.mean_fle_squared, self.fle_covariance,
+                        self.target[0])
+            results['transformed_target'] = transformed_targets
+            results['actual_tre'] = np.linalg.norm(
+                transformed_targets - self.target[:, 0:3], axis=1)
+
+        return results
+
+    def get_transformed_target(self):
+        """
+        Returns transformed target and status
+        """
+        if self.transformed_target is not None:
+            return True, self.transformed_target[:, 0:3]
+
+        return False, None
+
+
+class IncrementalRegistration: #pylint: disable=too-many-instance-attributes
+    """
+    Does the registration and associated measures for a set of
+    fiducials that grows or shrinks one fiducial at a time. Running
+    centroids and co-moment matrices are updated on each change, so
+    adding or removing a fiducial and re-registering take the same
+    time however many fiducials have been placed. While every
+    fiducial has z = 0 the rotation is solved in the plane.
+    """
+
+    def __init__(self, target, fixed_fle_esv, moving_fle_esv,
+                 fixed_fle_covariance=None, moving_fle_covariance=None):
+        """
+        :params target: 1x3 target point
+        :params fixed_fle_esv: the expected squared value of the fixed image fle
+        :params moving_fle_esv: the expected squared value of the moving
+            image fle
+        :params fixed_fle_covariance: 3x3 covariance of anisotropic
+            fixed image fle, used instead of fixed_fle_esv if given
+        :params moving_fle_covariance: 3x3 covariance of anisotropic
+            moving image fle, used instead of moving_fle_esv if given
+        """
+        self.target = None
+        self.fixed_fle_esv = None
+        self.moving_fle_esv = None
+        self.mean_fle_squared = None
+        self.fle_covariance = None
+        self.transformed_target = None
+        self.no_fids = 0
+        self.fixed_centroid = None
+        self.moving_centroid = None
+        self.moving_scatter = None
+        self.cross_covariance = None
+        self.fixed_sum_squares = 0.0
+        self.non_planar_fids = 0
+        self.reinit(target, fixed_fle_esv, moving_fle_esv,
+                    fixed_fle_covariance, moving_fle_covariance)
+        self.clear()
+
+    def reinit(self, target, fixed_fle_esv, moving_fle_esv,
+               fixed_fle_covariance=None, moving_fle_covariance=None):
+        """
+        reinitiatilses the target and errors, keeping the fiducials
+        """
+        self.target = target
+        self.fixed_fle_esv = fixed_fle_esv
+        self.moving_fle_esv = moving_fle_esv
+        self.mean_fle_squared, self.fle_covariance = combine_fle(
+            fixed_fle_esv, moving_fle_esv, fixed_fle_covariance,
+            moving_fle_covariance)
+        self.transformed_target = None
+
+    def clear(self):
+        """
+        Removes all fiducials
+        """
+        self.no_fids = 0
+        self.fixed_centroid = np.zeros(3, dtype=np.float64)
+        self.moving_centroid = np.zeros(3, dtype=np.float64)
+        self.moving_scatter = np.zeros((3, 3), dtype=np.float64)
+        self.cross_covariance = np.zeros((3, 3), dtype=np.float64)
+        self.fixed_sum_squares = 0.0
+        self.non_planar_fids = 0
+        self.transformed_target = None
+
+    def add_fiducial(self, fixed_point, moving_point):
+        """
+        Adds a fiducial pair, updating the running totals
+
+        :param fixed_point: the fiducial position in the fixed image
+        :param moving_point: the fiducial position in the moving image
+        """
+        fixed_point = np.asarray(fixed_point, dtype=np.float64).reshape(3)
+        moving_point = np.asarray(moving_point, dtype=np.float64).reshape(3)
+
+        self.no_fids += 1
+        if not is_planar(fixed_point, moving_point):
+            self.non_planar_fids += 1
+        moving_delta = moving_point - self.moving_centroid
+        fixed_delta = fixed_point - self.fixed_centroid
+        self.moving_centroid = self.moving_centroid + \
+                        moving_delta / self.no_fids
+        self.fixed_centroid = self.fixed_centroid + \
+                        fixed_delta / self.no_fids
+
+        #Welford's update, using the old and new means
+        self.moving_scatter += np.outer(moving_delta,
+                                        moving_point - self.moving_centroid)
+        self.cross_covariance += np.outer(moving_delta,
+                                          fixed_point - self.fixed_centroid)
+        self.fixed_sum_squares += np.dot(fixed_delta,
+                                         fixed_point - self.fixed_centroid)
+
+    def remove_fiducial(self, fixed_point, moving_point):
+        """
+        Removes a previously added fiducial pair, reversing the updates
+        made by add_fiducial
+
+        :param fixed_point: the fiducial position in the fixed image
+        :param moving_point: the fiducial position in the moving image
+        :raises ValueError: If there are no fiducials to remove
+        """
+        if self.no_fids < 1:
+            raise ValueError("There are no fiducials to remove")
+        if self.no_fids == 1:
+            self.clear()
+            return
+
+        fixed_point = np.asarray(fixed_point, dtype=np.float64).reshape(3)
+        moving_point = np.asarray(moving_point, dtype=np.float64).reshape(3)
+
+        self.no_fids -= 1
+        if not is_planar(fixed_point, moving_point):
+            self.non_planar_fids -= 1
+        moving_centroid = (self.moving_centroid * (self.no_fids + 1) -
+                           moving_point) / self.no_fids
+        fixed_centroid = (self.fixed_centroid * (self.no_fids + 1) -
+                          fixed_point) / self.no_fids
+
+        self.moving_scatter -= np.outer(moving_point - moving_centroid,
+                                        moving_point - self.moving_centroid)
+        self.cross_covariance -= np.outer(moving_point - moving_centroid,
+                                          fixed_point - self.fixed_centroid)
+        self.fixed_sum_squares -= np.dot(fixed_point - fixed_centroid,
+                                         fixed_point - self.fixed_centroid)
+
+        self.moving_centroid = moving_centroid
+        self.fixed_centroid = fixed_centroid
+
+    def register(self):
+        """
+        Does the registration with the current fiducials, returning
+        the same measures as PointBasedRegistration.register
+        """
+        success = False
+        fre = 0.0
+        expected_tre_squared = 0.0
+        expected_fre_sq = 0.0
+        actual_tre = 0.0
+        self.transformed_target = np.zeros(shape=(1, 3), dtype=np.float64)
+
+        if self.no_fids > 2:
+            if self.non_planar_fids == 0:
+                rotation = planar_rotations(self.cross_covariance)
+            else:
+                rotation = rotations_from_covariances(self.cross_covariance)
+            translation = (self.fixed_centroid - np.matmul(
+                rotation, self.moving_centroid)).reshape(3, 1)
+
+            sum_squared_error = self.fixed_sum_squares + \
+                    np.trace(self.moving_scatter) - \
+                    2.0 * np.trace(np.matmul(rotation, self.cross_covariance))
+            fre = np.sqrt(max(sum_squared_error, 0.0) / self.no_fids)
+
+            expected_tre_squared, expected_fre_sq = _expected_errors_squared(
+                self.moving_centroid, self.moving_scatter, self.no_fids,
+                self.mean_fle_squared, self.fle_covariance, self.target[0])
+            expected_tre_squared = float(expected_tre_squared)
+            expected_fre_sq = float(expected_fre_sq)
+
+            self.transformed_target = np.matmul(rotation,
+                                                self.target.transpose()) + \
+                                               translation
+            actual_tre = np.linalg.norm(
+                self.transformed_target - self.target[:, 0:3].transpose())
+            success = True
+
+        return [success, fre, self.mean_fle_squared, expected_tre_squared,
+                expected_fre_sq, self.transformed_target[:, 0:3], actual_tre,
+                self.no_fids]
+
     def get_transformed_target(self):
         """
         Returns transformed target and status
@@ -0,0 +1,320 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Functions for point based registration using Orthogonal Procrustes,
+vectorised over stacks of point sets.
+"""
+
+import threading
+import timeit
+
+import numpy as np
+
+
+def validate_batch_inputs(fixed, moving):
+    """
+    Checks that fixed and moving are matching stacks of point sets
+
+    :param fixed: point sets, BxNx3 ndarray
+    :param moving: point sets, BxNx3 ndarray of corresponding points
+    :raises TypeError: If either input is not a numpy array
+    :raises ValueError: If the inputs are not BxNx3 or do not match
+    """
+    if not isinstance(fixed, np.ndarray):
+        raise TypeError("fixed is not a numpy array")
+    if not isinstance(moving, np.ndarray):
+        raise TypeError("moving is not a numpy array")
+    if fixed.ndim != 3 or fixed.shape[2] != 3:
+        raise ValueError("fixed should be a B x N x 3 array")
+    if moving.ndim != 3 or moving.shape[2] != 3:
+        raise ValueError("moving should be a B x N x 3 array")
+    if fixed.shape != moving.shape:
+        raise ValueError("fixed and moving should have the same shape")
+
+
+def rotations_from_covariances(covariances):
+    """
+    Solves for the rotations that best align stacks of centred point
+    sets. Follows Arun's method, using Fitzpatrick's correction
+    (chapter 8, page 470) to avoid reflections, as
+    sksurgerycore.algorithms.procrustes does for a single point set.
+
+    :param covariances: ...x3x3 ndarray of cross covariance matrices, the
+        sum of the outer products of the centred moving and fixed points
+    :returns: ...x3x3 ndarray of rotation matrices
+    """
+    u_mat, _singular_values, vt_mat = np.linalg.svd(covariances)
+    v_mat = np.swapaxes(vt_mat, -1, -2)
+    ut_mat = np.swapaxes(u_mat, -1, -2)
+
+    diag = np.ones(covariances.shape[:-1], dtype=np.float64)
+    diag[..., 2] = np.linalg.det(np.matmul(v_mat, ut_mat))
+
+    return np.matmul(v_mat * diag[..., np.newaxis, :], ut_mat)
+
+
+def batch_orthogonal_procrustes(fixed, moving, solver='svd'):
+    """
+    Does point based registration via Orthogonal Procrustes for every
+    point set in a stack at once.
+
+    :param fixed: point sets, BxNx3 ndarray
+    :param moving: point sets, BxNx3 ndarray of corresponding points
+    :param solver: the name of the rotation solver, a key of
+        ROTATION_SOLVERS, defaults to 'svd'
+    :returns: Bx3x3 rotations, Bx3x1 translations, B fiducial
+        registration errors
+    :raises TypeError, ValueError: If the inputs are invalid
+    """
+    return _batch_procrustes(fixed, moving, get_rotation_solver(solver))
+
+
+def is_planar(*point_sets):
+    """
+    Checks whether every point lies in the plane z = 0
+
+    :param point_sets: ...x3 ndarrays of points
+    :returns: True if every z coordinate is zero
+    """
+    return all(not np.any(points[..., 2]) for points in point_sets)
+
+
+def planar_rotations(covariances):
+    """
+    Solves for the rotations about z that best align stacks of centred
+    point sets lying in the plane z = 0. The angle maximising the trace
+    of R H is the atan2 of the cross covariance terms, so there is no
+    SVD and no reflection to correct.
+
+    :param covariances: ...x3x3 ndarray of cross covariance matrices, the
+        sum of the outer products of the centred moving and fixed points
+    :returns: ...x3x3 ndarray of rotation matrices
+    """
+    angles = np.arctan2(covariances[..., 0, 1] - covariances[..., 1, 0],
+                        covariances[..., 0, 0] + covariances[..., 1, 1])
+    cosines = np.cos(angles)
+    sines = np.sin(angles)
+
+    rotations = np.zeros(covariances.shape, dtype=np.float64)
+    rotations[..., 0, 0] = cosines
+    rotations[..., 0, 1] = -sines
+    rotations[..., 1, 0] = sines
+    rotations[..., 1, 1] = cosines
+    rotations[..., 2, 2] = 1.0
+    return rotations
+
+
+def quaternion_rotations(covariances):
+    """
+    Solves for the rotations that best align stacks of centred point
+    sets using Horn's (1987) closed form. The unit quaternion of each
+    rotation is the eigenvector of the largest eigenvalue of a 4x4
+    symmetric matrix built from the cross covariance, so the whole
+    stack is solved with one call to eigh. The result is always a
+    proper rotation.
+
+    :param covariances: ...x3x3 ndarray of cross covariance matrices, the
+        sum of the outer products of the centred moving and fixed points
+    :returns: ...x3x3 ndarray of rotation matrices
+    """
+    s_xx, s_xy, s_xz = np.moveaxis(covariances[..., 0, :], -1, 0)
+    s_yx, s_yy, s_yz = np.moveaxis(covariances[..., 1, :], -1, 0)
+    s_zx, s_zy, s_zz = np.moveaxis(covariances[..., 2, :], -1, 0)
+
+    horn = np.empty(covariances.shape[:-2] + (4, 4), dtype=np.float64)
+    horn[..., 0, 0] = s_xx + s_yy + s_zz
+    horn[..., 1, 1] = s_xx - s_yy - s_zz
+    horn[..., 2, 2] = -s_xx + s_yy - s_zz
+    horn[..., 3, 3] = -s_xx - s_yy + s_zz
+    horn[..., 0, 1] = horn[..., 1, 0] = s_yz - s_zy
+    horn[..., 0, 2] = horn[..., 2, 0] = s_zx - s_xz
+    horn[..., 0, 3] = horn[..., 3, 0] = s_xy - s_yx
+    horn[..., 1, 2] = horn[..., 2, 1] = s_xy + s_yx
+    horn[..., 1, 3] = horn[..., 3, 1] = s_zx + s_xz
+    horn[..., 2, 3] = horn[..., 3, 2] = s_yz + s_zy
+
+    #eigh sorts the eigenvalues in ascending order
+    _eigen_values, eigen_vectors = np.linalg.eigh(horn)
+    q_w, q_x, q_y, q_z = np.moveaxis(eigen_vectors[..., :, 3], -1, 0)
+
+    rotations = np.empty(covariances.shape, dtype=np.float64)
+    rotations[..., 0, 0] = 1 - 2 * (q_y * q_y + q_z * q_z)
+    rotations[..., 0, 1] = 2 * (q_x * q_y - q_z * q_w)
+    rotations[..., 0, 2] = 2 * (q_x * q_z + q_y * q_w)
+    rotations[..., 1, 0] = 2 * (q_x * q_y + q_z * q_w)
+    rotations[..., 1, 1] = 1 - 2 * (q_x * q_x + q_z * q_z)
+    rotations[..., 1, 2] = 2 * (q_y * q_z - q_x * q_w)
+    rotations[..., 2, 0] = 2 * (q_x * q_z - q_y * q_w)
+    rotations[..., 2, 1] = 2 * (q_y * q_z + q_x * q_w)
+    rotations[..., 2, 2] = 1 - 2 * (q_x * q_x + q_y * q_y)
+    return rotations
+
+
+#: The rotation solvers, by name. Each takes ...x3x3 cross covariance
+#: matrices and returns ...x3x3 rotations. 'planar' is only valid for
+#: points with z = 0.
+ROTATION_SOLVERS = {
+    'svd': rotations_from_covariances,
+    'quaternion': quaternion_rotations,
+    'planar': planar_rotations,
+    }
+
+#: The solvers that are valid for any points, which default_solver
+#: and fastest_solver choose from
+GENERAL_SOLVERS = ('svd', 'quaternion')
+
+#: The smallest batch default_solver uses the quaternion solver for.
+#: benchmarks/benchmark_solvers.py puts the crossover between 64 and
+#: 128 registrations of 10 fiducials; at 64 the two are within timing
+#: noise, from 128 the quaternion method is 10 to 15% faster.
+QUATERNION_BATCH_SIZE = 128
+
+_FASTEST_SOLVERS = {}
+_FASTEST_LOCK = threading.Lock()
+
+
+def get_rotation_solver(name):
+    """
+    Returns the rotation solver called name
+
+    :raises ValueError: If there is no solver called name
+    """
+    try:
+        return ROTATION_SOLVERS[name]
+    except KeyError:
+        raise ValueError("Unknown rotation solver ", name, ", choose from ",
+                         list(ROTATION_SOLVERS)) from KeyError
+
+
+def time_rotation_solvers(batch_size, repeats=3, names=GENERAL_SOLVERS):
+    """
+    Times the rotation solvers on a batch of random cross covariance
+    matrices
+
+    :param batch_size: the number of matrices
+    :param repeats: the number of timings to take the best of
+    :param names: the names of the solvers to time
+    :returns: dictionary of the best time per call in seconds, by name
+    """
+    covariances = np.random.default_rng(0).normal(size=(batch_size, 3, 3))
+    times = {}
+    for name in names:
+        solver = get_rotation_solver(name)
+        times[name] = min(timeit.repeat(lambda solver=solver:
+                                        solver(covariances),
+                                        repeat=repeats, number=1))
+    return times
+
+
+def default_solver(batch_size):
+    """
+    Returns the general rotation solver to use for a batch size,
+    without any timing, so the choice is the same on every machine:
+    SVD for batches smaller than QUATERNION_BATCH_SIZE, otherwise
+    the quaternion method
+
+    :param batch_size: the number of registrations in the batch
+    :returns: a key of ROTATION_SOLVERS
+    """
+    if batch_size < QUATERNION_BATCH_SIZE:
+        return 'svd'
+    return 'quaternion'
+
+
+def fastest_solver(batch_size):
+    """
+    Returns the name of the fastest general rotation solver for a
+    batch size. The solvers are timed the first time a batch size of
+    the same power of two is seen, on up to 4096 matrices, and the
+    choice is kept. The choice depends on the machine, so
+    registrations use default_solver, and this is for checking
+    QUATERNION_BATCH_SIZE in benchmarks/benchmark_solvers.py.
+
+    :param batch_size: the number of registrations in the batch
+    :returns: a key of ROTATION_SOLVERS
+    """
+    size_class = max(int(batch_size), 1).bit_length()
+    with _FASTEST_LOCK:
+        name = _FASTEST_SOLVERS.get(size_class)
+    if name is None:
+        times = time_rotation_solvers(min(2 ** size_class, 4096))
+        name = min(times, key=times.get)
+        with _FASTEST_LOCK:
+            _FASTEST_SOLVERS[size_class] = name
+    return name
+
+
+def _batch_procrustes(fixed, moving, solver):
+    """
+    Internal function doing batched Orthogonal Procrustes with a given
+    rotation solver
+    """
+    validate_batch_inputs(fixed, moving)
+    if fixed.shape[1] < 3:
+        raise ValueError("fixed and moving should have at least 3 points")
+
+    moving_centroids = np.mean(moving, axis=1)
+    fixed_centroids = np.mean(fixed, axis=1)
+
+    covariances = np.matmul(
+        np.swapaxes(moving - moving_centroids[:, np.newaxis, :], 1, 2),
+        fixed - fixed_centroids[:, np.newaxis, :])
+
+    rotations = solver(covariances)
+    translations = fixed_centroids - np.einsum('bij,bj->bi', rotations,
+                                               moving_centroids)
+
+    transformed = np.matmul(moving, np.swapaxes(rotations, 1, 2)) + \
+                    translations[:, np.newaxis, :]
+    fres = np.sqrt(np.mean(np.sum(np.square(fixed - transformed), axis=2),
+                           axis=1))
+
+    return rotations, translations[:, :, np.newaxis], fres
+
+
+def batch_planar_procrustes(fixed, moving):
+    """
+    Does point based registration for every point set in a stack at
+    once, for points in the plane z = 0, as batch_orthogonal_procrustes.
+
+    :param fixed: point sets, BxNx3 ndarray, with z = 0
+    :param moving: point sets, BxNx3 ndarray of corresponding points,
+        with z = 0
+    :returns: Bx3x3 rotations, Bx3x1 translations, B fiducial
+        registration errors
+    :raises TypeError, ValueError: If the inputs are invalid
+    """
+    return _batch_procrustes(fixed, moving, planar_rotations)
+
+
+def planar_procrustes(fixed, moving):
+    """
+    Does point based registration for points in the plane z = 0,
+    returning the same as sksurgerycore's orthogonal_procrustes.
+
+    :param fixed: point set, Nx3 ndarray, with z = 0
+    :param moving: point set, Nx3 ndarray of corresponding points,
+        with z = 0
+    :returns: 3x3 rotation, 3x1 translation, fiducial registration error
+    :raises TypeError, ValueError: If the inputs are invalid
+    """
+    if not isinstance(fixed, np.ndarray):
+        raise TypeError("fixed is not a numpy array")
+    if not isinstance(moving, np.ndarray):
+        raise TypeError("moving is not a numpy array")
+    validate_batch_inputs(fixed[np.newaxis], moving[np.newaxis])
+    if fixed.shape[0] < 3:
+        raise ValueError("fixed and moving should have at least 3 points")
+
+    moving_centroid = np.mean(moving, axis=0)
+    fixed_centroid = np.mean(fixed, axis=0)
+    covariance = np.matmul((moving - moving_centroid).transpose(),
+                           fixed - fixed_centroid)
+
+    rotation = planar_rotations(covariance)
+    translation = fixed_centroid - np.matmul(rotation, moving_centroid)
+
+    transformed = np.matmul(moving, rotation.transpose()) + translation
+    fre = np.sqrt(np.mean(np.sum(np.square(fixed - transformed), axis=1)))
+
+    return rotation, translation.reshape(3, 1), fre
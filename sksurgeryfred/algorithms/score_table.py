@@ -0,0 +1,177 @@
+#  -*- coding: utf-8 -*-
+
+"""
+A precomputed lookup table for the ablation game score, for scoring
+large numbers of simulated ablations.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from sksurgeryfred.algorithms.scores import sphere_volume, _overlap_volumes
+
+
+def _margin_penalty(distance_ratios, margin_ratios):
+    """
+    Internal function giving the margin penalty part of calculate_score
+    for a target of radius one
+    """
+    treatment_volumes = sphere_volume(1.0 + margin_ratios)
+    overlap_volumes = _overlap_volumes(distance_ratios, 1.0,
+                                       1.0 + margin_ratios)
+    return -1000.0 * (treatment_volumes - overlap_volumes) / \
+                    treatment_volumes
+
+
+class ScoreTable:
+    """
+    calculate_score depends only on the distance between the target and
+    its estimate and the margin, both relative to the target radius.
+    The score is 1000 if the distance is no more than the margin, plus
+    a margin penalty that varies continuously. ScoreTable tabulates the
+    penalty against the normalised distance and margin and finds scores
+    by bilinear interpolation.
+
+    Interpolation error falls in proportion to the table spacing. With
+    the default 256 steps per target radius the penalty is within 0.75
+    of the exact value, so rounded scores are within 1 of
+    calculate_score. max_interpolation_error measures the error for
+    other resolutions.
+
+    :param max_margin_ratio: the largest margin, relative to the target
+        radius, the table covers. Defaults to 2, so a target radius of
+        10 covers the game's margins of 0 to 20.
+    :param steps_per_radius: the number of table entries per target
+        radius.
+    :param cache_path: an .npy file to memory map the table from. If the
+        file does not exist the table is built and saved there. Defaults
+        to None, building the table in memory.
+
+    :raises ValueError: If a cached table does not match the parameters.
+    """
+
+    def __init__(self, max_margin_ratio=2.0, steps_per_radius=256,
+                 cache_path=None):
+
+        self.max_margin_ratio = max_margin_ratio
+        self.steps_per_radius = steps_per_radius
+        #there is no overlap beyond a distance of 2 + margin ratio
+        self.max_distance_ratio = 2.0 + max_margin_ratio
+
+        self.shape = (int(round(max_margin_ratio * steps_per_radius)) + 1,
+                      int(round(self.max_distance_ratio *
+                                steps_per_radius)) + 1)
+
+        if cache_path is not None and os.path.exists(cache_path):
+            self.table = np.load(cache_path, mmap_mode='r')
+            if self.table.shape != self.shape:
+                raise ValueError("Cached score table ", cache_path,
+                                 " does not match the table parameters")
+        else:
+            self.table = self._build()
+            if cache_path is not None:
+                self._save(cache_path)
+                self.table = np.load(cache_path, mmap_mode='r')
+
+    def _build(self):
+        """Evaluates the margin penalty at every table entry"""
+        margin_ratios = np.arange(self.shape[0]) / self.steps_per_radius
+        distance_ratios = np.arange(self.shape[1]) / self.steps_per_radius
+        return _margin_penalty(distance_ratios[np.newaxis, :],
+                               margin_ratios[:, np.newaxis])
+
+    def _save(self, cache_path):
+        """
+        Saves the table via a temporary file, so other processes never
+        see a partly written table
+        """
+        directory = os.path.dirname(os.path.abspath(cache_path))
+        file_handle, temp_path = tempfile.mkstemp(suffix='.npy',
+                                                  dir=directory)
+        with os.fdopen(file_handle, 'wb') as temp_file:
+            np.save(temp_file, self.table)
+        os.replace(temp_path, cache_path)
+
+    def _interpolate(self, distance_ratios, margin_ratios):
+        """Bilinear interpolation of the margin penalty"""
+        rows = margin_ratios * self.steps_per_radius
+        columns = np.clip(distance_ratios * self.steps_per_radius,
+                          0.0, self.shape[1] - 1)
+
+        row = np.minimum(rows.astype(np.intp), self.shape[0] - 2)
+        column = np.minimum(columns.astype(np.intp), self.shape[1] - 2)
+        row_fraction = rows - row
+        column_fraction = columns - column
+
+        table = self.table
+        return (1.0 - row_fraction) * (
+            (1.0 - column_fraction) * table[row, column] +
+            column_fraction * table[row, column + 1]) + \
+                row_fraction * (
+                    (1.0 - column_fraction) * table[row + 1, column] +
+                    column_fraction * table[row + 1, column + 1])
+
+    def scores(self, distances, target_radii, margins):
+        """
+        Looks up the scores for ablations
+
+        :param distances: the distances between the targets and their
+            estimated positions
+        :param target_radii: the radii of the targets
+        :param margins: the margins, between 0 and max_margin_ratio
+            times the target radii
+        :returns: the scores, as calculate_scores
+        :raises ValueError: If any margin is outside the table
+        """
+        distances, target_radii, margins = np.broadcast_arrays(
+            np.asarray(distances, dtype=np.float64),
+            np.asarray(target_radii, dtype=np.float64),
+            np.asarray(margins, dtype=np.float64))
+
+        margin_ratios = margins / target_radii
+        if np.any(margin_ratios < 0.0) or \
+                np.any(margin_ratios > self.max_margin_ratio):
+            raise ValueError("Margins must be between 0 and ",
+                             self.max_margin_ratio, " times target radius")
+
+        penalty = self._interpolate(distances / target_radii, margin_ratios)
+        return np.round(np.where(distances <= margins, 1000.0, 0.0) +
+                        penalty)
+
+    def calculate_scores(self, target_centres, est_target_centres,
+                         target_radii, margins):
+        """
+        Looks up the scores for simulated ablations, taking the same
+        arguments as scores.calculate_scores
+
+        :params target_centres: The known target positions (Bx3)
+        :params est_target_centres: The target centres estimated by
+            registration (Bx3)
+        :target_radii: The radii of the targets
+        :margins: The margins to add
+        :returns: the scores (B)
+        """
+        distances = np.linalg.norm(
+            np.asarray(est_target_centres, dtype=np.float64) -
+            np.asarray(target_centres, dtype=np.float64), axis=-1)
+        return self.scores(distances, target_radii, margins)
+
+    def max_interpolation_error(self):
+        """
+        Measures the largest difference between the interpolated and
+        exact margin penalty, at the centre of every table cell
+
+        :returns: the largest absolute error, in score points
+        """
+        margin_ratios = (np.arange(self.shape[0] - 1) + 0.5) / \
+                            self.steps_per_radius
+        distance_ratios = (np.arange(self.shape[1] - 1) + 0.5) / \
+                            self.steps_per_radius
+        table = np.asarray(self.table)
+        interpolated = (table[:-1, :-1] + table[1:, :-1] +
+                        table[:-1, 1:] + table[1:, 1:]) / 4.0
+        exact = _margin_penalty(distance_ratios[np.newaxis, :],
+                                margin_ratios[:, np.newaxis])
+        return float(np.max(np.abs(interpolated - exact)))
@@ -73,3 +73,182 @@ def calculate_score(target_centre, est_target_centre, target_radius, margin):
     margin_penalty = -1000.0 * healty_tissue_treated
 
     return round(treatment_score + margin_penalty)
+
+
+def two_sphere_overlap_volumes(centres0, centres1, radii0, radii1):
+    """
+    Calculates the overlapping volumes of many pairs of spheres, as
+    two_sphere_overlap_volume does for one pair
+    :param: centres0 centres of spheres0 (Bx3)
+    :param: centres1 centres of spheres1 (Bx3)
+    :param: radii0 radii of spheres0 (B, or anything that broadcasts)
+    :param: radii1 radii of spheres1 (B, or anything that broadcasts)
+    :returns: the overlapping volumes (B)
+    """
+    distances = np.linalg.norm(np.asarray(centres1, dtype=np.float64) -
+                               np.asarray(centres0, dtype=np.float64),
+                               axis=-1)
+    return _overlap_volumes(distances, radii0, radii1)
+
+
+def _overlap_volumes(distances, radii0, radii1):
+    """
+    Internal function to calculate the overlapping volumes of spheres
+    with centres the given distances apart
+    """
+    distances, radii0, radii1 = np.broadcast_arrays(
+        np.asarray(distances, dtype=np.float64),
+        np.asarray(radii0, dtype=np.float64),
+        np.asarray(radii1, dtype=np.float64))
+
+    sum_radii = radii0 + radii1
+    abs_diff_radii = np.abs(radii0 - radii1)
+
+    volumes = np.zeros(distances.shape, dtype=np.float64)
+
+    overlapping = distances < sum_radii
+    contained = overlapping & (distances <= abs_diff_radii)
+    partial = overlapping & ~contained
+
+    volumes[contained] = sphere_volume(
+        np.minimum(radii0[contained], radii1[contained]))
+
+    distance = distances[partial]
+    sum_radii = sum_radii[partial]
+    abs_diff_radii = abs_diff_radii[partial]
+    volumes[partial] = (math.pi / (12 * distance) *
+                        (sum_radii - distance) * (sum_radii - distance) *
+                        (distance * distance +
+                         2 * distance * sum_radii -
+                         3 * abs_diff_radii * abs_diff_radii))
+
+    return volumes
+
+
+def calculate_scores(target_centres, est_target_centres, target_radii,
+                     margins):
+    """
+    Calculates the scores for many simulated ablations, as
+    calculate_score does for one
+    :params target_centres: The known target positions (Bx3)
+    :params est_target_centres: The target centres estimated by
+        registration (Bx3)
+    :target_radii: The radii of the targets (B, or anything that
+        broadcasts)
+    :margins: The margins to add (B, or anything that broadcasts)
+    :returns: the scores (B)
+    """
+    target_radii = np.asarray(target_radii, dtype=np.float64)
+    treatment_radii = target_radii + np.asarray(margins, dtype=np.float64)
+
+    target_volumes = sphere_volume(target_radii)
+    treatment_volumes = sphere_volume(treatment_radii)
+    overlap_volumes = two_sphere_overlap_volumes(
+        target_centres, est_target_centres, target_radii, treatment_radii)
+
+    target_not_treated = (target_volumes - overlap_volumes) / target_volumes
+    treatment_scores = np.where(target_not_treated > 0.0, 0.0, 1000.0)
+
+    healthy_tissue_treated = \
+                (treatment_volumes - overlap_volumes) / treatment_volumes
+
+    return np.round(treatment_scores - 1000.0 * healthy_tissue_treated)
+
+
+def _maxwell_cdf(distances, scale):
+    """
+    Internal function, the cumulative distribution of the length of
+    a 3D isotropic normal vector with standard deviation scale
+    """
+    erf = np.vectorize(math.erf, otypes=[np.float64])
+    normalised = np.asarray(distances, dtype=np.float64) / scale
+    return erf(normalised / math.sqrt(2.0)) - \
+            math.sqrt(2.0 / math.pi) * normalised * \
+            np.exp(-normalised * normalised / 2.0)
+
+
+def _maxwell_pdf(distances, scale):
+    """
+    Internal function, the probability density of the length of
+    a 3D isotropic normal vector with standard deviation scale
+    """
+    normalised = np.asarray(distances, dtype=np.float64) / scale
+    return math.sqrt(2.0 / math.pi) * normalised * normalised * \
+            np.exp(-normalised * normalised / 2.0) / scale
+
+
+def expected_scores(expected_tre, target_radius, margins,
+                    quadrature_points=64):
+    """
+    Calculates the expected score for each margin, given the expected
+    TRE. The registration error at the target is taken to be isotropic
+    and normally distributed with mean squared value expected_tre
+    squared, so its length follows a Maxwell distribution. Where the
+    overlap is constant (one sphere inside the other, or no overlap)
+    the score is integrated in closed form, elsewhere by Gauss-Legendre
+    quadrature. Scores are not rounded.
+    :params expected_tre: The expected (root mean square) TRE
+    :params target_radius: The radius of the target
+    :params margins: The margins to score (M)
+    :params quadrature_points: The number of quadrature points to use
+    :returns: the expected scores (M)
+    :raises ValueError: If any margin makes the treatment radius
+        less than or equal to zero
+    """
+    margins = np.asarray(margins, dtype=np.float64)
+    treatment_radii = target_radius + margins
+    if np.any(treatment_radii <= 0.0):
+        raise ValueError("Margins must be greater than -target_radius")
+
+    treatment_volumes = sphere_volume(treatment_radii)
+    contained_volumes = sphere_volume(np.minimum(target_radius,
+                                                 treatment_radii))
+
+    if expected_tre <= 0.0:
+        hit_probability = np.where(margins >= 0.0, 1.0, 0.0)
+        expected_overlap = contained_volumes
+    else:
+        scale = expected_tre / math.sqrt(3.0)
+        hit_probability = np.where(margins >= 0.0,
+                                   _maxwell_cdf(np.abs(margins), scale), 0.0)
+
+        #one sphere lies inside the other out to |margin|, and they
+        #don't overlap past 2 * target_radius + margin
+        inner = np.abs(margins)
+        outer = 2.0 * target_radius + margins
+        expected_overlap = contained_volumes * _maxwell_cdf(inner, scale)
+
+        nodes, weights = np.polynomial.legendre.leggauss(quadrature_points)
+        half_widths = (outer - inner) / 2.0
+        distances = ((outer + inner) / 2.0)[:, np.newaxis] + \
+                        half_widths[:, np.newaxis] * nodes
+        overlaps = _overlap_volumes(distances, target_radius,
+                                    treatment_radii[:, np.newaxis])
+        expected_overlap = expected_overlap + half_widths * np.sum(
+            weights * overlaps * _maxwell_pdf(distances, scale), axis=1)
+
+    return 1000.0 * hit_probability - 1000.0 * \
+            (treatment_volumes - expected_overlap) / treatment_volumes
+
+
+def optimal_margin(expected_tre, target_radius, margins=None,
+                   quadrature_points=64):
+    """
+    Finds the margin with the highest expected score, given the
+    expected TRE, see expected_scores
+    :params expected_tre: The expected (root mean square) TRE
+    :params target_radius: The radius of the target
+    :params margins: The margins to search (M), defaults to 0 to 20
+        in steps of 0.1, as the game's margin dial
+    :params quadrature_points: The number of quadrature points to use
+    :returns: the margins, their expected scores, the best margin and
+        its expected score
+    """
+    if margins is None:
+        margins = np.linspace(0.0, 20.0, 201)
+    margins = np.asarray(margins, dtype=np.float64)
+
+    scores = expected_scores(expected_tre, target_radius, margins,
+                             quadrature_points)
+    best = int(np.argmax(scores))
+    return margins, scores, float(margins[best]), float(scores[best])
@@ -0,0 +1,118 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Monte Carlo simulation of registration errors, drawing many
+realisations of fiducial localisation error for one fiducial layout
+and registering them all at once.
+"""
+
+import numpy as np
+
+from sksurgeryfred.algorithms.fle import FLE
+from sksurgeryfred.algorithms.point_based_reg import PointBasedRegistration
+
+
+def _perturb(fle, fiducials, repeats):
+    """
+    Returns repeats perturbed copies of the fiducials
+
+    :param fle: the FLE to apply
+    :param fiducials: Nx3 ndarray of fiducial positions
+    :param repeats: the number of copies
+    :returns: repeats x N x 3 ndarray
+    """
+    return fle.perturb_fiducials(
+        np.broadcast_to(fiducials, (repeats,) + fiducials.shape))
+
+
+def summarise(values):
+    """
+    Returns summary statistics for an array of errors
+
+    :param values: 1D ndarray
+    :returns: dictionary of mean, rms, standard deviation, median,
+        5th and 95th percentile
+    """
+    return {
+        'mean': float(np.mean(values)),
+        'rms': float(np.sqrt(np.mean(np.square(values)))),
+        'std': float(np.std(values)),
+        'median': float(np.median(values)),
+        'p5': float(np.percentile(values, 5)),
+        'p95': float(np.percentile(values, 95))
+        }
+
+
+def correlation(values_a, values_b):
+    """
+    Returns the correlation coefficient of two arrays, or zero if
+    either has no variance.
+    """
+    if np.std(values_a) == 0.0 or np.std(values_b) == 0.0:
+        return 0.0
+    return float(np.corrcoef(values_a, values_b)[0, 1])
+
+
+def simulate_registrations(fiducials, target, fixed_fle, fixed_fle_esv,
+                           repeats, moving_fle=None, moving_fle_esv=0.0):
+    """
+    Simulates repeated registrations of a fiducial layout, with
+    independent FLE realisations each time.
+
+    :param fiducials: Nx3 ndarray of the true fiducial positions
+    :param target: 1x3 ndarray, the target point
+    :param fixed_fle: the FLE applied to the fixed fiducials
+    :param fixed_fle_esv: the expected squared value of fixed_fle, used
+        for the expected TRE and FRE
+    :param repeats: the number of registrations to simulate
+    :param moving_fle: the FLE applied to the moving fiducials,
+        defaults to none
+    :param moving_fle_esv: the expected squared value of moving_fle,
+        used for the expected TRE and FRE, defaults to 0.0
+    :returns: a dictionary of length repeats arrays of 'tre', 'fre',
+        'expected_tre' and 'expected_fre', the repeats x 3
+        'transformed_target' and a 'summary' dictionary
+    :raises ValueError: If fiducials is not Nx3 with N > 2, or repeats
+        is less than 1
+    """
+    fiducials = np.asarray(fiducials, dtype=np.float64)
+    if fiducials.ndim != 2 or fiducials.shape[1] != 3:
+        raise ValueError("fiducials should be an N x 3 array")
+    if fiducials.shape[0] < 3:
+        raise ValueError("At least 3 fiducials are needed to register")
+    if repeats < 1:
+        raise ValueError("repeats should be at least 1")
+    if moving_fle is None:
+        moving_fle = FLE()
+
+    target = np.asarray(target, dtype=np.float64).reshape(1, 3)
+    registerer = PointBasedRegistration(target, fixed_fle_esv,
+                                        moving_fle_esv)
+
+    results = registerer.register_batch(
+        _perturb(fixed_fle, fiducials, repeats),
+        _perturb(moving_fle, fiducials, repeats))
+
+    tre = results['actual_tre']
+    fre = results['fre']
+    expected_tre = np.sqrt(results['expected_tre_squared'])
+    expected_fre = np.sqrt(results['expected_fre_squared'])
+
+    summary = {
+        'repeats': repeats,
+        'no_fids': fiducials.shape[0],
+        'tre': summarise(tre),
+        'fre': summarise(fre),
+        'expected_tre': summarise(expected_tre),
+        'expected_fre': summarise(expected_fre),
+        'tre_fre_correlation': correlation(tre, fre)
+        }
+
+    return {
+        'tre': tre,
+        'fre': fre,
+        'expected_tre': expected_tre,
+        'expected_fre': expected_fre,
+        'transformed_target': results['transformed_target'],
+        'summary': summary
+        }
@@ -0,0 +1,215 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Parameter sweeps of simulated registrations over numbers of
+fiducials, fiducial localisation errors, target locations and
+ablation margins, spread over processes.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+
+import numpy as np
+
+from sksurgeryfred.algorithms.contour import get_contour_geometry
+from sksurgeryfred.algorithms.errors import expected_absolute_value
+from sksurgeryfred.algorithms.fle import FLE
+from sksurgeryfred.algorithms.point_based_reg import PointBasedRegistration
+from sksurgeryfred.algorithms.scores import calculate_scores
+from sksurgeryfred.algorithms.simulation import correlation
+
+#: The fields of the sweep results, one record per combination of
+#: the grids
+SWEEP_RESULT_DTYPE = np.dtype([
+    ('no_fids', np.int64),
+    ('fle_sd', np.float64),
+    ('target', np.float64, (3,)),
+    ('margin', np.float64),
+    ('trials', np.int64),
+    ('mean_tre', np.float64),
+    ('rms_tre', np.float64),
+    ('mean_fre', np.float64),
+    ('mean_expected_tre', np.float64),
+    ('tre_fre_correlation', np.float64),
+    ('mean_score', np.float64)])
+
+#: The per trial arrays each chunk returns
+TRIAL_FIELDS = ('tre', 'fre', 'expected_tre', 'transformed_target')
+
+
+def _run_chunk(task):
+    """
+    Internal function simulating one chunk of trials for a single
+    number of fiducials, FLE and target. Fiducials are drawn
+    uniformly from inside the outline for every trial. Runs in a
+    worker process, so takes and returns only picklable values.
+
+    :param task: tuple of outline, number of fiducials, FLE standard
+        deviation, target, number of trials and a SeedSequence
+    :returns: dictionary of the TRIAL_FIELDS arrays
+    """
+    outline, no_fids, fle_sd, target, trials, seed_sequence = task
+    fiducial_seed, fle_seed = seed_sequence.spawn(2)
+
+    geometry = get_contour_geometry(outline)
+    samples = geometry.sample(trials * no_fids,
+                              np.random.default_rng(fiducial_seed))
+    #the outline is row (y) first, fiducials are x first
+    fiducials = np.zeros((trials, no_fids, 3), dtype=np.float64)
+    fiducials[:, :, 0:2] = samples[:, ::-1].reshape(trials, no_fids, 2)
+
+    fle = FLE(independent_fle=fle_sd, random_generator=fle_seed)
+    fle_esv = expected_absolute_value(fle.independent_fle)
+    #a fixed solver, as the default choice depends on the chunk size
+    #and could change the results in the last bits
+    registerer = PointBasedRegistration(
+        np.asarray(target, dtype=np.float64).reshape(1, 3), fle_esv, 0.0,
+        solver='svd')
+    results = registerer.register_batch(fle.perturb_fiducials(fiducials),
+                                         fiducials)
+
+    return {
+        'tre': results['actual_tre'],
+        'fre': results['fre'],
+        'expected_tre': np.sqrt(results['expected_tre_squared']),
+        'transformed_target': results['transformed_target']
+        }
+
+
+def make_tasks(outline, no_fids_grid, fle_sd_grid, targets, trials,
+               chunk_size, seed=None):
+    """
+    Splits the sweep into chunks of at most chunk_size trials, each
+    with its own child of one SeedSequence, so the results depend
+    only on the seed and not on how the chunks are run.
+
+    :returns: a list of (configuration index, task) pairs, with the
+        configurations in the order of itertools.product of the grids
+    :raises ValueError: If trials or chunk_size are less than 1
+    """
+    if trials < 1 or chunk_size < 1:
+        raise ValueError("trials and chunk_size should be at least 1")
+
+    configurations = list(itertools.product(no_fids_grid, fle_sd_grid,
+                                            range(len(targets))))
+    chunks_per_configuration = -(-trials // chunk_size)
+    seed_sequences = iter(np.random.SeedSequence(seed).spawn(
+        len(configurations) * chunks_per_configuration))
+
+    tasks = []
+    for index, (no_fids, fle_sd, target_index) in enumerate(configurations):
+        for start in range(0, trials, chunk_size):
+            tasks.append((index, (outline, int(no_fids), float(fle_sd),
+                                  targets[target_index],
+                                  min(chunk_size, trials - start),
+                                  next(seed_sequences))))
+    return tasks
+
+
+def run_sweep(outline, no_fids_grid, fle_sd_grid, margin_grid, targets=None, #pylint: disable=too-many-arguments
+              trials=1000, chunk_size=1000, workers=1, seed=None,
+              target_radius=10.0, score_table=None):
+    """
+    Simulates registrations for every combination of the number of
+    fiducials, FLE standard deviation and target, and scores them for
+    each ablation margin. Chunks of trials are run in parallel in a
+    ProcessPoolExecutor and merged in a fixed order, so for a given
+    seed the results are the same for any number of workers.
+
+    :param outline: the anatomy outline, (row, column) ordered
+        as static/brain512.npy, that fiducials are drawn from
+    :param no_fids_grid: the numbers of fiducials, each at least 3
+    :param fle_sd_grid: the FLE standard deviations, isotropic, on
+        the fixed image only as in FRED
+    :param margin_grid: the ablation margins to score
+    :param targets: Kx3 target points, x first. Defaults to None,
+        using the centre of the outline
+    :param trials: the number of registrations per configuration
+    :param chunk_size: the most trials in one task
+    :param workers: the number of processes. 1 runs in this process.
+    :param seed: the seed for the SeedSequence, defaults to None,
+        which gives fresh entropy
+    :param target_radius: the target radius for scoring
+    :param score_table: a ScoreTable to look the scores up in, defaults
+        to None, calculating them exactly. Margins the table doesn't
+        cover are calculated exactly.
+    :returns: a structured array of SWEEP_RESULT_DTYPE, with one
+        record per configuration and margin, and a dictionary of the
+        per trial TRIAL_FIELDS arrays, each configurations x trials
+    :raises ValueError: If a number of fiducials is less than 3, or
+        trials, chunk_size or workers are less than 1
+    """
+    outline = np.asarray(outline, dtype=np.float64)
+    if targets is None:
+        targets = np.array([[*np.mean(outline, axis=0)[::-1], 0.0]])
+    targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+    if min(no_fids_grid) < 3:
+        raise ValueError("At least 3 fiducials are needed to register")
+    if workers < 1:
+        raise ValueError("workers should be at least 1")
+
+    tasks = make_tasks(outline, no_fids_grid, fle_sd_grid, targets, trials,
+                       chunk_size, seed)
+    if workers == 1:
+        chunks = [_run_chunk(task) for _index, task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(_run_chunk,
+                                       [task for _index, task in tasks]))
+
+    no_configurations = tasks[-1][0] + 1
+    trial_results = {}
+    for field in TRIAL_FIELDS:
+        trial_results[field] = np.stack([
+            np.concatenate([chunk[field] for (index, _task), chunk
+                            in zip(tasks, chunks) if index == configuration])
+            for configuration in range(no_configurations)])
+
+    return _summarise(tasks, trial_results, margin_grid, target_radius,
+                      score_table), trial_results
+
+
+def _scores(score_table, target, transformed_targets, target_radius,
+            margin):
+    """
+    Internal function scoring the trials of one configuration, from
+    score_table if it covers the margin, otherwise exactly
+    """
+    if score_table is not None:
+        try:
+            return score_table.calculate_scores(
+                target, transformed_targets, target_radius, margin)
+        except ValueError:
+            pass
+    return calculate_scores(target, transformed_targets, target_radius,
+                            margin)
+
+
+def _summarise(tasks, trial_results, margin_grid, target_radius,
+               score_table=None):
+    """
+    Internal function giving the SWEEP_RESULT_DTYPE record for every
+    configuration and margin
+    """
+    first_tasks = {}
+    for index, task in tasks:
+        first_tasks.setdefault(index, task)
+
+    results = np.zeros(len(first_tasks) * len(margin_grid),
+                       dtype=SWEEP_RESULT_DTYPE)
+    record = 0
+    for index in sorted(first_tasks):
+        _outline, no_fids, fle_sd, target, _trials, _seed = first_tasks[index]
+        tre = trial_results['tre'][index]
+        fre = trial_results['fre'][index]
+        for margin in margin_grid:
+            scores = _scores(score_table, target,
+                             trial_results['transformed_target'][index],
+                             target_radius, margin)
+            results[record] = (no_fids, fle_sd, target, margin, tre.size,
+                               np.mean(tre), np.sqrt(np.mean(np.square(tre))),
+                               np.mean(fre),
+                               np.mean(trial_results['expected_tre'][index]),
+                               correlation(tre, fre), np.mean(scores))
+            record += 1
+    return results
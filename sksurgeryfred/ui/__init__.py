@@ -0,0 +1,2 @@
+# coding=utf-8
+"""Command line interfaces for scikit-surgeryfred"""
@@ -0,0 +1,150 @@
+# coding=utf-8
+
+"""
+Command line entry point for headless simulation of registrations,
+for large offline studies. Does not import main.py, so does not need
+Flask or google-cloud-firestore.
+"""
+
+import argparse
+import csv
+
+import numpy as np
+
+from sksurgeryfred import __version__
+from sksurgeryfred.algorithms.score_table import ScoreTable
+from sksurgeryfred.algorithms.sweep import run_sweep, TRIAL_FIELDS
+
+#: The summary fields written to csv, with the target split into x, y, z
+CSV_FIELDS = ('no_fids', 'fle_sd', 'target_x', 'target_y', 'target_z',
+              'margin', 'trials', 'mean_tre', 'rms_tre', 'mean_fre',
+              'mean_expected_tre', 'tre_fre_correlation', 'mean_score')
+
+
+def write_results(output, results, trial_results):
+    """
+    Writes the sweep results to a file. A .csv file gets the summary,
+    one row per configuration and margin, anything else is saved with
+    numpy.savez as the summary and the per trial arrays.
+
+    :param output: the path to write to
+    :param results: the summary, a SWEEP_RESULT_DTYPE array
+    :param trial_results: the dictionary of per trial arrays
+    """
+    if output.lower().endswith('.csv'):
+        with open(output, 'w', newline='', encoding='utf-8') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(CSV_FIELDS)
+            for record in results:
+                writer.writerow([record['no_fids'], record['fle_sd'],
+                                 *record['target'], *list(record)[3:]])
+        return
+
+    arrays = {field: trial_results[field] for field in TRIAL_FIELDS}
+    np.savez(output, results=results, **arrays)
+
+
+def main(args=None):
+    """
+    Entry point for sksurgeryfred-sim. Runs a sweep of simulated
+    registrations over the numbers of fiducials, FLEs, targets and
+    margins given, a single batch simulation if each has one value.
+    """
+    parser = argparse.ArgumentParser(
+        description='sksurgeryfred-sim: headless simulation of fiducial '
+                    'based registrations')
+
+    parser.add_argument("-n", "--fiducials",
+                        type=int, nargs='+', default=[4],
+                        help="The numbers of fiducials, at least 3")
+
+    parser.add_argument("-f", "--fle",
+                        type=float, nargs='+', default=[1.0],
+                        help="The FLE standard deviations, as /getfle "
+                             "gives between 0.5 and 5.0")
+
+    parser.add_argument("-m", "--margins",
+                        type=float, nargs='+', default=[2.0],
+                        help="The ablation margins to score")
+
+    parser.add_argument("--targets",
+                        type=float, nargs='+', default=None,
+                        help="Target x and y pairs, defaults to the "
+                             "centre of the outline")
+
+    parser.add_argument("-r", "--target_radius",
+                        type=float, default=10.0,
+                        help="The target radius for scoring")
+
+    parser.add_argument("-t", "--trials",
+                        type=int, default=1000,
+                        help="The number of registrations per "
+                             "configuration")
+
+    parser.add_argument("-c", "--chunk_size",
+                        type=int, default=1000,
+                        help="The most registrations in one task")
+
+    parser.add_argument("-w", "--workers",
+                        type=int, default=1,
+                        help="The number of worker processes")
+
+    parser.add_argument("-s", "--seed",
+                        type=int, default=None,
+                        help="The random seed, for repeatable results")
+
+    parser.add_argument("-l", "--outline",
+                        required=True,
+                        help="The .npy anatomy outline to place "
+                             "fiducials in, e.g. static/brain512.npy")
+
+    parser.add_argument("--score_table",
+                        default=None,
+                        help="An .npy file to memory map the score "
+                             "lookup table from, written if it doesn't "
+                             "exist. Defaults to building it in memory")
+
+    parser.add_argument("-o", "--output",
+                        default='sksurgeryfred_sim.npz',
+                        help="The file to write, .csv for the summary "
+                             "only, otherwise .npz")
+
+    version_string = __version__
+    friendly_version_string = version_string if version_string else 'unknown'
+    parser.add_argument(
+        "-v", "--version",
+        action='version',
+        version='sksurgeryfred version ' + friendly_version_string)
+
+    parsed = parser.parse_args(args)
+
+    targets = None
+    if parsed.targets is not None:
+        if len(parsed.targets) % 2 != 0:
+            parser.error("--targets should be x and y pairs")
+        targets = np.zeros((len(parsed.targets) // 2, 3), dtype=np.float64)
+        targets[:, 0:2] = np.reshape(parsed.targets, (-1, 2))
+
+    try:
+        outline = np.load(parsed.outline)
+    except (OSError, ValueError) as error:
+        parser.error("Failed to load outline " + parsed.outline + ": " +
+                     str(error))
+
+    try:
+        score_table = ScoreTable(cache_path=parsed.score_table)
+    except (OSError, ValueError) as error:
+        parser.error("Failed to load score table " +
+                     str(parsed.score_table) + ": " + str(error))
+
+    try:
+        results, trial_results = run_sweep(
+            outline, parsed.fiducials, parsed.fle,
+            parsed.margins, targets=targets, trials=parsed.trials,
+            chunk_size=parsed.chunk_size, workers=parsed.workers,
+            seed=parsed.seed, target_radius=parsed.target_radius,
+            score_table=score_table)
+    except ValueError as error:
+        parser.error(str(error))
+
+    write_results(parsed.output, results, trial_results)
@@ -0,0 +1,118 @@
+"""A registry of the anatomy outlines found in a directory, loaded
+lazily and memory mapped, with a bounded cache of geometry derived
+from them"""
+
+from collections import OrderedDict
+import os
+import threading
+
+import numpy as np
+
+from sksurgeryfred.algorithms.contour import ContourGeometry, TargetPool
+
+
+class AnatomyRegistry():
+    """
+    Finds the anatomy outlines, Nx2 .npy files, in a directory. Each
+    anatomy's id is its file name without the extension. Nothing is
+    loaded until an anatomy is first used, and then the file is memory
+    mapped, so its pages are shared by every worker process. Values
+    derived from an outline, such as its geometry, are kept in a least
+    recently used cache of at most max_cached anatomies.
+    """
+    def __init__(self, directory, max_cached=16):
+        """
+        :params directory: the directory holding the .npy outlines
+        :params max_cached: the most anatomies to keep derived values for
+        :raises ValueError: If max_cached is less than 1
+        """
+        if max_cached < 1:
+            raise ValueError("max_cached must be at least 1")
+        self.directory = directory
+        self.max_cached = max_cached
+        self._paths = {
+            os.path.splitext(name)[0]: os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if name.endswith('.npy')}
+        self._outlines = {}
+        self._derived = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def ids(self):
+        """The anatomy ids, sorted"""
+        return list(self._paths)
+
+    def __contains__(self, anatomy_id):
+        return anatomy_id in self._paths
+
+    def __len__(self):
+        return len(self._paths)
+
+    def outline(self, anatomy_id):
+        """
+        Returns an anatomy's outline, memory mapped read only
+
+        :params anatomy_id: the anatomy's id
+        :returns: Nx2 ndarray
+        :raises ValueError: If there is no anatomy anatomy_id
+        """
+        with self._lock:
+            outline = self._outlines.get(anatomy_id)
+        if outline is None:
+            path = self._paths.get(anatomy_id)
+            if path is None:
+                raise ValueError("Unknown anatomy ", anatomy_id)
+            outline = np.load(path, mmap_mode='r')
+            with self._lock:
+                outline = self._outlines.setdefault(anatomy_id, outline)
+        return outline
+
+    def derived(self, anatomy_id, key, function):
+        """
+        Returns a value derived from an anatomy's outline, calling
+        function(outline) only if it is not cached
+
+        :params anatomy_id: the anatomy's id
+        :params key: the name of the derived value
+        :params function: computes the value from the outline
+        :returns: the value
+        :raises ValueError: If there is no anatomy anatomy_id
+        """
+        with self._lock:
+            values = self._derived.get(anatomy_id)
+            if values is not None and key in values:
+                self._derived.move_to_end(anatomy_id)
+                return values[key]
+
+        value = function(self.outline(anatomy_id))
+
+        with self._lock:
+            values = self._derived.pop(anatomy_id, None)
+            if values is None:
+                values = {}
+                while len(self._derived) >= self.max_cached:
+                    self._derived.popitem(last=False)
+            values.setdefault(key, value)
+            self._derived[anatomy_id] = values
+            return values[key]
+
+    def geometry(self, anatomy_id):
+        """
+        Returns the ContourGeometry of an anatomy, with its centroid,
+        bounds and mask
+
+        :raises ValueError: If there is no anatomy anatomy_id
+        """
+        return self.derived(anatomy_id, 'geometry', ContourGeometry)
+
+    def target_pool(self, anatomy_id, edge_buffer=0.9):
+        """
+        Returns the TargetPool of an anatomy for an edge buffer
+
+        :raises ValueError: If there is no anatomy anatomy_id
+        """
+        geometry = self.geometry(anatomy_id)
+        return self.derived(anatomy_id, ('target_pool', edge_buffer),
+                            lambda _outline: TargetPool(geometry,
+                                                        edge_buffer))
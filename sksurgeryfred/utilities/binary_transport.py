@@ -0,0 +1,226 @@
+"""A compact binary alternative to json for the arrays sent to and
+from the server, readable without copying using numpy.frombuffer
+
+A message is an 8 byte header, the magic b'FRED', a version byte, the
+number of entries and two reserved bytes, followed by the entries.
+Each entry is the length of its name, a type code, the number of
+dimensions and a reserved byte, then a little endian uint32 per
+dimension, the utf-8 name, padding to a multiple of 8 bytes, the data
+and padding to a multiple of 8 bytes, so every array is aligned.
+"""
+
+import struct
+
+import numpy as np
+
+#: The mime type of binary messages
+OCTET_STREAM = 'application/octet-stream'
+
+MAGIC = b'FRED'
+VERSION = 1
+
+#: The type code of utf-8 text entries
+TEXT_CODE = 0
+
+#: The numpy dtype of each type code, all little endian
+DTYPES = {
+    1: np.dtype('<f4'),
+    2: np.dtype('<i2'),
+    3: np.dtype('<f8'),
+    4: np.dtype('u1'),
+    5: np.dtype('<i4'),
+    6: np.dtype('?'),
+    }
+
+_CODES = {dtype: code for code, dtype in DTYPES.items()}
+_HEADER = struct.Struct('<4sBBH')
+_ENTRY = struct.Struct('<BBBx')
+
+
+def _padding(length):
+    """Returns the bytes to pad length to a multiple of 8"""
+    return b'\0' * (-length % 8)
+
+
+def encode_arrays(arrays):
+    """
+    Encodes named arrays and text as a binary message
+
+    :param arrays: dictionary of numpy arrays, of the dtypes in DTYPES,
+        or strings, by name
+    :returns: the message as bytes
+    :raises ValueError: If an array's dtype is not supported or there
+        are too many entries, names or dimensions
+    """
+    if len(arrays) > 255:
+        raise ValueError("A message holds at most 255 entries")
+    parts = [_HEADER.pack(MAGIC, VERSION, len(arrays), 0)]
+    for name, array in arrays.items():
+        encoded_name = name.encode()
+        if isinstance(array, str):
+            code = TEXT_CODE
+            data = array.encode()
+            shape = (len(data),)
+        else:
+            array = np.asarray(array)
+            try:
+                code = _CODES[array.dtype.newbyteorder('<')]
+            except KeyError:
+                raise ValueError("Unsupported dtype ", array.dtype,
+                                 " for ", name) from KeyError
+            data = np.ascontiguousarray(array, dtype=DTYPES[code]).tobytes()
+            shape = array.shape
+        if len(encoded_name) > 255 or len(shape) > 255:
+            raise ValueError("Name or number of dimensions too long for ",
+                             name)
+        entry = _ENTRY.pack(len(encoded_name), code, len(shape)) + \
+                    struct.pack('<' + 'I' * len(shape), *shape) + \
+                    encoded_name
+        parts += [entry, _padding(len(entry)), data, _padding(len(data))]
+    return b''.join(parts)
+
+
+def decode_arrays(buffer):
+    """
+    Decodes a binary message. The arrays are read only views of
+    buffer, not copies.
+
+    :param buffer: bytes, or any object supporting the buffer protocol
+    :returns: dictionary of numpy arrays or strings, by name
+    :raises ValueError: If buffer is not a valid message
+    """
+    buffer = memoryview(buffer).cast('B')
+    if len(buffer) < _HEADER.size:
+        raise ValueError("Message too short for its header")
+    magic, version, count, _reserved = _HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a version ", VERSION, " message")
+
+    arrays = {}
+    offset = _HEADER.size
+    try:
+        for _ in range(count):
+            start = offset
+            name_length, code, ndim = _ENTRY.unpack_from(buffer, offset)
+            offset += _ENTRY.size
+            shape = struct.unpack_from('<' + 'I' * ndim, buffer, offset)
+            offset += 4 * ndim
+            name = bytes(buffer[offset:offset + name_length]).decode()
+            offset += name_length
+            offset += -(offset - start) % 8
+
+            if code == TEXT_CODE:
+                if ndim != 1:
+                    raise ValueError("Text entry ", name,
+                                     " should have one dimension")
+                dtype = None
+                length = shape[0]
+            else:
+                dtype = DTYPES[code]
+                length = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+            if offset + length > len(buffer):
+                raise ValueError("Message too short for entry ", name)
+
+            if dtype is None:
+                arrays[name] = bytes(buffer[offset:offset + length]).decode()
+            else:
+                arrays[name] = np.frombuffer(
+                    buffer, dtype=dtype, count=length // dtype.itemsize,
+                    offset=offset).reshape(shape)
+            offset += length + (-length % 8)
+    except (struct.error, KeyError, UnicodeDecodeError) as error:
+        raise ValueError("Malformed message") from error
+    return arrays
+
+
+def encode_values(values, float_dtype='<f4'):
+    """
+    Encodes a dictionary of the kind returned as json. Floats become
+    float_dtype, integers int32 and booleans bool, nested dictionaries
+    are flattened with '.' separated names, and None is left out.
+
+    :param values: dictionary of numbers, lists, arrays, strings,
+        dictionaries or None, by name
+    :param float_dtype: the dtype of floating point values, defaults
+        to little endian float32
+    :returns: the message as bytes
+    """
+    return encode_arrays(_flatten(values, '', np.dtype(float_dtype)))
+
+
+def _flatten(values, prefix, float_dtype):
+    """Returns values as a flat dictionary of arrays and strings"""
+    arrays = {}
+    for name, value in values.items():
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            arrays.update(_flatten(value, prefix + name + '.', float_dtype))
+            continue
+        if not isinstance(value, str):
+            value = np.asarray(value)
+            if value.dtype.kind == 'f':
+                value = value.astype(float_dtype)
+            elif value.dtype.kind in 'iu' and \
+                    value.dtype.newbyteorder('<') not in _CODES:
+                value = value.astype('<i4')
+        arrays[prefix + name] = value
+    return arrays
+
+
+def decode_values(buffer):
+    """
+    Decodes a message made by encode_values, turning zero dimensional
+    arrays back to numbers and '.' separated names back to nested
+    dictionaries. Other arrays are views of buffer.
+
+    :param buffer: bytes, or any object supporting the buffer protocol
+    :returns: dictionary of values
+    :raises ValueError: If buffer is not a valid message, or its names
+        collide, such as 'a' and 'a.b'
+    """
+    values = {}
+    for name, array in decode_arrays(buffer).items():
+        if not isinstance(array, str) and array.ndim == 0:
+            array = array.item()
+        *parents, leaf = name.split('.')
+        nested = values
+        for parent in parents:
+            nested = nested.setdefault(parent, {})
+            if not isinstance(nested, dict):
+                raise ValueError("Entry name ", name, " collides with ",
+                                 parent)
+        if leaf in nested:
+            raise ValueError("Entry name ", name, " collides with another")
+        nested[leaf] = array
+    return values
+
+
+def delta_encode(points):
+    """
+    Delta encodes integer points, such as a contour, as int16. The
+    first point is kept and each after it is replaced by its
+    difference from the one before.
+
+    :param points: NxD integer valued ndarray
+    :returns: NxD int16 ndarray
+    :raises ValueError: If the points are not integers or a difference
+        does not fit in int16
+    """
+    points = np.asarray(points)
+    if not np.array_equal(points, np.round(points)):
+        raise ValueError("Only integer points can be delta encoded")
+    deltas = np.diff(points.astype(np.int64), axis=0, prepend=0)
+    if np.any(np.abs(deltas) > np.iinfo(np.int16).max):
+        raise ValueError("Points too far apart to delta encode as int16")
+    return deltas.astype('<i2')
+
+
+def delta_decode(deltas):
+    """
+    Reverses delta_encode
+
+    :param deltas: NxD int16 ndarray
+    :returns: NxD int64 ndarray of points
+    """
+    return np.cumsum(deltas, axis=0, dtype=np.int64)
@@ -0,0 +1,236 @@
+"""Per endpoint request metrics, counts, latency and payload size
+histograms and error counts, rendered in Prometheus text format"""
+
+from bisect import bisect_left
+import threading
+
+#: Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+#: Upper bounds of the payload size histogram buckets, in bytes
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+#: The content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#: How many threads register between sweeps for finished threads
+RETIRE_EVERY = 64
+
+
+class EndpointStats():
+    """
+    The counts and histograms for one endpoint and method
+    """
+    def __init__(self):
+        self.statuses = {}
+        self.errors = 0
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.request_size_counts = [0] * (len(SIZE_BUCKETS) + 1)
+        self.request_size_sum = 0
+        self.response_size_counts = [0] * (len(SIZE_BUCKETS) + 1)
+        self.response_size_sum = 0
+
+    @property
+    def count(self):
+        """The number of requests"""
+        return sum(self.statuses.values())
+
+    def record(self, status, duration, request_size, response_size):
+        """
+        Adds one request
+
+        :params status: the http status code of the response
+        :params duration: the time taken in seconds
+        :params request_size: the request body size in bytes
+        :params response_size: the response body size in bytes
+        """
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status >= 500:
+            self.errors += 1
+        self.latency_counts[bisect_left(LATENCY_BUCKETS, duration)] += 1
+        self.latency_sum += duration
+        self.request_size_counts[bisect_left(SIZE_BUCKETS,
+                                             request_size)] += 1
+        self.request_size_sum += request_size
+        self.response_size_counts[bisect_left(SIZE_BUCKETS,
+                                              response_size)] += 1
+        self.response_size_sum += response_size
+
+    def merge(self, other):
+        """
+        Adds the counts of another EndpointStats to these
+        """
+        for status, count in list(other.statuses.items()):
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.errors += other.errors
+        for counts, other_counts in (
+                (self.latency_counts, other.latency_counts),
+                (self.request_size_counts, other.request_size_counts),
+                (self.response_size_counts, other.response_size_counts)):
+            for i, count in enumerate(other_counts):
+                counts[i] += count
+        self.latency_sum += other.latency_sum
+        self.request_size_sum += other.request_size_sum
+        self.response_size_sum += other.response_size_sum
+
+
+class RequestMetrics():
+    """
+    Collects request metrics with no locking when recording. Each
+    thread records into its own buckets, which are only summed when
+    the metrics are rendered, so the cost per request is a few
+    dictionary and list updates whether or not anyone scrapes them.
+    A thread takes the lock once, to append its buckets when it first
+    records. Buckets of threads that have finished are folded into a
+    retired total when the metrics are collected, and by every
+    RETIRE_EVERY'th thread to register, so thread per request servers
+    hold at most about RETIRE_EVERY finished threads' buckets even if
+    nobody scrapes, at a constant amortised cost per registration.
+    """
+    def __init__(self, prefix='fred'):
+        """
+        :params prefix: the prefix of the metric names
+        """
+        self.prefix = prefix
+        self._local = threading.local()
+        self._buckets = []
+        self._retired = {}
+        self._registrations = 0
+        self._lock = threading.Lock()
+
+    def _thread_buckets(self):
+        """Returns the current thread's buckets, registering them once"""
+        buckets = getattr(self._local, 'buckets', None)
+        if buckets is None:
+            buckets = {}
+            self._local.buckets = buckets
+            with self._lock:
+                self._buckets.append((threading.current_thread(), buckets))
+                self._registrations += 1
+                if self._registrations % RETIRE_EVERY == 0:
+                    self._retire_finished()
+        return buckets
+
+    def _retire_finished(self):
+        """
+        Folds the buckets of finished threads into the retired total.
+        Call with the lock held.
+        """
+        live = []
+        for thread, buckets in self._buckets:
+            if thread.is_alive():
+                live.append((thread, buckets))
+            else:
+                _merge_into(self._retired, buckets)
+        self._buckets = live
+
+    def record(self, endpoint, method, status, duration, request_size=0,
+               response_size=0):
+        """
+        Records one request
+
+        :params endpoint: the name of the endpoint
+        :params method: the http method
+        :params status: the http status code of the response
+        :params duration: the time taken in seconds
+        :params request_size: the request body size in bytes
+        :params response_size: the response body size in bytes
+        """
+        buckets = self._thread_buckets()
+        stats = buckets.get((endpoint, method))
+        if stats is None:
+            stats = EndpointStats()
+            buckets[(endpoint, method)] = stats
+        stats.record(status, duration, request_size, response_size)
+
+    def collect(self):
+        """
+        Sums the buckets of every thread
+
+        :returns: dictionary of EndpointStats keyed by (endpoint, method)
+        """
+        with self._lock:
+            self._retire_finished()
+            live = self._buckets
+            totals = {}
+            _merge_into(totals, self._retired)
+        for _thread, buckets in live:
+            _merge_into(totals, buckets)
+        return totals
+
+    def render(self):
+        """
+        Returns the metrics in Prometheus text format
+        """
+        totals = self.collect()
+        keys = sorted(totals)
+        name = self.prefix + '_http_requests_total'
+        lines = ['# HELP ' + name + ' Requests by endpoint, method and '
+                 'status.', '# TYPE ' + name + ' counter']
+        for key in keys:
+            for status, count in sorted(totals[key].statuses.items()):
+                lines.append(name + _labels(key, status=status) +
+                             ' ' + str(count))
+
+        name = self.prefix + '_http_request_errors_total'
+        lines += ['# HELP ' + name + ' Requests with a 5xx status.',
+                  '# TYPE ' + name + ' counter']
+        for key in keys:
+            lines.append(name + _labels(key) + ' ' + str(totals[key].errors))
+
+        for name, help_text, bounds, attribute in (
+                ('_http_request_duration_seconds', 'Request latency.',
+                 LATENCY_BUCKETS, 'latency'),
+                ('_http_request_size_bytes', 'Request body size.',
+                 SIZE_BUCKETS, 'request_size'),
+                ('_http_response_size_bytes', 'Response body size.',
+                 SIZE_BUCKETS, 'response_size')):
+            name = self.prefix + name
+            lines += ['# HELP ' + name + ' ' + help_text,
+                      '# TYPE ' + name + ' histogram']
+            for key in keys:
+                stats = totals[key]
+                lines += _histogram(
+                    name, key, bounds,
+                    getattr(stats, attribute + '_counts'),
+                    getattr(stats, attribute + '_sum'))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _merge_into(totals, buckets):
+    """Adds buckets of EndpointStats to totals"""
+    for key, stats in list(buckets.items()):
+        if key not in totals:
+            totals[key] = EndpointStats()
+        totals[key].merge(stats)
+
+
+def _labels(key, **extra):
+    """Returns the Prometheus labels for an (endpoint, method) key"""
+    endpoint, method = key
+    labels = [('endpoint', endpoint), ('method', method)]
+    labels += sorted(extra.items())
+    return '{' + ','.join(name + '="' + _escape(value) + '"'
+                          for name, value in labels) + '}'
+
+
+def _escape(value):
+    """Escapes a label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _histogram(name, key, bounds, counts, total):
+    """Returns the Prometheus lines of one histogram"""
+    lines = []
+    cumulative = 0
+    for bound, count in zip(list(bounds) + ['+Inf'], counts):
+        cumulative += count
+        lines.append(name + '_bucket' + _labels(key, le=bound) + ' ' +
+                     str(cumulative))
+    lines.append(name + '_sum' + _labels(key) + ' ' + repr(total))
+    lines.append(name + '_count' + _labels(key) + ' ' + str(cumulative))
+    return lines
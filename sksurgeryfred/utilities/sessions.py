@@ -0,0 +1,187 @@
+"""Server side registration sessions, so the client need only send
+each new fiducial rather than the whole fiducial history"""
+
+from collections import OrderedDict
+import threading
+import time
+
+import numpy as np
+
+from sksurgeryfred.algorithms.fle import FLE
+from sksurgeryfred.algorithms.point_based_reg import IncrementalRegistration
+
+
+class RegistrationSession():
+    """
+    Holds the target, the fiducial localisation errors and the
+    fiducials placed so far for one registration.
+    """
+    def __init__(self, target, fixed_fle_esv, moving_fle_esv,
+                 fixed_fle, moving_fle, max_fiducials=100,
+                 fixed_fle_covariance=None, moving_fle_covariance=None):
+        """
+        :params target: 1x3 target point
+        :params fixed_fle_esv: the expected squared value of the fixed
+            image fle
+        :params moving_fle_esv: the expected squared value of the moving
+            image fle
+        :params fixed_fle: an FLE to perturb the fixed (intra-op) fiducials
+        :params moving_fle: an FLE to perturb the moving (pre-op) fiducials
+        :params max_fiducials: the most fiducials the session will hold
+        :params fixed_fle_covariance: 3x3 covariance of anisotropic
+            fixed image fle, used for the expected errors if given
+        :params moving_fle_covariance: 3x3 covariance of anisotropic
+            moving image fle, used for the expected errors if given
+        """
+        self.registration = IncrementalRegistration(
+            target, fixed_fle_esv, moving_fle_esv,
+            fixed_fle_covariance=fixed_fle_covariance,
+            moving_fle_covariance=moving_fle_covariance)
+        self.fixed_fle = fixed_fle
+        self.moving_fle = moving_fle
+        self.max_fiducials = max_fiducials
+        self.fixed_fids = []
+        self.moving_fids = []
+        self.lock = threading.Lock()
+
+    def add_fiducial(self, position):
+        """
+        Perturbs a fiducial position with each image's FLE, adds it
+        to the registration and re-registers.
+
+        :params position: the true position of the fiducial
+        :returns: the fixed fiducial, the moving fiducial and the
+            registration result list, or None, None, None if the
+            session is full.
+        """
+        with self.lock:
+            if len(self.fixed_fids) >= self.max_fiducials:
+                return None, None, None
+            fixed_fid = self.fixed_fle.perturb_fiducial(position)
+            moving_fid = self.moving_fle.perturb_fiducial(position)
+            self.registration.add_fiducial(fixed_fid, moving_fid)
+            self.fixed_fids.append(fixed_fid)
+            self.moving_fids.append(moving_fid)
+            return fixed_fid, moving_fid, self.registration.register()
+
+    def register(self):
+        """
+        Registers the fiducials placed so far
+
+        :returns: the registration result list
+        """
+        with self.lock:
+            return self.registration.register()
+
+
+def make_session(target, fixed_fle_esv, moving_fle_esv, #pylint: disable=too-many-arguments
+                 fixed_ind_fle, moving_ind_fle,
+                 fixed_sys_fle, moving_sys_fle, max_fiducials=100,
+                 seed_sequence=None, fixed_fle_covariance=None,
+                 moving_fle_covariance=None):
+    """
+    Creates a RegistrationSession from the values the client uses
+    for /register and /placefiducial
+
+    :params seed_sequence: a numpy SeedSequence to spawn independent
+        random generators for the session's FLEs from. Defaults to
+        None, using numpy's global random state.
+    :returns: a RegistrationSession
+    """
+    fixed_seed = None
+    moving_seed = None
+    if seed_sequence is not None:
+        fixed_seed, moving_seed = seed_sequence.spawn(2)
+
+    target = np.array(target, dtype=np.float64).reshape(1, 3)
+    fixed_fle = FLE(independent_fle=np.array(fixed_ind_fle),
+                    systematic_fle=np.array(fixed_sys_fle),
+                    random_generator=fixed_seed)
+    moving_fle = FLE(independent_fle=np.array(moving_ind_fle),
+                     systematic_fle=np.array(moving_sys_fle),
+                     random_generator=moving_seed)
+    return RegistrationSession(target, fixed_fle_esv, moving_fle_esv,
+                               fixed_fle, moving_fle, max_fiducials,
+                               fixed_fle_covariance, moving_fle_covariance)
+
+
+class SessionStore():
+    """
+    A thread safe store of sessions, keyed by reference. Sessions
+    that have not been used for time_to_live seconds expire, and
+    when the store is full the least recently used session is
+    evicted. Together with the per session fiducial limit this
+    caps the memory used.
+    """
+    def __init__(self, max_sessions=1000, time_to_live=3600.0,
+                 timer=time.monotonic):
+        """
+        :params max_sessions: the most sessions to hold
+        :params time_to_live: seconds after last use before a session
+            expires
+        :params timer: a function returning the current time in seconds
+        :raises ValueError: If max_sessions is less than 1
+        """
+        if max_sessions < 1:
+            raise ValueError("max_sessions must be at least 1")
+        self.max_sessions = max_sessions
+        self.time_to_live = time_to_live
+        self.timer = timer
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _expire(self, now):
+        """Removes expired sessions, which are the least recently used"""
+        while self._sessions:
+            reference, (last_used, _session) = next(
+                iter(self._sessions.items()))
+            if now - last_used < self.time_to_live:
+                break
+            del self._sessions[reference]
+
+    def add(self, reference, session):
+        """
+        Adds a session. A reference can't be reused until its session
+        is removed or expires, so one client can't replace another's
+        session.
+
+        :params reference: the key for the session
+        :params session: the session
+        :raises ValueError: If there is already a session for reference
+        """
+        with self._lock:
+            now = self.timer()
+            self._expire(now)
+            if reference in self._sessions:
+                raise ValueError("There is already a session for ",
+                                 reference)
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+            self._sessions[reference] = (now, session)
+
+    def get(self, reference):
+        """
+        Returns the session for reference and marks it as used
+
+        :params reference: the key for the session
+        :returns: the session, or None if it is missing or expired
+        """
+        with self._lock:
+            now = self.timer()
+            self._expire(now)
+            entry = self._sessions.pop(reference, None)
+            if entry is None:
+                return None
+            self._sessions[reference] = (now, entry[1])
+            return entry[1]
+
+    def remove(self, reference):
+        """
+        Removes the session for reference, if present
+        """
+        with self._lock:
+            self._sessions.pop(reference, None)
@@ -10,6 +10,7 @@ var intraOpContour = [[200,100], [300,100], [300,400], [200, 400] ];
 var canvasScale = 4; //scale the canvases so we can zoom in
 var dbreference = 0; //reference to the database document
 var reg_dbreference = 0; //reference to a specific registration
+var sessionreference = null; //reference to the registration session
 
 //arrays of the results, decided to store these locally, to 
 //avoid problems when we're not connected to a data base, and 
@@ -47,15 +48,36 @@ intraOpTargetCanvas.addEventListener("click", intraOpImageClick)
 
 async function loadDefaultContour() {
   console.log("Default contour");
+  //send the ETag of any contour we already hold, so the server can
+  //reply 304 Not Modified rather than sending it again
+  var headers = {};
+  var cachedETag = localStorage.getItem("defaultContourETag");
+  var cachedContour = localStorage.getItem("defaultContour");
+  if (cachedETag && cachedContour)
+    headers["If-None-Match"] = cachedETag;
   fetch("/defaultcontour", {
     method: "POST",
+    headers: headers,
     })
     .then(resp => {
       console.log("resp");
-      if (resp.ok)
+      if (resp.status == 304) {
+        intraOpContour = JSON.parse(cachedContour);
+        drawOutline(intraOpContour);
+      }
+      else if (resp.ok)
         resp.json().then(data => {
           intraOpContour = data.contour;
           drawOutline(intraOpContour);
+          try {
+            localStorage.setItem("defaultContour",
+                                 JSON.stringify(intraOpContour));
+            localStorage.setItem("defaultContourETag",
+                                 resp.headers.get("ETag"));
+          }
+          catch (err) {
+            console.log("Could not cache the default contour", err.message);
+          }
       });
     })
     .catch(err => {
@@ -94,8 +116,7 @@ function hideGameElements(){
 async function startup() {
     const result = await loadDefaultContour();	
     console.log(result);
-    resetTarget();
-    init_fles();
+    init_fles().then(resetTarget);
     initdatabase();
     hideGameElements();
     hide(document.getElementById('submitScoreForm'));
@@ -295,10 +316,9 @@ function switchToChartView(){
 
 function reset(){
   console.log('reset');
-  resetTarget();
   clearCanvas(intraOpTargetCanvas);
   clearCanvas(intraOpFiducialCanvas);
-  init_fles();
+  init_fles().then(resetTarget);
   expectedFLEText.innerHTML=Math.round(Math.sqrt(FLE.intraOpFLEEAV)*100)/100;
 
   preOpFids.length = 0;
@@ -323,11 +343,15 @@ function placeFiducial(x, y) {
 		      "pre_op_ind_fle": FLE.preOpFLEStdDev, 
 		      "intra_op_ind_fle": FLE.intraOpFLEStdDev,
 		      "pre_op_sys_fle": FLE.preOpSysError, 
-		      "intra_op_sys_fle": FLE.intraOpSysError})
+		      "intra_op_sys_fle": FLE.intraOpSysError,
+		      "reference": sessionreference || undefined})
     })
     .then(resp => {
       if (resp.ok)
         resp.json().then(data => {
+	  //the session has expired, so register without it
+	  if ( sessionreference && ! data.session )
+		  sessionreference = null;
 	  if ( data.valid_fid ) {
           var intraOpFid = data.fixed_fid;
           var preOpFid = data.moving_fid;
@@ -341,7 +365,10 @@ function placeFiducial(x, y) {
 	  preOpFids.push(preOpFid);
 	  intraOpFids.push(intraOpFid);
 	  noFidsText.innerHTML=intraOpFids.length;
-	  register();
+	  if ( data.session )
+		  showRegistration(data.registration);
+	  else
+		  register();
 	  };
       });
     })
@@ -369,7 +396,22 @@ function register(){
     })
     .then(resp => {
       if (resp.ok)
-        resp.json().then(data => {
+        resp.json().then(showRegistration);
+    })
+    .catch(err => {
+      console.log("error");
+
+      console.log("An error occured during registration", err.message);
+      window.alert("An error occured during registration");
+    });
+
+}
+
+/**
+ * Shows and stores a registration result, from /register or
+ * from /placefiducial with a session
+ */
+function showRegistration(data){
 		if ( data.success ){
 		  results.push([data.actual_tre, data.fre, data.expected_tre, data.expected_fre, data.mean_fle, data.no_fids]);
 		  clearCanvas(intraOpTargetCanvas);
@@ -389,15 +431,6 @@ function register(){
 			  enable_ablation()
 		  };
 		};
-	});
-    })
-    .catch(err => {
-      console.log("error");
-
-      console.log("An error occured during registration", err.message);
-      window.alert("An error occured during registration");
-    });
-
 }
 
 function writeresults(actual_tre, fre, expected_tre, expected_fre, mean_fle, no_fids){
@@ -460,6 +493,7 @@ function initdatabase(){
 
 function resetTarget() {
   console.log("reset target called");
+  sessionreference = null;
   fetch("/gettarget", {
       method: "POST",
       headers: {
@@ -482,6 +516,7 @@ function resetTarget() {
           noFidsText.innerHTML="0"
 
 	  disable_ablation();
+	  initsession();
       });
     })
     .catch(err => {
@@ -493,16 +528,49 @@ function resetTarget() {
 
 }
 
+/**
+ * Starts a registration session for the target and FLE, so each
+ * fiducial placed is registered by /placefiducial without sending
+ * the others. Without a session fiducials are sent to /register.
+ */
+function initsession() {
+  fetch("/initsession", {
+      method: "POST",
+      headers: {
+	"Content-Type": "application/json"
+      },
+      body: JSON.stringify({
+	      "target" : target,
+	      "preop_fle": FLE.preOpFLEEAV,
+	      "intraop_fle": FLE.intraOpFLEEAV,
+	      "pre_op_ind_fle": FLE.preOpFLEStdDev,
+	      "intra_op_ind_fle": FLE.intraOpFLEStdDev,
+	      "pre_op_sys_fle": FLE.preOpSysError,
+	      "intra_op_sys_fle": FLE.intraOpSysError})
+    })
+    .then(resp => {
+      if (resp.ok)
+        resp.json().then(data => {
+	  //fiducials placed before the session started aren't in it
+	  if ( data.success && preOpFids.length == 0 )
+		  sessionreference = data.reference;
+      });
+    })
+    .catch(err => {
+      console.log("An error occured starting a session", err.message);
+    });
+}
+
 /**
  * Sets the global fiducial localisation error (FLE)
  */
 function init_fles() {
-  fetch("/getfle", {
+  return fetch("/getfle", {
       method: "POST",
     })
     .then(resp => {
       if (resp.ok)
-        resp.json().then(data => {
+        return resp.json().then(data => {
 	
 	let preOpFLEStdDev = data.moving_fle_sd;
         let intraOpFLEStdDev = data.fixed_fle_sd;
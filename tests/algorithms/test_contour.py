@@ -0,0 +1,152 @@
+# coding=utf-8
+
+"""Fiducial Registration Educational Demonstration tests"""
+import numpy as np
+import pytest
+
+from sksurgeryfred.algorithms import contour
+from sksurgeryfred.algorithms.fred import make_target_point
+
+# Pytest style
+
+def _l_shape():
+    """An L shaped (non convex) outline"""
+    return np.array([[0.0, 0.0], [40.0, 0.0], [40.0, 10.0], [10.0, 10.0],
+                     [10.0, 30.0], [0.0, 30.0]])
+
+
+def test_points_in_polygon():
+    """
+    Points in the L should be inside, points in the notch outside
+    """
+    points = np.array([[5.0, 5.0], [35.0, 5.0], [5.0, 25.0],
+                       [25.0, 25.0], [-1.0, 5.0], [50.0, 5.0]])
+    inside = contour.points_in_polygon(points, _l_shape())
+    assert np.array_equal(inside, [True, True, True, False, False, False])
+
+    #should work for any leading shape
+    inside = contour.points_in_polygon(points.reshape((2, 3, 2)), _l_shape())
+    assert inside.shape == (2, 3)
+
+
+def test_bounded_outline():
+    """
+    Outlines should be Nx2, not too long and within the image
+    """
+    outline = contour.bounded_outline(_l_shape().tolist(), 6, (40, 40))
+    assert np.array_equal(outline, _l_shape())
+    for bad in (_l_shape()[0:2], np.zeros((6, 3)), "outline", [[1.0, {}]],
+                _l_shape() - 1.0, _l_shape() * 2.0):
+        with pytest.raises(ValueError):
+            contour.bounded_outline(bad, 6, (40, 40))
+    with pytest.raises(ValueError):
+        contour.bounded_outline(_l_shape(), 5, (40, 40))
+
+
+def test_contour_geometry():
+    """
+    Geometry should give the bounds, area and containment
+    """
+    with pytest.raises(ValueError):
+        contour.ContourGeometry(np.zeros((2, 2)))
+    with pytest.raises(ValueError):
+        contour.ContourGeometry(np.zeros((5, 3)))
+
+    geometry = contour.ContourGeometry(_l_shape())
+    assert np.array_equal(geometry.minimum, [0.0, 0.0])
+    assert np.array_equal(geometry.maximum, [40.0, 30.0])
+    #the area is 600, the mask counts points strictly inside
+    assert 500 < geometry.area <= 600
+
+    points = np.array([[5.0, 5.0, 0.0], [25.0, 25.0, 0.0],
+                       [-100.0, 5.0, 0.0], [5.0, 100.0, 0.0]])
+    assert np.array_equal(geometry.contains(points),
+                          [True, False, False, False])
+
+    np.random.seed(0)
+    samples = geometry.sample(5000)
+    assert samples.shape == (5000, 2)
+    assert np.all(contour.points_in_polygon(samples, _l_shape()))
+    #uniform, so the long arm (2/3 of the area) should get 2/3 of samples
+    assert np.isclose(np.mean(samples[:, 1] < 10.0), 2.0/3.0, atol=0.03)
+
+    generator = np.random.default_rng(0)
+    samples = geometry.sample(10, generator)
+    assert np.all(contour.points_in_polygon(samples, _l_shape()))
+
+
+def test_geometry_cache():
+    """
+    Geometry and pools should be cached by outline content
+    """
+    geometry = contour.get_contour_geometry(_l_shape())
+    assert contour.get_contour_geometry(_l_shape().tolist()) is geometry
+    assert contour.get_contour_geometry(_l_shape() + 1.0) is not geometry
+
+    pool = contour.get_target_pool(_l_shape(), 0.9)
+    assert contour.get_target_pool(_l_shape(), 0.9) is pool
+    assert contour.get_target_pool(_l_shape(), 0.5) is not pool
+    assert contour.contour_hash(_l_shape()) != \
+                    contour.contour_hash(_l_shape().transpose())
+
+
+def test_target_pool():
+    """
+    Targets should lie in the outline scaled by the edge buffer
+    """
+    pool = contour.TargetPool(contour.ContourGeometry(_l_shape()),
+                              edge_buffer=0.8, pool_size=50,
+                              random_generator=np.random.default_rng(1))
+    targets = np.concatenate([pool.pop() for _ in range(120)])
+    assert targets.shape == (120, 3)
+    assert np.all(targets[:, 2] == 0.0)
+    assert np.all(contour.points_in_polygon(targets[:, 0:2], _l_shape()))
+    assert np.all(pool.region.contains(targets))
+
+    #with no generator given, numpy's global random state is untouched
+    np.random.seed(0)
+    state = np.random.get_state()[1].copy()
+    contour.TargetPool(contour.ContourGeometry(_l_shape())).pop()
+    assert np.array_equal(np.random.get_state()[1], state)
+
+    with pytest.raises(ValueError):
+        contour.ContourGeometry([[0.0, 0.0], [np.inf, 0.0], [0.0, 1.0]])
+
+
+def test_target_pool_no_overlap():
+    """
+    A pool whose region misses the outline should raise, not loop
+    """
+    angles = np.linspace(0.0, 2.0 * np.pi, 100)
+    circle = np.stack([np.cos(angles), np.sin(angles)], axis=-1)
+    ring = np.concatenate([200.0 * circle, 195.0 * circle[::-1]])
+    pool = contour.TargetPool(contour.ContourGeometry(ring),
+                              random_generator=np.random.default_rng(0))
+    with pytest.raises(ValueError):
+        pool.pop()
+
+
+def test_make_target_point():
+    """
+    Targets should lie inside the brain outline
+    """
+    outline = np.load('static/brain512.npy')
+    targets = np.concatenate([make_target_point(outline)
+                              for _ in range(300)])
+    assert targets.shape == (300, 3)
+    assert np.all(targets[:, 2] == 0.0)
+    assert np.all(contour.points_in_polygon(targets[:, 0:2], outline))
+
+
+def test_rasterise_polygon():
+    """
+    Rasterising should match points_in_polygon at every grid point
+    """
+    outline = np.load('static/brain512.npy')
+    origin = np.array([20, 40])
+    shape = (490, 370)
+    grid = np.stack(np.meshgrid(np.arange(shape[0]) + origin[0],
+                                np.arange(shape[1]) + origin[1],
+                                indexing='ij'), axis=-1)
+    assert np.array_equal(contour.rasterise_polygon(outline, origin, shape),
+                          contour.points_in_polygon(grid, outline))
@@ -1,6 +1,7 @@
 # coding=utf-8
 
 """Fiducial Registration Educational Demonstration tests"""
+import pytest
 import numpy as np
 
 import sksurgeryfred.algorithms.errors as e2d
@@ -115,3 +116,158 @@ def test_expected_absolute_value_3d():
         assert np.isclose(eav, arith_eav, atol=0.0, rtol=0.0001)
         assert np.isclose(eav, _eav_by_brute_force(stddevs),
                           atol=0.0, rtol=0.15)
+
+
+def test_tre_map_matches_targets():
+    """
+    Tests that each element of the expected TRE map matches the
+    expected TRE at that point
+    """
+    fiducials = np.array([[100.0, 120.0, 0.0],
+                          [300.0, 150.0, 0.0],
+                          [200.0, 380.0, 0.0],
+                          [260.0, 260.0, 0.0]])
+    centroid = np.mean(fiducials, axis=0)
+    centred = fiducials - centroid
+    scatter = np.matmul(centred.transpose(), centred)
+
+    tre_map = e2d.compute_tre_map(fiducials, 4.0, shape=(64, 48), stride=8)
+    assert tre_map.shape == (8, 6)
+
+    for row, column in [(0, 0), (3, 2), (7, 5), (5, 1)]:
+        target = np.array([column * 8.0, row * 8.0, 0.0])
+        expected = e2d.compute_tre_from_moments(centroid, scatter, 4, 4.0,
+                                                target)
+        assert np.isclose(tre_map[row, column], expected)
+
+    assert np.argmin(tre_map) == np.argmin(e2d.compute_tre_map(
+        fiducials, 1.0, shape=(64, 48), stride=8))
+
+
+def test_tre_map_fle_covariance():
+    """
+    Tests that the expected TRE map with isotropic FLE covariance
+    matches the map from the mean FLE squared
+    """
+    fiducials = np.array([[100.0, 120.0, 0.0],
+                          [300.0, 150.0, 0.0],
+                          [200.0, 380.0, 0.0]])
+    tre_map = e2d.compute_tre_map(fiducials, 6.0, shape=(64, 48), stride=8)
+    assert np.allclose(tre_map, e2d.compute_tre_map(
+        fiducials, 0.0, shape=(64, 48), stride=8,
+        fle_cov=np.eye(3) * 2.0))
+    assert not np.allclose(tre_map, e2d.compute_tre_map(
+        fiducials, 0.0, shape=(64, 48), stride=8,
+        fle_cov=np.diag([5.0, 0.5, 0.5])))
+
+
+def test_tre_map_invalid():
+    """
+    Tests that the expected TRE map needs at least three fiducials
+    """
+    with pytest.raises(ValueError):
+        e2d.compute_tre_map(np.zeros((2, 3)), 1.0)
+    with pytest.raises(ValueError):
+        e2d.compute_tre_map(np.zeros((4, 2)), 1.0)
+
+
+def test_quantise():
+    """
+    Tests quantisation to 8 bits
+    """
+    values = np.linspace(0.0, 10.0, 101)
+    quantised, scale = e2d.quantise(values)
+    assert quantised.dtype == np.uint8
+    assert quantised[-1] == 255
+    assert np.allclose(quantised * scale, values, atol=scale / 2.0)
+
+    quantised, scale = e2d.quantise(np.zeros((3, 3)))
+    assert scale == 0.0
+    assert np.all(quantised == 0)
+
+
+def test_tre_from_fle_many_targets():
+    """
+    Tests expected TRE for many targets against a loop over the
+    principal axes, and against the circle result
+    """
+    fiducials = np.array([[-100.0, -100.0, 0.0],
+                          [100.0, 50.0, 0.0],
+                          [-50.0, 100.0, 0.0],
+                          [20.0, -30.0, 40.0]])
+    targets = np.array([[0.0, 0.0, 0.0],
+                        [150.0, -20.0, 10.0],
+                        [-70.0, 80.0, -30.0]])
+    tre_sq = e2d.compute_tre_from_fle(fiducials, 2.0, targets)
+    assert tre_sq.shape == (3,)
+
+    centroid = np.mean(fiducials, axis=0)
+    _, axes = np.linalg.eigh(np.cov(fiducials.T))
+    for target, result in zip(targets, tre_sq):
+        inner_sum = 0.0
+        for axis in axes.T:
+            f_k_sq = np.mean([np.sum(np.square(np.cross(fid - centroid,
+                                                        axis)))
+                              for fid in fiducials])
+            d_k_sq = np.sum(np.square(np.cross(target - centroid, axis)))
+            inner_sum += d_k_sq / f_k_sq
+        assert np.isclose(result, (2.0 / 4) * (1 + inner_sum / 3.0))
+
+    #at the centroid expected TRE is FLE / N
+    assert np.isclose(e2d.compute_tre_from_fle(
+        fiducials, 2.0, centroid.reshape(1, 3))[0], 0.5)
+
+    assert np.isclose(e2d.compute_fre_from_fle(fiducials, 2.0), 1.0)
+
+
+def test_tre_from_fle_invalid():
+    """
+    Tests expected TRE and FRE input checking
+    """
+    targets = np.zeros((1, 3))
+    with pytest.raises(TypeError):
+        e2d.compute_tre_from_fle([[0.0, 0.0, 0.0]] * 3, 1.0, targets)
+    with pytest.raises(ValueError):
+        e2d.compute_tre_from_fle(np.zeros((3, 2)), 1.0, targets)
+    with pytest.raises(ValueError):
+        e2d.compute_tre_from_fle(np.zeros((2, 3)), 1.0, targets)
+    with pytest.raises(TypeError):
+        e2d.compute_tre_from_fle(np.eye(3), 1.0, [0.0, 0.0, 0.0])
+    with pytest.raises(ValueError):
+        e2d.compute_tre_from_fle(np.eye(3), 1.0, np.zeros(3))
+    with pytest.raises(ValueError):
+        e2d.compute_fre_from_fle(np.zeros((2, 3)), 1.0)
+
+
+def test_tre_from_fle_covariance():
+    """
+    Tests that the general expected TRE and FRE agree with Fitzpatrick's
+    for isotropic FLE, and depend on the direction of anisotropic FLE
+    """
+    fiducials = np.array([[-100.0, -100.0, 0.0],
+                          [100.0, 50.0, 0.0],
+                          [-50.0, 100.0, 0.0],
+                          [20.0, -30.0, 40.0]])
+    targets = np.array([[0.0, 0.0, 0.0],
+                        [150.0, -20.0, 10.0],
+                        [-70.0, 80.0, -30.0]])
+    centroid = np.mean(fiducials, axis=0)
+    centred = fiducials - centroid
+    scatter = np.matmul(centred.transpose(), centred)
+
+    covariance = e2d.fle_covariance(1.0)
+    assert np.array_equal(covariance, np.eye(3))
+    assert np.allclose(e2d.compute_tre_from_fle_covariance(
+        centroid, scatter, 4, covariance, targets),
+                       e2d.compute_tre_from_fle(fiducials, 3.0, targets))
+    assert np.isclose(e2d.compute_fre_from_fle_covariance(
+        scatter, 4, covariance), e2d.compute_fre_from_fle(fiducials, 3.0))
+
+    #fle along z moves the in plane target along z only
+    covariance = e2d.fle_covariance([0.0, 0.0, 2.0])
+    assert np.trace(covariance) == e2d.expected_absolute_value([0, 0, 2])
+    tre_sq = e2d.compute_tre_from_fle_covariance(
+        centroid, scatter, 4, np.stack([covariance, 4.0 * covariance]),
+        targets[0])
+    assert tre_sq.shape == (2,)
+    assert np.isclose(tre_sq[1], 4.0 * tre_sq[0])
@@ -141,3 +141,92 @@ def test_fle_with_custom_function():
     fiducial_location = np.array([1.0, 0.0])
     assert np.array_equal(fixed_fle.perturb_fiducial(fiducial_location),
                           np.array([3.0, 2.0]))
+
+
+def test_perturb_fiducials():
+    """
+    Bulk perturbation should draw the same errors as perturbing one
+    marker at a time
+    """
+    fixed_fle = FLE(independent_fle=np.array([1.0, 2.0, 0.5]),
+                    systematic_fle=np.array([0.0, 1.0, -1.0]))
+    markers = np.random.uniform(0.0, 100.0, size=(4, 5, 3))
+
+    np.random.seed(3)
+    bulk = fixed_fle.perturb_fiducials(markers)
+    assert bulk.shape == (4, 5, 3)
+
+    np.random.seed(3)
+    for batch in range(4):
+        for marker in range(5):
+            assert np.allclose(bulk[batch, marker],
+                               fixed_fle.perturb_fiducial(
+                                   markers[batch, marker]))
+
+    #the errors should have the expected mean and standard deviation
+    np.random.seed(0)
+    samples = fixed_fle.perturb_fiducials(np.zeros((20000, 3)))
+    assert np.allclose(np.mean(samples, axis=0), [0.0, 1.0, -1.0],
+                       atol=0.05)
+    assert np.allclose(np.std(samples, axis=0), [1.0, 2.0, 0.5], rtol=0.05)
+
+    with pytest.raises(ValueError):
+        fixed_fle.perturb_fiducials(np.zeros((4, 2)))
+
+
+def test_perturb_fiducials_custom():
+    """
+    Bulk perturbation should call custom functions once per marker
+    """
+    calls = []
+    def my_ind():
+        calls.append(1)
+        return np.full(2, float(len(calls)), dtype=np.float64)
+
+    fixed_fle = FLE(ind_fle_function=my_ind,
+                    sys_fle_function=lambda: np.array([1.0, 0.0]),
+                    dimension=2)
+    calls.clear()
+
+    perturbed = fixed_fle.perturb_fiducials(np.zeros((3, 2)))
+    assert len(calls) == 3
+    assert np.array_equal(perturbed, [[2.0, 1.0], [3.0, 2.0], [4.0, 3.0]])
+
+
+def test_fle_random_generator():
+    """
+    FLEs with their own generators should be reproducible and
+    independent of the global random state
+    """
+    markers = np.zeros((10, 3))
+    fle_a = FLE(independent_fle=1.0, random_generator=42)
+    fle_b = FLE(independent_fle=1.0,
+                random_generator=np.random.SeedSequence(42))
+    np.random.seed(0)
+    samples_a = fle_a.perturb_fiducials(markers)
+    np.random.seed(1)
+    samples_b = fle_b.perturb_fiducials(markers)
+    assert np.array_equal(samples_a, samples_b)
+    assert np.array_equal(fle_a.perturb_fiducial(markers[0]),
+                          fle_b.perturb_fiducial(markers[0]))
+
+    generator = np.random.default_rng(7)
+    fle_c = FLE(independent_fle=1.0, random_generator=generator)
+    assert fle_c.random_generator is generator
+    assert fle_c.seed_sequence is None
+
+    #spawned children are independent but reproducible
+    children_a = fle_a.spawn(3)
+    children_b = FLE(independent_fle=1.0, random_generator=42).spawn(3)
+    assert len(children_a) == 3
+    samples = [child.perturb_fiducials(markers) for child in children_a]
+    assert not np.array_equal(samples[0], samples[1])
+    for child, sample in zip(children_b, samples):
+        assert np.array_equal(child.perturb_fiducials(markers), sample)
+
+    #we can spawn from generators and the global state too
+    assert len(fle_c.spawn(2)) == 2
+    assert len(FLE(independent_fle=1.0).spawn(2)) == 2
+
+    with pytest.raises(ValueError):
+        FLE(ind_fle_function=lambda: np.zeros(3)).spawn(2)
@@ -0,0 +1,41 @@
+# coding=utf-8
+
+"""Fiducial Registration Educational Demonstration tests"""
+import numpy as np
+
+from sksurgeryfred.algorithms import fred
+
+# Pytest style
+
+def test_is_valid_fiducial():
+    """
+    Fiducials should be non negative, and inside the outline if given
+    """
+    outline = np.load('static/brain512.npy')
+    assert fred.is_valid_fiducial([0.0, 0.0, 0.0])
+    assert not fred.is_valid_fiducial([-1.0, 0.0, 0.0])
+
+    assert not fred.is_valid_fiducial([0.0, 0.0, 0.0], outline)
+    assert not fred.is_valid_fiducial([-1.0, 250.0, 0.0], outline)
+    assert fred.is_valid_fiducial([250.0, 250.0, 0.0], outline)
+    #the outline is (row, column), so x and y are swapped
+    assert fred.is_valid_fiducial([100.0, 250.0, 0.0], outline)
+    assert not fred.is_valid_fiducial([470.0, 250.0, 0.0], outline)
+
+
+def test_are_valid_fiducials():
+    """
+    Batch validation should match one at a time validation
+    """
+    outline = np.load('static/brain512.npy')
+    np.random.seed(0)
+    locations = np.random.uniform(-20.0, 530.0, size=(50, 40, 3))
+    locations[..., 2] = 0.0
+
+    valid = fred.are_valid_fiducials(locations, outline)
+    assert valid.shape == (50, 40)
+    assert np.any(valid)
+    assert not np.all(valid)
+    for index in np.ndindex(50, 40):
+        assert valid[index] == fred.is_valid_fiducial(locations[index],
+                                                      outline)
@@ -8,6 +8,7 @@ import pytest
 
 from sksurgeryfred.algorithms.errors import expected_absolute_value
 import sksurgeryfred.algorithms.point_based_reg as pbreg
+from sksurgeryfred.algorithms import procrustes
 
 
 def _make_circle_fiducials(no_fids, centre, radius,
@@ -58,7 +59,7 @@ def _run_registrations (pbr, no_fids, centre, radius, fixed_stddevs,
 
 def test_init_with_moving_fle():
     """
-    Init pbr with moving fle should yield non implemented error
+    Moving fle should add to the fixed fle
     """
     fixed_fle_std_dev = np.array([1.0, 1.0, 1.0], dtype=np.float64)
     moving_fle_std_dev = np.array([1.0, 1.0, 1.0], dtype=np.float64)
@@ -68,8 +69,79 @@ def test_init_with_moving_fle():
 
     target = np.array([[0.0, 0.0, 0.0]], dtype=np.float64)
 
-    with pytest.raises(NotImplementedError):
-        pbreg.PointBasedRegistration(target, fixed_fle_easv, moving_fle_easv)
+    pbr = pbreg.PointBasedRegistration(target, fixed_fle_easv,
+                                       moving_fle_easv)
+    assert np.isclose(pbr.mean_fle_squared, 6.0)
+    assert pbr.fle_covariance is None
+
+    fids = np.array([[10.0, 0.0, 0.0], [0.0, 20.0, 0.0], [-10.0, 5.0, 0.0],
+                     [3.0, -8.0, 0.0]])
+    combined = pbreg.PointBasedRegistration(target, 6.0, 0.0)
+    result = pbr.register(fids, fids)
+    expected = combined.register(fids, fids)
+    for index in (2, 3, 4):
+        assert np.isclose(result[index], expected[index])
+
+    with pytest.raises(ValueError):
+        pbreg.PointBasedRegistration(target, 1.0, 0.0,
+                                     fixed_fle_covariance=np.eye(2))
+
+
+def test_pbr_anisotropic_fle():
+    """
+    Expected errors for anisotropic fle on both images should match
+    simulation, and agree across the registration methods
+    """
+    fixed_covariance = np.diag([4.0, 0.25, 1.0])
+    moving_covariance = np.array([[1.0, 0.5, 0.0], [0.5, 1.0, 0.0],
+                                  [0.0, 0.0, 0.2]])
+    target = np.array([[250.0, -30.0, 10.0]], dtype=np.float64)
+
+    pbr = pbreg.PointBasedRegistration(
+        target, 0.0, 0.0, fixed_fle_covariance=fixed_covariance,
+        moving_fle_covariance=moving_covariance)
+    assert np.isclose(pbr.mean_fle_squared, 7.45)
+    assert pbr.fle_covariance is not None
+
+    np.random.seed(3)
+    fids = np.random.uniform(0.0, 200.0, size=(5, 3))
+    fids[:, 2] *= 0.2
+    repeats = 5000
+    fixed_fids = fids + np.matmul(np.random.normal(size=(repeats, 5, 3)),
+                                  np.linalg.cholesky(fixed_covariance).T)
+    moving_fids = fids + np.matmul(np.random.normal(size=(repeats, 5, 3)),
+                                   np.linalg.cholesky(moving_covariance).T)
+
+    results = pbr.register_batch(fixed_fids, moving_fids)
+    [_success, _fre, mean_fle, expected_tre_squared, expected_fre,
+     _transformed_target, _actual_tre, _no_fids] = pbr.register(
+         fixed_fids[0], moving_fids[0])
+    assert np.isclose(mean_fle, 7.45)
+    assert np.isclose(results['expected_tre_squared'][0],
+                      expected_tre_squared)
+    assert np.isclose(results['expected_fre_squared'][0], expected_fre)
+
+    assert np.isclose(np.mean(np.square(results['actual_tre'])),
+                      np.mean(results['expected_tre_squared']), rtol=0.05)
+    assert np.isclose(np.mean(np.square(results['fre'])),
+                      np.mean(results['expected_fre_squared']), rtol=0.05)
+
+    #isotropic fle would get the expected tre wrong
+    isotropic = pbreg.PointBasedRegistration(target, 7.45, 0.0)
+    assert not np.isclose(
+        isotropic.register(fixed_fids[0], moving_fids[0])[3],
+        expected_tre_squared, rtol=0.05)
+
+    inc = pbreg.IncrementalRegistration(
+        target, 0.0, 0.0, fixed_fle_covariance=fixed_covariance,
+        moving_fle_covariance=moving_covariance)
+    for fixed_fid, moving_fid in zip(fixed_fids[0], moving_fids[0]):
+        inc.add_fiducial(fixed_fid, moving_fid)
+    assert np.isclose(inc.register()[3], expected_tre_squared)
+
+    loo = pbr.leave_one_out(fixed_fids[0], moving_fids[0])
+    assert np.isclose(loo['expected_tre_squared'][0], pbr.register(
+        fixed_fids[0, 1:], moving_fids[0, 1:])[3])
 
 
 def test_pbr_3_fids():
@@ -203,3 +275,248 @@ def test_pbr_20_fids_offset_target():
     status, transformed_target = pbr.get_transformed_target()
     assert status
     assert np.allclose(np.transpose(transformed_target), target, atol=1.0)
+
+
+def test_pbr_register_batch():
+    """
+    register_batch should give the same results as repeated calls
+    to register
+    """
+    fixed_fle_std_dev = np.array([1.0, 1.0, 1.0], dtype=np.float64)
+    moving_fle_std_dev = np.array([0.0, 0.0, 0.0], dtype=np.float64)
+
+    fixed_fle_easv = expected_absolute_value(fixed_fle_std_dev)
+
+    target = np.array([[2.0, 1.0, 0.0]], dtype=np.float64)
+
+    pbr = pbreg.PointBasedRegistration(target, fixed_fle_easv, 0.0)
+
+    centre = np.array([0.0, 0.0, 0.0], dtype=np.float64)
+    repeats = 50
+    no_fids = 6
+
+    np.random.seed(0)
+    fixed_fids = np.empty((repeats, no_fids, 3), dtype=np.float64)
+    moving_fids = np.empty((repeats, no_fids, 3), dtype=np.float64)
+    for i in range(repeats):
+        fixed_fids[i], moving_fids[i] = _make_circle_fiducials(
+            no_fids, centre, 20.0, fixed_fle_std_dev, moving_fle_std_dev)
+
+    results = pbr.register_batch(fixed_fids, moving_fids)
+
+    assert results.shape == (repeats,)
+    for i in range(repeats):
+        [success, fre, mean_fle, expected_tre_squared, expected_fre,
+         transformed_target, actual_tre, no_fids_out] = pbr.register(
+             fixed_fids[i], moving_fids[i])
+        assert results['success'][i] == success
+        assert np.isclose(results['fre'][i], fre)
+        assert np.isclose(results['mean_fle_squared'][i], mean_fle)
+        assert np.isclose(results['expected_tre_squared'][i],
+                          expected_tre_squared)
+        assert np.isclose(results['expected_fre_squared'][i], expected_fre)
+        assert np.allclose(results['transformed_target'][i],
+                           transformed_target[:, 0])
+        assert np.isclose(results['actual_tre'][i], actual_tre)
+        assert results['no_fids'][i] == no_fids_out
+
+
+def test_pbr_batch_too_few_fids():
+    """
+    register_batch should return unsuccessful results with fewer than
+    3 fiducials, and raise errors for mismatched inputs
+    """
+    target = np.array([[0.0, 0.0, 0.0]], dtype=np.float64)
+    pbr = pbreg.PointBasedRegistration(target, 1.0, 0.0)
+
+    fids = np.zeros((4, 2, 3), dtype=np.float64)
+    results = pbr.register_batch(fids, fids)
+    assert not np.any(results['success'])
+    assert np.all(results['no_fids'] == 2)
+    assert np.all(results['actual_tre'] == 0.0)
+
+    with pytest.raises(ValueError):
+        pbr.register_batch(np.zeros((4, 3, 3)), np.zeros((4, 4, 3)))
+    with pytest.raises(TypeError):
+        pbr.register_batch(fids.tolist(), fids)
+
+
+def test_incremental_registration():
+    """
+    Incremental registration should match register as fiducials
+    are added and removed
+    """
+    fixed_fle_std_dev = np.array([2.0, 2.0, 2.0], dtype=np.float64)
+    fixed_fle_easv = expected_absolute_value(fixed_fle_std_dev)
+    target = np.array([[120.0, 230.0, 0.0]], dtype=np.float64)
+
+    pbr = pbreg.PointBasedRegistration(target, fixed_fle_easv, 0.0)
+    inc = pbreg.IncrementalRegistration(target, fixed_fle_easv, 0.0)
+
+    status, transformed_target = inc.get_transformed_target()
+    assert not status
+    assert transformed_target is None
+
+    np.random.seed(1)
+    moving_fids = np.random.uniform(50.0, 450.0, size=(12, 3))
+    moving_fids[:, 2] = 0.0
+    fixed_fids = moving_fids + np.random.normal(scale=fixed_fle_std_dev,
+                                                size=(12, 3))
+
+    for no_fids in range(1, 13):
+        inc.add_fiducial(fixed_fids[no_fids - 1], moving_fids[no_fids - 1])
+        expected = pbr.register(fixed_fids[0:no_fids],
+                                moving_fids[0:no_fids])
+        result = inc.register()
+        assert result[0] == expected[0]
+        assert result[7] == no_fids
+        for index in (1, 2, 3, 4, 6):
+            assert np.isclose(result[index], expected[index])
+        assert np.allclose(result[5], expected[5])
+
+    status, transformed_target = inc.get_transformed_target()
+    assert status
+    assert np.allclose(transformed_target, target.transpose(), atol=5.0)
+
+    #remove the first four fiducials, out of order
+    for index in (2, 0, 3, 1):
+        inc.remove_fiducial(fixed_fids[index], moving_fids[index])
+    expected = pbr.register(fixed_fids[4:], moving_fids[4:])
+    result = inc.register()
+    assert result[7] == 8
+    for index in (1, 4, 6):
+        assert np.isclose(result[index], expected[index])
+    assert np.allclose(result[5], expected[5])
+
+    for index in range(4, 12):
+        inc.remove_fiducial(fixed_fids[index], moving_fids[index])
+    assert not inc.register()[0]
+    with pytest.raises(ValueError):
+        inc.remove_fiducial(fixed_fids[0], moving_fids[0])
+
+    inc.reinit(target, fixed_fle_easv, 1.0)
+    assert inc.mean_fle_squared == fixed_fle_easv + 1.0
+
+
+def test_pbr_leave_one_out():
+    """
+    leave_one_out should match registering without each fiducial,
+    and pick out an outlying fiducial
+    """
+    target = np.array([[220.0, 240.0, 0.0]], dtype=np.float64)
+    pbr = pbreg.PointBasedRegistration(target, 3.0, 0.0)
+
+    np.random.seed(2)
+    moving_fids = np.random.uniform(50.0, 450.0, size=(8, 3))
+    moving_fids[:, 2] = 0.0
+    fixed_fids = moving_fids + np.random.normal(scale=1.0, size=(8, 3))
+    fixed_fids[5] += np.array([30.0, -20.0, 0.0])
+
+    results = pbr.leave_one_out(fixed_fids, moving_fids)
+    assert results.shape == (8,)
+    for index in range(8):
+        keep = np.arange(8) != index
+        [success, fre, mean_fle, expected_tre_squared, expected_fre,
+         transformed_target, actual_tre, no_fids_out] = pbr.register(
+             fixed_fids[keep], moving_fids[keep])
+        assert results['success'][index] == success
+        assert np.isclose(results['fre'][index], fre, atol=1e-6)
+        assert np.isclose(results['mean_fle_squared'][index], mean_fle)
+        assert np.isclose(results['expected_tre_squared'][index],
+                          expected_tre_squared)
+        assert np.isclose(results['expected_fre_squared'][index],
+                          expected_fre)
+        assert np.allclose(results['transformed_target'][index],
+                           transformed_target[:, 0])
+        assert np.isclose(results['actual_tre'][index], actual_tre)
+        assert results['no_fids'][index] == no_fids_out == 7
+
+    assert np.argmin(results['fre']) == 5
+
+    results = pbr.leave_one_out(fixed_fids[0:3], moving_fids[0:3])
+    assert not np.any(results['success'])
+    with pytest.raises(ValueError):
+        pbr.leave_one_out(fixed_fids, moving_fids[0:4])
+    with pytest.raises(TypeError):
+        pbr.leave_one_out(fixed_fids.tolist(), moving_fids)
+
+
+def test_incremental_non_planar():
+    """
+    Incremental registration should switch between the planar and
+    SVD solvers as fiducials off the plane come and go
+    """
+    target = np.array([[20.0, 30.0, 0.0]], dtype=np.float64)
+    pbr = pbreg.PointBasedRegistration(target, 1.0, 0.0)
+    inc = pbreg.IncrementalRegistration(target, 1.0, 0.0)
+
+    np.random.seed(4)
+    moving_fids = np.random.uniform(-50.0, 50.0, size=(6, 3))
+    moving_fids[0:5, 2] = 0.0
+    fixed_fids = moving_fids + np.random.normal(scale=1.0, size=(6, 3))
+    fixed_fids[0:5, 2] = 0.0
+
+    for fixed_fid, moving_fid in zip(fixed_fids, moving_fids):
+        inc.add_fiducial(fixed_fid, moving_fid)
+    assert inc.non_planar_fids == 1
+    assert np.allclose(inc.register()[5],
+                       pbr.register(fixed_fids, moving_fids)[5])
+
+    inc.remove_fiducial(fixed_fids[5], moving_fids[5])
+    assert inc.non_planar_fids == 0
+    assert np.allclose(inc.register()[5],
+                       pbr.register(fixed_fids[0:5], moving_fids[0:5])[5])
+
+
+def test_pbr_solvers():
+    """
+    Each rotation solver should give the same registration
+    """
+    target = np.array([[20.0, 30.0, 10.0]], dtype=np.float64)
+    np.random.seed(5)
+    moving_fids = np.random.uniform(-50.0, 50.0, size=(4, 6, 3))
+    fixed_fids = moving_fids + np.random.normal(scale=1.0, size=(4, 6, 3))
+
+    expected_pbr = pbreg.PointBasedRegistration(target, 1.0, 0.0)
+    expected = expected_pbr.register(fixed_fids[0], moving_fids[0])
+    expected_batch = expected_pbr.register_batch(fixed_fids, moving_fids)
+    for solver in ('svd', 'quaternion'):
+        pbr = pbreg.PointBasedRegistration(target, 1.0, 0.0, solver=solver)
+        result = pbr.register(fixed_fids[0], moving_fids[0])
+        for index in (1, 3, 4, 6):
+            assert np.isclose(result[index], expected[index])
+        assert np.allclose(result[5], expected[5])
+        batch = pbr.register_batch(fixed_fids, moving_fids)
+        assert np.allclose(batch['transformed_target'],
+                           expected_batch['transformed_target'])
+        assert np.allclose(pbr.leave_one_out(fixed_fids[0], moving_fids[0]
+                                             )['fre'],
+                           expected_pbr.leave_one_out(fixed_fids[0],
+                                                      moving_fids[0])['fre'])
+
+    with pytest.raises(ValueError):
+        pbreg.PointBasedRegistration(target, 1.0, 0.0, solver='lu')
+
+
+def test_pbr_default_solver_untimed(monkeypatch):
+    """
+    The default solver should be chosen without timing the solvers
+    """
+    def _no_timing(*_args, **_kwargs):
+        raise AssertionError("solvers should not be timed")
+    monkeypatch.setattr(procrustes, 'time_rotation_solvers',
+                        _no_timing)
+
+    target = np.array([[20.0, 30.0, 10.0]], dtype=np.float64)
+    np.random.seed(6)
+    moving_fids = np.random.uniform(-50.0, 50.0, size=(300, 5, 3))
+    fixed_fids = moving_fids + np.random.normal(scale=1.0, size=(300, 5, 3))
+    pbr = pbreg.PointBasedRegistration(target, 1.0, 0.0)
+    for batch_size in (1, 300):
+        assert np.all(pbr.register_batch(fixed_fids[0:batch_size],
+                                         moving_fids[0:batch_size]
+                                         )['success'])
+        moving_fids[:, :, 2] = 0.0
+        fixed_fids[:, :, 2] = 0.0
+    assert pbr.leave_one_out(fixed_fids[0], moving_fids[0])['fre'].shape == \
+                    (5,)
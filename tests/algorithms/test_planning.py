@@ -0,0 +1,91 @@
+# coding=utf-8
+
+"""Fiducial Registration Educational Demonstration tests"""
+import numpy as np
+import pytest
+
+from sksurgeryfred.algorithms import planning
+from sksurgeryfred.algorithms.errors import compute_tre_from_fle
+from sksurgeryfred.algorithms.fred import are_valid_fiducials
+
+# Pytest style
+
+def test_candidate_grid():
+    """
+    Candidates should be on the grid and inside the outline
+    """
+    outline = np.load('static/brain512.npy')
+    candidates = planning.candidate_grid(outline, stride=16)
+    assert candidates.shape[0] > 100
+    assert np.all(candidates[:, 2] == 0.0)
+    assert np.all(are_valid_fiducials(candidates, outline))
+
+    denser = planning.candidate_grid(outline, stride=8)
+    assert denser.shape[0] > 3 * candidates.shape[0]
+
+    with pytest.raises(ValueError):
+        planning.candidate_grid(outline, stride=0)
+
+
+def test_candidates_match_registers():
+    """
+    The rank one updates should give the same expected TRE as
+    adding each candidate and recomputing
+    """
+    fiducials = np.array([[100.0, 100.0, 0.0], [300.0, 120.0, 0.0],
+                          [180.0, 330.0, 0.0]])
+    target = np.array([220.0, 200.0, 0.0])
+    candidates = np.array([[50.0, 400.0, 0.0], [250.0, 250.0, 0.0],
+                           [400.0, 300.0, 0.0], [10.0, 20.0, 5.0]])
+    centroid = np.mean(fiducials, axis=0)
+    centred = fiducials - centroid
+
+    result = planning.expected_tre_with_candidates(
+        centroid, np.matmul(centred.transpose(), centred), 3, 2.0,
+        target, candidates)
+
+    for candidate, tre_sq in zip(candidates, result):
+        expected = compute_tre_from_fle(np.vstack([fiducials, candidate]),
+                                        2.0, target.reshape(1, 3))[0]
+        assert np.isclose(tre_sq, expected)
+
+
+def test_suggest_fiducials():
+    """
+    Suggestions should be the best candidate, reduce expected TRE and
+    avoid candidates that leave the fiducials collinear
+    """
+    fiducials = np.array([[100.0, 100.0, 0.0], [300.0, 100.0, 0.0]])
+    target = np.array([200.0, 200.0, 0.0])
+    candidates = np.array([[200.0, 100.0, 0.0], [200.0, 300.0, 0.0],
+                           [150.0, 250.0, 0.0], [400.0, 100.0, 0.0]])
+
+    suggestions, tre_sq = planning.suggest_fiducials(
+        fiducials, target, 1.0, candidates, number=3)
+    assert suggestions.shape == (3, 3)
+    assert np.array_equal(suggestions[0], [200.0, 300.0, 0.0])
+    assert np.isclose(tre_sq[0], compute_tre_from_fle(
+        np.vstack([fiducials, suggestions[0]]), 1.0,
+        target.reshape(1, 3))[0])
+    assert np.isclose(tre_sq[2], compute_tre_from_fle(
+        np.vstack([fiducials, suggestions]), 1.0, target.reshape(1, 3))[0])
+    assert np.all(np.diff(tre_sq) < 0.0)
+
+    #isotropic covariance gives the same, skipping collinear candidates
+    cov_suggestions, cov_tre_sq = planning.suggest_fiducials(
+        fiducials, target, 0.0, candidates, number=3,
+        fle_cov=np.eye(3) / 3.0)
+    assert np.array_equal(cov_suggestions, suggestions)
+    assert np.allclose(cov_tre_sq, tre_sq)
+    cov_tre_sq = planning.suggest_fiducials(
+        fiducials, target, 0.0, candidates,
+        fle_cov=np.diag([0.1, 0.8, 0.1]))[1]
+    assert not np.isclose(cov_tre_sq[0], tre_sq[0])
+
+    with pytest.raises(ValueError):
+        planning.suggest_fiducials(fiducials, target, 1.0,
+                                   candidates[[0, 3]])
+    with pytest.raises(ValueError):
+        planning.suggest_fiducials(fiducials[0:1], target, 1.0, candidates)
+    with pytest.raises(ValueError):
+        planning.suggest_fiducials(fiducials, target, 1.0, np.zeros((0, 3)))
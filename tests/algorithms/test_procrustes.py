@@ -0,0 +1,188 @@
+# coding=utf-8
+
+"""Fiducial Registration Educational Demonstration tests"""
+import numpy as np
+import pytest
+from sksurgerycore.algorithms.procrustes import orthogonal_procrustes
+
+from sksurgeryfred.algorithms import procrustes
+
+def _random_rotation():
+    quaternion = np.random.normal(size=4)
+    quaternion /= np.linalg.norm(quaternion)
+    w_q, x_q, y_q, z_q = quaternion
+    return np.array([
+        [1 - 2*(y_q*y_q + z_q*z_q), 2*(x_q*y_q - z_q*w_q),
+         2*(x_q*z_q + y_q*w_q)],
+        [2*(x_q*y_q + z_q*w_q), 1 - 2*(x_q*x_q + z_q*z_q),
+         2*(y_q*z_q - x_q*w_q)],
+        [2*(x_q*z_q - y_q*w_q), 2*(y_q*z_q + x_q*w_q),
+         1 - 2*(x_q*x_q + y_q*y_q)]])
+
+
+def test_batch_matches_sksurgery():
+    """
+    Batch procrustes should match sksurgerycore for each point set
+    """
+    np.random.seed(0)
+    batch_size = 20
+    no_fids = 5
+    moving = np.random.uniform(-50.0, 50.0, size=(batch_size, no_fids, 3))
+    fixed = np.empty_like(moving)
+    for i in range(batch_size):
+        fixed[i] = np.matmul(_random_rotation(), moving[i].transpose()
+                             ).transpose() + np.random.normal(size=3) * 10.0
+    fixed += np.random.normal(scale=1.0, size=fixed.shape)
+
+    rotations, translations, fres = procrustes.batch_orthogonal_procrustes(
+        fixed, moving)
+
+    assert rotations.shape == (batch_size, 3, 3)
+    assert translations.shape == (batch_size, 3, 1)
+    assert fres.shape == (batch_size,)
+    for i in range(batch_size):
+        rotation, translation, fre = orthogonal_procrustes(fixed[i],
+                                                           moving[i])
+        assert np.allclose(rotations[i], rotation)
+        assert np.allclose(translations[i], translation)
+        assert np.isclose(fres[i], fre)
+
+
+def test_batch_planar_no_reflection():
+    """
+    Planar point sets should give proper rotations, not reflections
+    """
+    moving = np.array([[[0.0, 0.0, 0.0], [10.0, 0.0, 0.0],
+                        [0.0, 10.0, 0.0], [10.0, 10.0, 0.0]]])
+    fixed = moving + np.array([5.0, -3.0, 0.0])
+
+    rotations, translations, fres = procrustes.batch_orthogonal_procrustes(
+        fixed, moving)
+    assert np.allclose(rotations[0], np.eye(3))
+    assert np.allclose(translations[0], [[5.0], [-3.0], [0.0]])
+    assert np.isclose(fres[0], 0.0)
+    assert np.isclose(np.linalg.det(rotations[0]), 1.0)
+
+
+def test_batch_invalid_inputs():
+    """
+    Should raise errors on invalid inputs
+    """
+    points = np.zeros((2, 4, 3))
+    with pytest.raises(TypeError):
+        procrustes.batch_orthogonal_procrustes(points.tolist(), points)
+    with pytest.raises(TypeError):
+        procrustes.batch_orthogonal_procrustes(points, points.tolist())
+    with pytest.raises(ValueError):
+        procrustes.batch_orthogonal_procrustes(np.zeros((4, 3)),
+                                               np.zeros((4, 3)))
+    with pytest.raises(ValueError):
+        procrustes.batch_orthogonal_procrustes(points, np.zeros((2, 4, 2)))
+    with pytest.raises(ValueError):
+        procrustes.batch_orthogonal_procrustes(points, np.zeros((2, 5, 3)))
+    with pytest.raises(ValueError):
+        procrustes.batch_orthogonal_procrustes(np.zeros((2, 2, 3)),
+                                               np.zeros((2, 2, 3)))
+
+
+def _random_planar_rotation():
+    angle = np.random.uniform(-np.pi, np.pi)
+    return np.array([[np.cos(angle), -np.sin(angle), 0.0],
+                     [np.sin(angle), np.cos(angle), 0.0],
+                     [0.0, 0.0, 1.0]])
+
+
+def test_planar_matches_svd():
+    """
+    The planar solvers should match the SVD for points with z = 0,
+    including rotations of more than 90 degrees
+    """
+    np.random.seed(1)
+    batch_size = 20
+    no_fids = 5
+    moving = np.random.uniform(0.0, 500.0, size=(batch_size, no_fids, 3))
+    moving[:, :, 2] = 0.0
+    fixed = np.empty_like(moving)
+    for i in range(batch_size):
+        fixed[i] = np.matmul(moving[i], _random_planar_rotation().T)
+        fixed[i, :, 0:2] += np.random.normal(size=2) * 10.0
+    fixed[:, :, 0:2] += np.random.normal(scale=2.0,
+                                         size=(batch_size, no_fids, 2))
+    assert procrustes.is_planar(fixed, moving)
+    assert not procrustes.is_planar(fixed, moving + 1.0)
+
+    rotations, translations, fres = procrustes.batch_planar_procrustes(
+        fixed, moving)
+    expected = procrustes.batch_orthogonal_procrustes(fixed, moving)
+    assert np.allclose(rotations, expected[0])
+    assert np.allclose(translations, expected[1])
+    assert np.allclose(fres, expected[2])
+    assert np.allclose(np.linalg.det(rotations), 1.0)
+
+    for i in range(batch_size):
+        rotation, translation, fre = procrustes.planar_procrustes(
+            fixed[i], moving[i])
+        expected = orthogonal_procrustes(fixed[i], moving[i])
+        assert np.allclose(rotation, expected[0])
+        assert np.allclose(translation, expected[1])
+        assert np.isclose(fre, expected[2])
+
+    with pytest.raises(TypeError):
+        procrustes.planar_procrustes(fixed[0].tolist(), moving[0])
+    with pytest.raises(ValueError):
+        procrustes.planar_procrustes(fixed[0, 0:2], moving[0, 0:2])
+
+
+def test_quaternion_matches_svd():
+    """
+    Horn's quaternion solver should match the SVD solver
+    """
+    np.random.seed(2)
+    batch_size = 30
+    moving = np.random.uniform(-50.0, 50.0, size=(batch_size, 6, 3))
+    fixed = np.empty_like(moving)
+    for i in range(batch_size):
+        fixed[i] = np.matmul(moving[i], _random_rotation().T) + \
+                        np.random.normal(size=3) * 10.0
+    fixed += np.random.normal(scale=1.0, size=fixed.shape)
+
+    expected = procrustes.batch_orthogonal_procrustes(fixed, moving)
+    result = procrustes.batch_orthogonal_procrustes(fixed, moving,
+                                                    'quaternion')
+    for expected_values, values in zip(expected, result):
+        assert np.allclose(values, expected_values)
+    assert np.allclose(np.linalg.det(result[0]), 1.0)
+
+    #works for any leading shape
+    covariances = np.random.normal(size=(2, 5, 3, 3))
+    assert np.allclose(procrustes.quaternion_rotations(covariances),
+                       procrustes.rotations_from_covariances(covariances))
+
+
+def test_solver_registry():
+    """
+    Solvers should be found by name and the fastest chosen by timing
+    """
+    assert procrustes.get_rotation_solver('svd') is \
+                    procrustes.rotations_from_covariances
+    with pytest.raises(ValueError):
+        procrustes.get_rotation_solver('no such solver')
+    with pytest.raises(ValueError):
+        procrustes.batch_orthogonal_procrustes(np.zeros((1, 3, 3)),
+                                               np.zeros((1, 3, 3)), 'lu')
+
+    times = procrustes.time_rotation_solvers(16, repeats=1)
+    assert set(times) == set(procrustes.GENERAL_SOLVERS)
+    assert all(time > 0.0 for time in times.values())
+
+    name = procrustes.fastest_solver(100)
+    assert name in procrustes.GENERAL_SOLVERS
+    #the choice is kept for batch sizes of the same power of two
+    assert procrustes.fastest_solver(120) == name
+
+    #the default needs no timing and is the same on every machine
+    assert procrustes.default_solver(1) == 'svd'
+    assert procrustes.default_solver(
+        procrustes.QUATERNION_BATCH_SIZE - 1) == 'svd'
+    assert procrustes.default_solver(
+        procrustes.QUATERNION_BATCH_SIZE) == 'quaternion'
@@ -0,0 +1,59 @@
+# coding=utf-8
+
+"""Fiducial Registration Educational Demonstration tests"""
+import numpy as np
+import pytest
+
+from sksurgeryfred.algorithms import scores
+from sksurgeryfred.algorithms.score_table import ScoreTable
+
+
+def test_score_table_matches_scores():
+    """
+    Table scores should be within one point of calculate_scores
+    """
+    table = ScoreTable()
+    assert table.max_interpolation_error() < 0.75
+
+    np.random.seed(0)
+    target_centres = np.random.uniform(0.0, 100.0, size=(100000, 3))
+    est_target_centres = target_centres + np.random.normal(
+        scale=8.0, size=(100000, 3))
+    margins = np.random.uniform(0.0, 20.0, size=100000)
+    margins[0:100] = 0.0
+
+    exact = scores.calculate_scores(target_centres, est_target_centres,
+                                    10.0, margins)
+    looked_up = table.calculate_scores(target_centres, est_target_centres,
+                                       10.0, margins)
+    assert np.max(np.abs(exact - looked_up)) <= 1.0
+
+    #distances beyond the table are all misses
+    assert table.scores(1000.0, 10.0, 5.0) == scores.calculate_score(
+        np.zeros(3), np.array([1000.0, 0.0, 0.0]), 10.0, 5.0)
+
+    with pytest.raises(ValueError):
+        table.scores(1.0, 10.0, -1.0)
+    with pytest.raises(ValueError):
+        table.scores(1.0, 10.0, 21.0)
+
+
+def test_score_table_cache(tmp_path):
+    """
+    The table should be saved to and memory mapped from the cache
+    """
+    cache_path = str(tmp_path / 'scores.npy')
+    table = ScoreTable(max_margin_ratio=1.0, steps_per_radius=32,
+                       cache_path=cache_path)
+    assert isinstance(table.table, np.memmap)
+    assert table.table.shape == (33, 97)
+
+    cached_table = ScoreTable(max_margin_ratio=1.0, steps_per_radius=32,
+                              cache_path=cache_path)
+    assert isinstance(cached_table.table, np.memmap)
+    assert np.array_equal(cached_table.table, table.table)
+    assert cached_table.scores(3.0, 10.0, 2.0) == table.scores(3.0, 10.0, 2.0)
+
+    with pytest.raises(ValueError):
+        ScoreTable(max_margin_ratio=2.0, steps_per_radius=32,
+                   cache_path=cache_path)
@@ -3,6 +3,7 @@
 """Fiducial Registration Educational Demonstration tests"""
 import math
 import numpy as np
+import pytest
 
 from sksurgeryfred.algorithms import scores
 
@@ -123,3 +124,104 @@ def test_calc_hit_with_damage():
     treatment_vol = math.pi * 4.0 / 3.0 * 20.0 * 20.0 * 20.0
     myscore = 1000.0 - (1000.0 * (treatment_vol - target_vol)/treatment_vol)
     assert score == myscore
+
+
+def test_overlap_volumes_vectorised():
+    """
+    Vectorised overlap should match the scalar version in every case
+    """
+    np.random.seed(0)
+    centres0 = np.random.uniform(-10.0, 10.0, size=(500, 3))
+    centres1 = np.random.uniform(-10.0, 10.0, size=(500, 3))
+    radii0 = np.random.uniform(0.5, 15.0, size=500)
+    radii1 = np.random.uniform(0.5, 15.0, size=500)
+    #include coincident centres and spheres that just touch
+    centres1[0] = centres0[0]
+    centres1[1] = centres0[1] + [radii0[1] + radii1[1], 0.0, 0.0]
+
+    overlaps = scores.two_sphere_overlap_volumes(centres0, centres1,
+                                                 radii0, radii1)
+    assert overlaps.shape == (500,)
+    for i in range(500):
+        assert np.isclose(overlaps[i], scores.two_sphere_overlap_volume(
+            centres0[i], centres1[i], radii0[i], radii1[i]),
+                          atol=0.0, rtol=1e-12)
+
+    #radii should broadcast
+    overlaps = scores.two_sphere_overlap_volumes(centres0, centres1,
+                                                 5.0, 8.0)
+    assert np.isclose(overlaps[7], scores.two_sphere_overlap_volume(
+        centres0[7], centres1[7], 5.0, 8.0), atol=0.0, rtol=1e-12)
+
+
+def test_calc_scores_vectorised():
+    """
+    Vectorised scores should match the scalar version
+    """
+    np.random.seed(1)
+    target_centres = np.random.uniform(0.0, 100.0, size=(1000, 3))
+    est_target_centres = target_centres + np.random.normal(
+        scale=5.0, size=(1000, 3))
+    margins = np.random.uniform(0.0, 15.0, size=1000)
+    est_target_centres[0] = target_centres[0]
+    margins[0] = 0.0
+
+    calc_scores = scores.calculate_scores(target_centres,
+                                          est_target_centres, 10.0, margins)
+    assert calc_scores.shape == (1000,)
+    assert calc_scores[0] == 1000.0
+    for i in range(1000):
+        assert calc_scores[i] == scores.calculate_score(
+            target_centres[i], est_target_centres[i], 10.0, margins[i])
+
+
+def test_expected_scores_simulated():
+    """
+    Expected scores should match the mean of simulated scores
+    """
+    np.random.seed(2)
+    expected_tre = 6.0
+    target_radius = 10.0
+    margins = np.array([0.0, 2.0, 5.0, 10.0, 15.0])
+    expected = scores.expected_scores(expected_tre, target_radius, margins)
+
+    errors = np.random.normal(scale=expected_tre / math.sqrt(3.0),
+                              size=(200000, 3))
+    targets = np.zeros((200000, 3))
+    for margin, expected_score in zip(margins, expected):
+        simulated = np.mean(scores.calculate_scores(
+            targets, errors, target_radius, margin))
+        assert np.isclose(expected_score, simulated, atol=5.0, rtol=0.0)
+
+    #with no error we should get the score for a perfect registration
+    expected = scores.expected_scores(0.0, target_radius, margins)
+    for margin, expected_score in zip(margins, expected):
+        assert np.isclose(expected_score, scores.calculate_score(
+            targets[0], targets[0], target_radius, margin), atol=0.5)
+
+    with pytest.raises(ValueError):
+        scores.expected_scores(expected_tre, target_radius, [-10.0])
+
+
+def test_optimal_margin():
+    """
+    The optimal margin should be zero with no error, and grow with TRE
+    """
+    margins, expected, best_margin, best_score = scores.optimal_margin(
+        0.0, 10.0)
+    assert margins.shape == (201,)
+    assert expected.shape == (201,)
+    assert best_margin == 0.0
+    assert np.isclose(best_score, 1000.0)
+
+    last_margin = 0.0
+    for expected_tre in (1.0, 2.0, 4.0):
+        margins, expected, best_margin, best_score = scores.optimal_margin(
+            expected_tre, 10.0)
+        assert best_margin > last_margin
+        assert best_score == np.max(expected)
+        last_margin = best_margin
+
+    margins, expected, best_margin, _ = scores.optimal_margin(
+        2.0, 10.0, margins=[1.0, 3.0, 5.0])
+    assert best_margin in (1.0, 3.0, 5.0)
@@ -0,0 +1,98 @@
+# coding=utf-8
+
+"""Fiducial Registration Educational Demonstration tests"""
+import math
+import numpy as np
+import pytest
+
+from sksurgeryfred.algorithms.errors import expected_absolute_value
+from sksurgeryfred.algorithms.fle import FLE
+from sksurgeryfred.algorithms import simulation
+
+
+def _circle_fiducials(no_fids, radius):
+    angles = np.linspace(0.0, math.pi * 2.0, no_fids, endpoint=False)
+    return np.stack([radius * np.cos(angles), radius * np.sin(angles),
+                     np.zeros(no_fids)], axis=1)
+
+
+def test_simulation_matches_theory():
+    """
+    Mean squared TRE and FRE should match their expected values, and
+    TRE and FRE should be uncorrelated
+    """
+    np.random.seed(0)
+    fixed_fle_std_dev = np.array([1.0, 1.0, 1.0], dtype=np.float64)
+    fixed_fle_esv = expected_absolute_value(fixed_fle_std_dev)
+    fixed_fle = FLE(independent_fle=fixed_fle_std_dev)
+
+    fiducials = _circle_fiducials(8, 20.0)
+    target = np.array([[5.0, 2.0, 0.0]])
+    repeats = 2000
+
+    results = simulation.simulate_registrations(
+        fiducials, target, fixed_fle, fixed_fle_esv, repeats)
+
+    for key in ('tre', 'fre', 'expected_tre', 'expected_fre'):
+        assert results[key].shape == (repeats,)
+    assert results['transformed_target'].shape == (repeats, 3)
+
+    summary = results['summary']
+    assert summary['repeats'] == repeats
+    assert summary['no_fids'] == 8
+    assert np.isclose(summary['tre']['rms'] ** 2,
+                      summary['expected_tre']['mean'] ** 2, rtol=0.10)
+    assert np.isclose(summary['fre']['rms'] ** 2,
+                      summary['expected_fre']['mean'] ** 2, rtol=0.05)
+    assert abs(summary['tre_fre_correlation']) < 0.1
+    assert summary['tre']['p5'] < summary['tre']['median'] < \
+                    summary['tre']['p95']
+
+
+def test_simulation_moving_fle():
+    """
+    With FLE on both images the expected values should include both
+    """
+    np.random.seed(0)
+    fle_std_dev = np.array([1.0, 1.0, 1.0], dtype=np.float64)
+    fle_esv = expected_absolute_value(fle_std_dev)
+    fiducials = _circle_fiducials(8, 20.0)
+    target = np.array([[5.0, 2.0, 0.0]])
+
+    results = simulation.simulate_registrations(
+        fiducials, target, FLE(independent_fle=fle_std_dev), fle_esv, 2000,
+        moving_fle=FLE(independent_fle=fle_std_dev), moving_fle_esv=fle_esv)
+
+    summary = results['summary']
+    assert np.isclose(summary['tre']['rms'] ** 2,
+                      summary['expected_tre']['mean'] ** 2, rtol=0.10)
+    assert np.isclose(summary['fre']['rms'] ** 2,
+                      summary['expected_fre']['mean'] ** 2, rtol=0.05)
+
+
+def test_simulation_no_error():
+    """
+    With no FLE there should be no TRE or FRE
+    """
+    fiducials = _circle_fiducials(4, 20.0)
+    results = simulation.simulate_registrations(
+        fiducials, np.array([[1.0, 1.0, 0.0]]), FLE(), 0.0, 10)
+    assert np.allclose(results['tre'], 0.0)
+    assert np.allclose(results['fre'], 0.0)
+    assert results['summary']['tre_fre_correlation'] == 0.0
+
+
+def test_simulation_invalid_inputs():
+    """
+    Should raise errors on invalid inputs
+    """
+    target = np.array([[0.0, 0.0, 0.0]])
+    with pytest.raises(ValueError):
+        simulation.simulate_registrations(np.zeros((4, 2)), target,
+                                          FLE(), 0.0, 10)
+    with pytest.raises(ValueError):
+        simulation.simulate_registrations(np.zeros((2, 3)), target,
+                                          FLE(), 0.0, 10)
+    with pytest.raises(ValueError):
+        simulation.simulate_registrations(_circle_fiducials(4, 1.0), target,
+                                          FLE(), 0.0, 0)
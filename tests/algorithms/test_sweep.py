@@ -0,0 +1,94 @@
+# coding=utf-8
+
+"""Fiducial Registration Educational Demonstration sweep tests"""
+import numpy as np
+import pytest
+
+from sksurgeryfred.algorithms import sweep
+from sksurgeryfred.algorithms.score_table import ScoreTable
+
+
+def _square_outline():
+    return np.array([[100.0, 100.0], [100.0, 300.0], [300.0, 300.0],
+                     [300.0, 100.0]])
+
+
+def test_sweep_shapes():
+    """
+    There should be one record per configuration and margin
+    """
+    results, trials = sweep.run_sweep(
+        _square_outline(), [3, 5], [0.5, 2.0, 5.0], [0.0, 2.0],
+        targets=[[200.0, 200.0, 0.0], [150.0, 250.0, 0.0]],
+        trials=25, chunk_size=10, seed=0)
+
+    assert results.dtype == sweep.SWEEP_RESULT_DTYPE
+    assert results.shape == (2 * 3 * 2 * 2,)
+    assert np.all(results['trials'] == 25)
+    assert trials['tre'].shape == (12, 25)
+    assert trials['transformed_target'].shape == (12, 25, 3)
+    assert np.array_equal(results['no_fids'][0:12:2], [3] * 6)
+    assert np.array_equal(results['margin'][0:4], [0.0, 2.0, 0.0, 2.0])
+    assert np.allclose(results['target'][0], [200.0, 200.0, 0.0])
+    assert np.allclose(results['target'][2], [150.0, 250.0, 0.0])
+    #more FLE, more TRE
+    assert results['mean_tre'][0] < results['mean_tre'][8]
+
+
+def test_sweep_default_target():
+    """
+    The default target is the centre of the outline, x first
+    """
+    outline = np.array([[100.0, 200.0], [100.0, 300.0], [150.0, 300.0],
+                        [150.0, 200.0]])
+    results, _trials = sweep.run_sweep(outline, [4], [1.0], [1.0],
+                                       trials=5, seed=0)
+    assert np.allclose(results['target'][0], [250.0, 125.0, 0.0])
+
+
+def test_sweep_deterministic():
+    """
+    The same seed should give the same results for any number of
+    workers
+    """
+    kwargs = {'trials': 30, 'chunk_size': 8, 'seed': 42}
+    serial = sweep.run_sweep(_square_outline(), [4, 6], [1.0, 3.0],
+                             [2.0], **kwargs)
+    parallel = sweep.run_sweep(_square_outline(), [4, 6], [1.0, 3.0],
+                               [2.0], workers=2, **kwargs)
+    assert np.array_equal(serial[0], parallel[0])
+    for field in sweep.TRIAL_FIELDS:
+        assert np.array_equal(serial[1][field], parallel[1][field])
+
+    other = sweep.run_sweep(_square_outline(), [4, 6], [1.0, 3.0],
+                            [2.0], trials=30, chunk_size=8, seed=43)
+    assert not np.array_equal(serial[1]['tre'], other[1]['tre'])
+
+
+def test_sweep_score_table():
+    """
+    Table scores should be within a point of the exact ones, and
+    margins the table doesn't cover scored exactly
+    """
+    exact, _ = sweep.run_sweep(_square_outline(), [4], [2.0], [2.0, 30.0],
+                               trials=50, seed=3)
+    looked_up, _ = sweep.run_sweep(_square_outline(), [4], [2.0],
+                                   [2.0, 30.0], trials=50, seed=3,
+                                   score_table=ScoreTable())
+    assert np.allclose(looked_up['mean_score'], exact['mean_score'],
+                       atol=1.0)
+    assert looked_up['mean_score'][1] == exact['mean_score'][1]
+
+
+def test_sweep_invalid_inputs():
+    """
+    Should raise errors on invalid inputs
+    """
+    with pytest.raises(ValueError):
+        sweep.run_sweep(_square_outline(), [2, 4], [1.0], [1.0])
+    with pytest.raises(ValueError):
+        sweep.run_sweep(_square_outline(), [4], [1.0], [1.0], trials=0)
+    with pytest.raises(ValueError):
+        sweep.run_sweep(_square_outline(), [4], [1.0], [1.0], chunk_size=0)
+    with pytest.raises(ValueError):
+        sweep.run_sweep(_square_outline(), [4], [1.0], [1.0], workers=0)
@@ -1,6 +1,8 @@
 # coding=utf-8
 
 """Fiducial Registration Educational Demonstration tests"""
+import base64
+import gzip
 from html.parser import HTMLParser
 from math import isclose
 import warnings
@@ -8,6 +10,10 @@ import json
 import pytest
 import numpy as np
 import main as sksfmain # pylint: disable=unused-import
+from sksurgeryfred.algorithms.fred import are_valid_fiducials
+from sksurgeryfred.algorithms.contour import get_contour_geometry
+from sksurgeryfred.utilities.binary_transport import decode_arrays, \
+                decode_values, encode_arrays, encode_values
 
 
 # Pytest style
@@ -94,6 +100,28 @@ def testserve_defaultcontour(client):
     servedcontour = json.loads(response.data.decode()).get('contour')
 
     assert np.array_equal(servedcontour, expectedcontour)
+    etag = response.headers.get('ETag')
+    assert etag and not etag.startswith('W/')
+    assert 'max-age' in response.headers.get('Cache-Control')
+
+    #gzipped if the client accepts it, with a different strong ETag
+    response = client.post('/defaultcontour',
+                           headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers.get('Content-Encoding') == 'gzip'
+    assert response.headers.get('ETag') != etag
+    servedcontour = json.loads(gzip.decompress(response.data).decode()).get(
+        'contour')
+    assert np.array_equal(servedcontour, expectedcontour)
+
+    #not modified if the client has it
+    response = client.post('/defaultcontour',
+                           headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers.get('ETag') == etag
+    response = client.post('/defaultcontour',
+                           headers={'If-None-Match': '"something else"'})
+    assert response.status_code == 200
 
 def testserve_gettarget(client):
     """Serve target"""
@@ -138,6 +166,28 @@ def testserve_getfle(client):
     assert fixed_fle_eav == exp_fixed_eav
     assert moving_fle_eav == 0.0
 
+    #anisotropic fle, with moving fle
+    postdata = dict(fle_ratio = [2.0, 1.0, 0.0], moving_fle_ratio = 0.5)
+    returndata = client.post('/getfle', data = json.dumps(postdata),
+                    content_type='application/json')
+    fles = json.loads(returndata.data.decode())
+    fixed_fle_sd = np.array(fles.get('fixed_fle_sd'))
+    moving_fle_sd = np.array(fles.get('moving_fle_sd'))
+    assert isclose(fixed_fle_sd[0], 2.0 * fixed_fle_sd[1])
+    assert fixed_fle_sd[2] == 0.0
+    assert np.allclose(moving_fle_sd, fixed_fle_sd * 0.5)
+    assert isclose(fles.get('moving_fle_eav'),
+                   fles.get('fixed_fle_eav') / 4.0)
+    assert np.allclose(fles.get('fixed_fle_covariance'),
+                       np.diag(np.square(fixed_fle_sd)))
+    assert isclose(np.trace(fles.get('moving_fle_covariance')),
+                   fles.get('moving_fle_eav'))
+
+    postdata = dict(fle_ratio = [0.0, 0.0, 0.0])
+    returndata = client.post('/getfle', data = json.dumps(postdata),
+                    content_type='application/json')
+    assert not json.loads(returndata.data.decode()).get('success', True)
+
 def testserve_placefiducial(client):
     """Serve place fiducial"""
     #get should not be allowed
@@ -160,9 +210,21 @@ def testserve_placefiducial(client):
                     content_type='application/json')
     assert not json.loads(fid.data.decode()).get("valid_fid", True)
 
+    #not valid fid, outside the anatomy
+    x_pos = 10.0
+    y_pos = 10.0
+    postdata = dict(
+             x_pos=x_pos,
+             y_pos=y_pos,
+             pre_op_ind_fle=pre_op_ind_fle,
+             intra_op_ind_fle=intra_op_ind_fle)
+    fid = client.post('/placefiducial', data = json.dumps(postdata),
+                    content_type='application/json')
+    assert not json.loads(fid.data.decode()).get("valid_fid", True)
+
     #normal usage
-    x_pos = 0.0
-    y_pos = 0.0
+    x_pos = 250.0
+    y_pos = 250.0
     pre_op_ind_fle = [0.0, 0.0, 0.0]
     intra_op_ind_fle = [2.0, 2.0, 2.0]
     postdata = dict(
@@ -232,7 +294,28 @@ def testserve_register(client):
     assert reg_result_json.get("success", False)
     assert reg_result_json.get("actual_tre") == 200.0
     assert isclose(reg_result_json.get("expected_fre"), 1.2247, abs_tol = 1e-4)
-    assert isclose(reg_result_json.get("expected_tre"), 1.2248, abs_tol = 1e-4)
+    #1.2634 uses the principal axes, sksurgerycore gave 1.2248 using
+    #eigenvector rows. Simulation gives an rms TRE of 1.265.
+    assert isclose(reg_result_json.get("expected_tre"), 1.2634, abs_tol = 1e-4)
+
+    #the same fle split between the images, as covariances
+    postdata["intraop_fle"] = 0.0
+    postdata["intraop_fle_covariance"] = np.diag([1.0, 1.0, 1.0]).tolist()
+    postdata["preop_fle_covariance"] = np.diag([0.5, 0.5, 0.5]).tolist()
+    reg_result = client.post('/register', data = json.dumps(postdata),
+                    content_type='application/json')
+    reg_result_json = json.loads(reg_result.data.decode())
+    assert isclose(reg_result_json.get("mean_fle") ** 2, 4.5)
+    assert isclose(reg_result_json.get("expected_tre"), 1.2634, abs_tol = 1e-4)
+
+    #fle only along z tilts the plane of the fiducials, simulation
+    #gives an rms TRE of 1.315
+    postdata["intraop_fle_covariance"] = np.diag([0.0, 0.0, 4.5]).tolist()
+    postdata["preop_fle_covariance"] = None
+    reg_result = client.post('/register', data = json.dumps(postdata),
+                    content_type='application/json')
+    reg_result_json = json.loads(reg_result.data.decode())
+    assert isclose(reg_result_json.get("expected_tre"), 1.3155, abs_tol = 1e-4)
     assert isclose(reg_result_json.get("fre"), 0.0, abs_tol=1e-8)
     assert reg_result_json.get("mean_fle") == 2.1213203435596424
     assert reg_result_json.get("no_fids") == 3
@@ -448,3 +531,470 @@ def testserve_calculatescore(client):
     result_json = json.loads(result.data.decode())
     assert result_json.get('success', True)
     assert result_json.get('score', 0) == 1000
+
+
+def testserve_sessions(client):
+    """Serve registration sessions"""
+    #get should not be allowed
+    session = client.get('/initsession')
+    parser = FredHTMLParser('405 Method Not Allowed')
+    parser.feed(str(session.data))
+    assert parser.title_ok
+
+    #needs a target
+    result = client.post('/initsession', data = json.dumps({}),
+                    content_type='application/json')
+    assert not json.loads(result.data.decode()).get('success', True)
+
+    postdata = dict(
+             target = [200.0, 0.0, 0.0],
+             preop_fle = 0.0,
+             intraop_fle = 4.5,
+             intra_op_sys_fle = [200.0, 0.0, 0.0]
+             )
+    result = client.post('/initsession', data = json.dumps(postdata),
+                    content_type='application/json')
+    result_json = json.loads(result.data.decode())
+    assert result_json.get('success')
+    reference = result_json.get('reference')
+    assert reference
+
+    #the same translation as testserve_register, one fiducial at a time
+    for x_pos, y_pos in ((200.0, 250.0), (300.0, 250.0), (250.0, 150.0)):
+        postdata = dict(x_pos = x_pos, y_pos = y_pos, reference = reference)
+        fid = client.post('/placefiducial', data = json.dumps(postdata),
+                          content_type='application/json')
+        fid_json = json.loads(fid.data.decode())
+        assert fid_json.get('valid_fid')
+        assert fid_json.get('session')
+        assert fid_json.get('fixed_fid') == [x_pos + 200.0, y_pos, 0.0]
+
+    registration = fid_json.get('registration')
+    assert registration.get('success')
+    assert isclose(registration.get('actual_tre'), 200.0)
+    assert isclose(registration.get('expected_fre'), 1.2247, abs_tol = 1e-4)
+    assert isclose(registration.get('mean_fle'), 2.1213203435596424)
+    assert registration.get('no_fids') == 3
+
+    #register without resending the fiducials
+    postdata = dict(reference = reference)
+    reg_result = client.post('/register', data = json.dumps(postdata),
+                    content_type='application/json')
+    assert json.loads(reg_result.data.decode()) == registration
+
+    #unknown sessions fall back to stateless behaviour
+    postdata = dict(x_pos = 250.0, y_pos = 250.0,
+                    reference = 'not a session')
+    fid = client.post('/placefiducial', data = json.dumps(postdata),
+                      content_type='application/json')
+    fid_json = json.loads(fid.data.decode())
+    assert fid_json.get('valid_fid')
+    assert not fid_json.get('session')
+
+    postdata = dict(reference = 'not a session')
+    reg_result = client.post('/register', data = json.dumps(postdata),
+                    content_type='application/json')
+    reg_json = json.loads(reg_result.data.decode())
+    assert not reg_json.get('success')
+    assert not reg_json.get('session')
+
+    #without a reference one is made for us, reusing one is refused
+    postdata = dict(target = [0.0, 0.0, 0.0])
+    result = client.post('/initsession', data = json.dumps(postdata),
+                    content_type='application/json')
+    assert json.loads(result.data.decode()).get('reference')
+    postdata['reference'] = reference
+    assert client.post('/initsession', data = json.dumps(postdata),
+                       content_type='application/json').status_code == 400
+    assert np.array_equal(sksfmain.SESSIONS.get(reference).registration.target,
+                          [[200.0, 0.0, 0.0]])
+
+
+def testserve_optimalmargin(client):
+    """Serve optimal margin"""
+    #get should not be allowed
+    margin = client.get('/optimalmargin')
+    parser = FredHTMLParser('405 Method Not Allowed')
+    parser.feed(str(margin.data))
+    assert parser.title_ok
+
+    postdata = dict(expected_tre = 3.0, target_radius = 10.0)
+    result = client.post('/optimalmargin', data = json.dumps(postdata),
+                    content_type='application/json')
+    result_json = json.loads(result.data.decode())
+    assert result_json.get('success')
+    assert len(result_json.get('margins')) == 201
+    assert len(result_json.get('expected_scores')) == 201
+    assert result_json.get('optimal_margin') > 0.0
+    assert result_json.get('optimal_score') == \
+                    max(result_json.get('expected_scores'))
+
+    postdata = dict(expected_tre = 3.0, margins = [-20.0, 1.0])
+    result = client.post('/optimalmargin', data = json.dumps(postdata),
+                    content_type='application/json')
+    assert not json.loads(result.data.decode()).get('success', True)
+
+    postdata = dict(target_radius = 10.0)
+    result = client.post('/optimalmargin', data = json.dumps(postdata),
+                    content_type='application/json')
+    assert not json.loads(result.data.decode()).get('success', True)
+
+
+def testserve_expectedtremap(client):
+    """Serve expected TRE map"""
+    #get should not be allowed
+    tremap = client.get('/expectedtremap')
+    parser = FredHTMLParser('405 Method Not Allowed')
+    parser.feed(str(tremap.data))
+    assert parser.title_ok
+
+    fids = [[200.0, 200.0, 0.0], [300.0, 220.0, 0.0], [250.0, 320.0, 0.0]]
+    postdata = dict(preop_fids = fids, intraop_fle = 4.0, stride = 8)
+    result = client.post('/expectedtremap', data = json.dumps(postdata),
+                    content_type='application/json')
+    result_json = json.loads(result.data.decode())
+    assert result_json.get('success')
+    assert result_json.get('shape') == [64, 64]
+    assert result_json.get('stride') == 8
+    data = np.frombuffer(base64.b64decode(result_json.get('data')),
+                         dtype=np.uint8).reshape(64, 64)
+    #expected tre is lowest near the fiducials' centroid
+    low_row, low_column = divmod(int(np.argmin(data)), data.shape[1])
+    assert abs(low_column * 8 - 250) < 24
+    assert abs(low_row * 8 - 247) < 24
+
+    #pre-op and anisotropic fle are used, as they are when registering
+    for fles, mean_fle_sq, fle_cov in ((dict(intraop_fle = 4.0), 4.0, None),
+            (dict(intraop_fle = 4.0, preop_fle = 5.0), 9.0, None),
+            (dict(intraop_fle_covariance = np.diag([8.0, 0.5, 0.5]).tolist()),
+             0.0, np.diag([8.0, 0.5, 0.5]))):
+        result_json = json.loads(client.post('/expectedtremap',
+            data = json.dumps(dict(preop_fids = fids, stride = 8, **fles)),
+            content_type='application/json').data.decode())
+        assert isclose(np.max(np.frombuffer(base64.b64decode(
+            result_json.get('data')), dtype=np.uint8)) *
+                       result_json.get('scale'),
+                       np.max(np.sqrt(sksfmain.compute_tre_map(
+                           np.array(fids), mean_fle_sq, stride = 8,
+                           fle_cov = fle_cov))))
+
+    for postdata in (dict(preop_fids = fids[0:2], intraop_fle = 4.0),
+                     dict(preop_fids = fids, intraop_fle = 4.0, stride = 0),
+                     dict(reference = 'no such session')):
+        result = client.post('/expectedtremap', data = json.dumps(postdata),
+                        content_type='application/json')
+        assert not json.loads(result.data.decode()).get('success', True)
+
+
+def testserve_suggestfiducial(client):
+    """Serve suggest fiducial"""
+    #get should not be allowed
+    suggest = client.get('/suggestfiducial')
+    parser = FredHTMLParser('405 Method Not Allowed')
+    parser.feed(str(suggest.data))
+    assert parser.title_ok
+
+    fids = [[200.0, 250.0, 0.0], [300.0, 250.0, 0.0]]
+    postdata = dict(preop_fids = fids, target = [250.0, 200.0, 0.0],
+                    intraop_fle = 4.0, stride = 16, number = 2)
+    result = client.post('/suggestfiducial', data = json.dumps(postdata),
+                    content_type='application/json')
+    result_json = json.loads(result.data.decode())
+    assert result_json.get('success')
+    suggestions = np.array(result_json.get('suggestions'))
+    assert suggestions.shape == (2, 3)
+    assert np.all(are_valid_fiducials(
+        suggestions, sksfmain.ANATOMIES.geometry('brain512')))
+    assert result_json.get('expected_tre')[1] < \
+                    result_json.get('expected_tre')[0]
+
+    #pre-op fle adds to intra-op fle, anisotropic fle is used when given
+    postdata['preop_fle'] = 5.0
+    preop_tre = json.loads(client.post('/suggestfiducial',
+        data = json.dumps(postdata), content_type='application/json'
+        ).data.decode()).get('expected_tre')
+    assert np.allclose(preop_tre, np.multiply(
+        result_json.get('expected_tre'), 1.5))
+    postdata['intraop_fle_covariance'] = np.diag([0.5, 8.0, 0.5]).tolist()
+    result = client.post('/suggestfiducial', data = json.dumps(postdata),
+                    content_type='application/json')
+    assert not np.allclose(json.loads(result.data.decode()).get(
+        'expected_tre'), preop_tre)
+
+    postdata = dict(preop_fids = fids[0:1], target = [250.0, 200.0, 0.0])
+    result = client.post('/suggestfiducial', data = json.dumps(postdata),
+                    content_type='application/json')
+    assert not json.loads(result.data.decode()).get('success', True)
+
+    postdata = dict(reference = 'no such session')
+    result = client.post('/suggestfiducial', data = json.dumps(postdata),
+                    content_type='application/json')
+    assert not json.loads(result.data.decode()).get('success', True)
+
+    #the candidate grids kept are bounded, whatever the strides asked for
+    for stride in range(40, 80):
+        postdata = dict(preop_fids = fids, target = [250.0, 200.0, 0.0],
+                        stride = stride)
+        client.post('/suggestfiducial', data = json.dumps(postdata),
+                    content_type='application/json')
+    #pylint: disable=protected-access, no-value-for-parameter
+    cache_info = sksfmain._candidate_fiducials.cache_info()
+    assert cache_info.currsize <= cache_info.maxsize
+
+    #too many suggestions is a bad request, a bad number a failure
+    postdata = dict(preop_fids = fids, target = [250.0, 200.0, 0.0],
+                    number = sksfmain.MAX_SUGGESTIONS + 1)
+    result = client.post('/suggestfiducial', data = json.dumps(postdata),
+                    content_type='application/json')
+    assert result.status_code == 400
+    for number in ('many', [2], 0):
+        postdata['number'] = number
+        result = client.post('/suggestfiducial', data = json.dumps(postdata),
+                        content_type='application/json')
+        assert not json.loads(result.data.decode()).get('success', True)
+
+
+def testserve_fiducialinfluence(client):
+    """Serve fiducial influence"""
+    #get should not be allowed
+    influence = client.get('/fiducialinfluence')
+    parser = FredHTMLParser('405 Method Not Allowed')
+    parser.feed(str(influence.data))
+    assert parser.title_ok
+
+    preop_fids = [[-100., -100., 0.], [100., 50., 0.], [-50., 100., 0.],
+                  [80., -60., 0.]]
+    intraop_fids = [[100., -100., 0.], [300., 50., 0.], [150, 100., 0.],
+                    [290., -60., 0.]]
+    postdata = dict(target = [0.0, 0.0, 0.0], preop_fle = 0.0,
+                    intraop_fle = 4.5, preop_fids = preop_fids,
+                    intraop_fids = intraop_fids)
+    result = client.post('/fiducialinfluence', data = json.dumps(postdata),
+                    content_type='application/json')
+    result_json = json.loads(result.data.decode())
+    assert result_json.get('success')
+    assert result_json.get('no_fids') == 4
+    assert len(result_json.get('fre')) == 4
+    assert len(result_json.get('transformed_target')) == 4
+    #the fourth fiducial is 10 out from a translation of 200
+    assert np.argmin(result_json.get('fre')) == 3
+    assert isclose(result_json.get('actual_tre')[3], 200.0)
+    assert isclose(result_json.get('fre')[3], 0.0, abs_tol = 1e-4)
+
+    postdata['preop_fids'] = preop_fids[0:3]
+    postdata['intraop_fids'] = intraop_fids[0:3]
+    result = client.post('/fiducialinfluence', data = json.dumps(postdata),
+                    content_type='application/json')
+    assert not json.loads(result.data.decode()).get('success', True)
+
+    postdata = dict(reference = 'no such session')
+    result = client.post('/fiducialinfluence', data = json.dumps(postdata),
+                    content_type='application/json')
+    assert not json.loads(result.data.decode()).get('success', True)
+
+
+def testserve_metrics(client):
+    """Serve request metrics"""
+    client.post('/getfle')
+    client.post('/getfle')
+    client.get('/no/such/route')
+
+    result = client.get('/metrics')
+    assert result.status_code == 200
+    assert result.content_type.startswith('text/plain; version=0.0.4')
+    lines = result.data.decode().split('\n')
+    counts = [line for line in lines if line.startswith(
+        'fred_http_requests_total{endpoint="getfle",method="POST"')]
+    assert len(counts) == 1
+    assert int(counts[0].split(' ')[-1]) >= 2
+    assert any(line.startswith(
+        'fred_http_requests_total{endpoint="unmatched",method="GET",'
+        'status="404"}') for line in lines)
+
+    result = client.post('/metrics')
+    assert result.status_code == 405
+
+
+def testserve_binary(client):
+    """Serve binary messages to clients that accept them"""
+    octet = 'application/octet-stream'
+    response = client.post('/defaultcontour', headers={'Accept': octet})
+    assert response.content_type == octet
+    contour = decode_arrays(response.data).get('contour_delta')
+    assert np.array_equal(np.cumsum(contour, axis=0),
+                          np.load('static/brain512.npy'))
+    assert len(response.data) < len(client.post('/defaultcontour').data)
+    etag = response.headers.get('ETag')
+    response = client.post('/defaultcontour', headers={
+        'Accept': octet, 'If-None-Match': etag})
+    assert response.status_code == 304
+
+    #a binary registration, the translation of testserve_register
+    postdata = dict(target = [[0.0, 0.0, 0.0]], preop_fle = 0.0,
+                    intraop_fle = 4.5,
+                    preop_fids = [[-100., -100., 0.], [100., 50., 0.],
+                                  [-50., 100., 0.]],
+                    intraop_fids = [[100., -100., 0.], [300., 50., 0.],
+                                    [150, 100., 0.]])
+    response = client.post('/register', data = encode_values(postdata),
+                           content_type = octet, headers={'Accept': octet})
+    assert response.content_type == octet
+    result = decode_values(response.data)
+    assert result.get('success')
+    assert isclose(result.get('actual_tre'), 200.0, rel_tol = 1e-6)
+    assert result.get('transformed_target').dtype == np.float32
+    assert result.get('no_fids') == 3
+
+    #binary requests can get json responses
+    response = client.post('/register', data = encode_values(postdata),
+                           content_type = octet)
+    assert json.loads(response.data.decode()).get('actual_tre') == 200.0
+
+    response = client.post('/register', data = b'not a message',
+                           content_type = octet, headers={'Accept': octet})
+    assert not decode_values(response.data).get('success', True)
+
+    postdata = dict(x_pos = 100.0, y_pos = 250.0,
+                    intra_op_sys_fle = [2.0, 2.0, -2.0])
+    response = client.post('/placefiducial', data = encode_values(postdata),
+                           content_type = octet, headers={'Accept': octet})
+    result = decode_values(response.data)
+    assert result.get('valid_fid')
+    assert np.array_equal(result.get('fixed_fid'), [102.0, 252.0, -2.0])
+    assert np.array_equal(result.get('moving_fid'), [100.0, 250.0, 0.0])
+
+    response = client.post('/placefiducial', data = b'',
+                           content_type = octet, headers={'Accept': octet})
+    assert not decode_values(response.data).get('valid_fid', True)
+
+    #colliding names are malformed, not a server error
+    colliding = encode_arrays({'x_pos': np.float32(100.0),
+                               'x_pos.a': 'text'})
+    for endpoint, key in (('/placefiducial', 'valid_fid'),
+                          ('/register', 'success')):
+        response = client.post(endpoint, data = colliding,
+                               content_type = octet,
+                               headers={'Accept': octet})
+        assert response.status_code == 200
+        assert not decode_values(response.data).get(key, True)
+
+
+def testserve_anatomies(client):
+    """Serve contours and targets by anatomy id"""
+    result = client.post('/anatomies')
+    result_json = json.loads(result.data.decode())
+    assert 'brain512' in result_json.get('anatomies')
+    assert result_json.get('default') == 'brain512'
+
+    expectedcontour = np.load('static/brain512.npy')
+    for kwargs in ({'query_string': {'anatomy': 'brain512'}},
+                   {'data': json.dumps({'anatomy': 'brain512'}),
+                    'content_type': 'application/json'}):
+        response = client.post('/defaultcontour', **kwargs)
+        servedcontour = json.loads(response.data.decode()).get('contour')
+        assert np.array_equal(servedcontour, expectedcontour)
+
+    response = client.post('/defaultcontour',
+                           query_string={'anatomy': 'no such anatomy'})
+    assert not json.loads(response.data.decode()).get('success', True)
+
+    for postdata in ({'anatomy': 'brain512'}, {}):
+        response = client.post('/gettarget', data = json.dumps(postdata),
+                               content_type='application/json')
+        target = json.loads(response.data.decode()).get('target')
+        assert len(target[0]) == 3
+        #targets are in the outline's order, like make_target_point
+        assert get_contour_geometry(expectedcontour).contains(
+            np.array(target))[0]
+
+    response = client.post('/gettarget',
+                           data = json.dumps({'anatomy': 'no such anatomy'}),
+                           content_type='application/json')
+    assert not json.loads(response.data.decode()).get('success', True)
+
+
+def testgettarget_bad_outlines(client):
+    """Outlines that are too small, too big, malformed or that targets
+    can't be drawn from are bad requests"""
+    too_many = np.full((sksfmain.MAX_OUTLINE_POINTS + 1, 2), 100.0)
+    for outline in ([[100.0, 100.0], [200.0, 200.0]],
+                    [[0.0, 0.0], [1e9, 0.0], [0.0, 1e9]],
+                    [[0.0, 0.0], [-10.0, 0.0], [0.0, 10.0]],
+                    too_many.tolist(), [[1.0, 2.0], 'a', None], 'outline'):
+        response = client.post('/gettarget',
+                               data = json.dumps({'outline': outline}),
+                               content_type='application/json')
+        assert response.status_code == 400
+
+    #a thin ring, which the region scaled by the edge buffer misses
+    angles = np.linspace(0.0, 2.0 * np.pi, 100)
+    circle = np.stack([np.cos(angles), np.sin(angles)], axis=-1)
+    ring = np.concatenate([256.0 + 200.0 * circle,
+                           256.0 + 195.0 * circle[::-1]])
+    response = client.post('/gettarget',
+                           data = json.dumps({'outline': ring.tolist()}),
+                           content_type='application/json')
+    assert response.status_code == 400
+
+    response = client.post('/gettarget', data = json.dumps(
+        {'outline': [[100.0, 100.0], [100.0, 300.0], [300.0, 300.0],
+                     [300.0, 100.0]]}), content_type='application/json')
+    target = json.loads(response.data.decode()).get('target')
+    assert 100.0 < target[0][0] < 300.0
+
+
+def testfiducials_by_anatomy(client):
+    """Validate and suggest fiducials against the named anatomy"""
+    for anatomy, valid in (('brain512', True), ('no such anatomy', False),
+                           (['brain512'], False)):
+        response = client.post('/placefiducial', data = json.dumps({
+            'x_pos': 250.0, 'y_pos': 250.0, 'anatomy': anatomy}),
+                               content_type='application/json')
+        result = json.loads(response.data.decode())
+        assert result.get('valid_fid') == valid
+
+        response = client.post('/suggestfiducial', data = json.dumps({
+            'preop_fids': [[200.0, 200.0, 0.0], [300.0, 200.0, 0.0]],
+            'target': [250.0, 250.0, 0.0], 'intraop_fle': 1.0,
+            'stride': 32, 'anatomy': anatomy}),
+                               content_type='application/json')
+        result = json.loads(response.data.decode())
+        assert result.get('success') == valid
+
+    geometry = sksfmain.ANATOMIES.geometry('brain512')
+    assert sksfmain.ANATOMIES.target_pool('brain512').geometry is geometry
+    assert get_contour_geometry(geometry) is geometry
+
+
+def testsession_bad_reference(client):
+    """A reference that isn't a string is a bad request"""
+    for endpoint, postdata in (
+            ('/initsession', {'target': [250.0, 250.0, 0.0]}),
+            ('/placefiducial', {'x_pos': 250.0, 'y_pos': 250.0}),
+            ('/register', {}),
+            ('/fiducialinfluence', {}),
+            ('/expectedtremap', {}),
+            ('/suggestfiducial', {'target': [250.0, 250.0, 0.0]})):
+        postdata['reference'] = ['not', 'a', 'string']
+        response = client.post(endpoint, data = json.dumps(postdata),
+                               content_type='application/json')
+        assert response.status_code == 400
+
+
+def testplacefiducial_no_hashing(client, monkeypatch):
+    """Fiducials are checked against the geometry without hashing"""
+    def _no_hashing(_outline):
+        raise AssertionError("the outline should not be hashed")
+    monkeypatch.setattr('sksurgeryfred.algorithms.contour.contour_hash',
+                        _no_hashing)
+    #the registry builds the geometry once and keeps it
+    assert sksfmain.ANATOMIES.geometry('brain512') is \
+                    sksfmain.ANATOMIES.geometry('brain512')
+
+    for postdata, valid in (({'x_pos': 250.0, 'y_pos': 250.0}, True),
+                            ({'x_pos': 10.0, 'y_pos': 10.0}, False),
+                            ({'x_pos': 250.0}, False),
+                            ({'x_pos': 'a', 'y_pos': 250.0}, False)):
+        fid = client.post('/placefiducial', data = json.dumps(postdata),
+                          content_type='application/json')
+        assert json.loads(fid.data.decode()).get('valid_fid') == valid
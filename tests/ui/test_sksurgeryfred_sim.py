@@ -0,0 +1,99 @@
+# coding=utf-8
+
+"""Fiducial Registration Educational Demonstration simulation cli tests"""
+import csv
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from sksurgeryfred.algorithms.sweep import SWEEP_RESULT_DTYPE
+from sksurgeryfred.ui.sksurgeryfred_sim_command_line import main
+
+OUTLINE = 'static/brain512.npy'
+
+
+def test_sim_npz(tmp_path):
+    """
+    Should write the summary and per trial arrays, repeatably
+    """
+    output = str(tmp_path / 'results.npz')
+    args = ['-l', OUTLINE, '-n', '3', '5', '-f', '0.5', '2.0', '-t', '20',
+            '-c', '8', '-s', '1', '-o', output]
+    main(args)
+    saved = np.load(output)
+    assert saved['results'].dtype == SWEEP_RESULT_DTYPE
+    assert saved['results'].shape == (4,)
+    assert saved['tre'].shape == (4, 20)
+    assert saved['transformed_target'].shape == (4, 20, 3)
+
+    first = saved['tre']
+    main(args + ['-w', '2'])
+    assert np.array_equal(np.load(output)['tre'], first)
+
+
+def test_sim_csv(tmp_path):
+    """
+    A .csv output should get one row per configuration and margin
+    """
+    output = str(tmp_path / 'results.csv')
+    main(['-l', OUTLINE, '-m', '0.0', '2.0', '--targets', '250', '250',
+          '200', '260', '-t', '5', '-s', '1', '-o', output])
+    with open(output, newline='', encoding='utf-8') as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert len(rows) == 4
+    assert float(rows[2]['target_x']) == 200.0
+    assert float(rows[2]['target_y']) == 260.0
+    assert float(rows[1]['margin']) == 2.0
+    assert int(rows[0]['trials']) == 5
+
+
+def test_sim_score_table(tmp_path):
+    """
+    The score table should be saved and memory mapped from --score_table
+    """
+    table = str(tmp_path / 'scores.npy')
+    output = str(tmp_path / 'results.npz')
+    args = ['-l', OUTLINE, '-t', '5', '-s', '1', '--score_table', table,
+            '-o', output]
+    main(args)
+    first = np.load(output)['results']
+    assert os.path.exists(table)
+    main(args)
+    assert np.array_equal(np.load(output)['results'], first)
+
+    np.save(table, np.zeros((2, 2)))
+    with pytest.raises(SystemExit):
+        main(args)
+
+
+def test_sim_no_flask():
+    """
+    The cli should not import Flask or firestore
+    """
+    imported = subprocess.run(
+        [sys.executable, '-c',
+         'import sys; '
+         'import sksurgeryfred.ui.sksurgeryfred_sim_command_line; '
+         'print(sorted(name for name in sys.modules '
+         'if name.split(".")[0] in ("flask", "google", "main")))'],
+        stdout=subprocess.PIPE, check=True, universal_newlines=True)
+    assert imported.stdout.strip() == '[]'
+
+
+def test_sim_invalid_inputs(tmp_path):
+    """
+    Should exit with an error on invalid inputs
+    """
+    output = str(tmp_path / 'results.npz')
+    with pytest.raises(SystemExit):
+        main(['-l', OUTLINE, '--targets', '250', '-o', output])
+    with pytest.raises(SystemExit):
+        main(['-l', OUTLINE, '-n', '2', '-t', '5', '-o', output])
+    #the outline is needed, and should load
+    with pytest.raises(SystemExit):
+        main(['-t', '5', '-o', output])
+    with pytest.raises(SystemExit):
+        main(['-l', str(tmp_path / 'no_such_outline.npy'), '-o', output])
@@ -0,0 +1,91 @@
+# coding=utf-8
+
+"""Fiducial Registration Educational Demonstration tests"""
+import numpy as np
+import pytest
+
+from sksurgeryfred.algorithms.contour import ContourGeometry
+from sksurgeryfred.utilities.anatomy import AnatomyRegistry
+
+
+def _square(size):
+    return np.array([[0, 0], [0, size], [size, size], [size, 0]])
+
+
+def _registry(tmp_path, max_cached=2):
+    for size in (10, 20, 30):
+        np.save(str(tmp_path / ('square' + str(size) + '.npy')),
+                _square(size))
+    (tmp_path / 'readme.txt').write_text('not an anatomy')
+    return AnatomyRegistry(str(tmp_path), max_cached=max_cached)
+
+
+def test_registry_discovery(tmp_path):
+    """
+    Should find the .npy files, and only load them when used
+    """
+    registry = _registry(tmp_path)
+    assert registry.ids == ['square10', 'square20', 'square30']
+    assert len(registry) == 3
+    assert 'square20' in registry
+    assert 'readme' not in registry
+    assert not registry._outlines #pylint: disable=protected-access
+
+    outline = registry.outline('square20')
+    assert isinstance(outline, np.memmap)
+    assert not outline.flags.writeable
+    assert np.array_equal(outline, _square(20))
+    assert registry.outline('square20') is outline
+
+    with pytest.raises(ValueError):
+        registry.outline('no such anatomy')
+    with pytest.raises(ValueError):
+        registry.geometry('no such anatomy')
+    with pytest.raises(ValueError):
+        AnatomyRegistry(str(tmp_path), max_cached=0)
+
+
+def test_registry_lru(tmp_path):
+    """
+    Derived values should be cached, least recently used evicted
+    """
+    registry = _registry(tmp_path, max_cached=2)
+    calls = []
+
+    def _area(outline):
+        calls.append(outline.shape)
+        return ContourGeometry(outline).area
+
+    area = ContourGeometry(_square(10)).area
+    assert registry.derived('square10', 'area', _area) == area
+    assert registry.derived('square10', 'area', _area) == area
+    assert len(calls) == 1
+
+    geometry = registry.geometry('square10')
+    assert registry.geometry('square10') is geometry
+    assert np.allclose(geometry.centre, [5.0, 5.0])
+
+    registry.derived('square20', 'area', _area)
+    registry.derived('square10', 'area', _area)
+    #square20 is now the least recently used, so is evicted
+    registry.derived('square30', 'area', _area)
+    assert len(calls) == 3
+    registry.derived('square10', 'area', _area)
+    assert len(calls) == 3
+    registry.derived('square20', 'area', _area)
+    assert len(calls) == 4
+
+
+def test_registry_target_pool(tmp_path):
+    """
+    Targets should lie inside the anatomy, away from the edge
+    """
+    registry = _registry(tmp_path)
+    pool = registry.target_pool('square30', edge_buffer=0.5)
+    assert registry.target_pool('square30', edge_buffer=0.5) is pool
+    assert registry.target_pool('square30') is not pool
+    for _ in range(20):
+        target = pool.pop()
+        assert target.shape == (1, 3)
+        assert np.all(target[0, 0:2] >= 6.5)
+        assert np.all(target[0, 0:2] <= 23.5)
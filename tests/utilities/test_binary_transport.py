@@ -0,0 +1,104 @@
+# coding=utf-8
+
+"""Fiducial Registration Educational Demonstration tests"""
+import numpy as np
+import pytest
+
+from sksurgeryfred.utilities import binary_transport as bt
+
+
+def test_arrays_round_trip():
+    """
+    Arrays and text should decode to views equal to the originals
+    """
+    arrays = {'fids': np.arange(12, dtype=np.float32).reshape(4, 3),
+              'scalar': np.array(2.5),
+              'odd': np.array([1, -2, 3], dtype='>i2'),
+              'flags': np.array([True, False]),
+              'reference': 'a reference'}
+    message = bt.encode_arrays(arrays)
+    assert len(message) % 8 == 0
+
+    decoded = bt.decode_arrays(message)
+    assert list(decoded) == list(arrays)
+    for name, array in arrays.items():
+        assert np.array_equal(decoded[name], array)
+    assert decoded['fids'].dtype == np.dtype('<f4')
+    assert decoded['odd'].dtype == np.dtype('<i2')
+    assert decoded['scalar'].shape == ()
+    #views of the message, not copies
+    assert not decoded['fids'].flags.writeable
+    assert decoded['fids'].flags.aligned
+
+    with pytest.raises(ValueError):
+        bt.encode_arrays({'complex': np.array([1j])})
+
+
+def test_values_round_trip():
+    """
+    Values should round trip with floats as float32 and nesting kept
+    """
+    values = {'success': True, 'fre': 1.25, 'no_fids': 3, 'empty': None,
+              'fixed_fid': [102.0, 252.0, -2.0], 'reference': 'abc',
+              'registration': {'success': False,
+                               'transformed_target': [[1.0, 2.0, 3.0]]}}
+    decoded = bt.decode_values(bt.encode_values(values))
+    assert decoded['success'] is True
+    assert decoded['fre'] == 1.25
+    assert decoded['no_fids'] == 3
+    assert 'empty' not in decoded
+    assert decoded['reference'] == 'abc'
+    assert decoded['fixed_fid'].dtype == np.float32
+    assert np.array_equal(decoded['fixed_fid'], values['fixed_fid'])
+    assert decoded['registration']['success'] is False
+    assert decoded['registration']['transformed_target'].shape == (1, 3)
+
+    decoded = bt.decode_values(bt.encode_values({'fre': 0.1}, '<f8'))
+    assert decoded['fre'] == 0.1
+
+
+def test_decode_invalid_messages():
+    """
+    Should raise ValueError on malformed messages
+    """
+    message = bt.encode_arrays({'fids': np.zeros((4, 3), dtype=np.float32)})
+    with pytest.raises(ValueError):
+        bt.decode_arrays(message[0:4])
+    with pytest.raises(ValueError):
+        bt.decode_arrays(b'JSON' + message[4:])
+    with pytest.raises(ValueError):
+        bt.decode_arrays(message[0:-8])
+    with pytest.raises(ValueError):
+        bt.decode_arrays(message[0:10])
+    bad_code = bytearray(message)
+    bad_code[9] = 99
+    with pytest.raises(ValueError):
+        bt.decode_arrays(bytes(bad_code))
+
+    #a text entry with no dimensions has no length
+    bad_text = bytearray(bt.encode_arrays({'reference': 'abc'}))
+    bad_text[10] = 0
+    with pytest.raises(ValueError):
+        bt.decode_arrays(bytes(bad_text))
+
+    #names that can't all be nested
+    for arrays in ({'a': np.zeros(2, dtype=np.float32), 'a.b': 'text'},
+                   {'a.b': 'text', 'a': 'text'},
+                   {'a': 'text', 'a.b.c': np.zeros(1, dtype=np.int32)}):
+        with pytest.raises(ValueError):
+            bt.decode_values(bt.encode_arrays(arrays))
+
+
+def test_delta_encoding():
+    """
+    Delta encoding should be lossless for integer contours
+    """
+    contour = np.load('static/brain512.npy')
+    deltas = bt.delta_encode(contour)
+    assert deltas.dtype == np.dtype('<i2')
+    assert np.array_equal(bt.delta_decode(deltas), contour)
+
+    with pytest.raises(ValueError):
+        bt.delta_encode(np.array([[0.5, 1.0]]))
+    with pytest.raises(ValueError):
+        bt.delta_encode(np.array([[0, 0], [40000, 0]]))
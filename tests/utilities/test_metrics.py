@@ -0,0 +1,96 @@
+# coding=utf-8
+
+"""Fiducial Registration Educational Demonstration tests"""
+import threading
+
+from sksurgeryfred.utilities.metrics import RequestMetrics, LATENCY_BUCKETS, \
+                RETIRE_EVERY
+
+
+def test_metrics_record():
+    """
+    Counts, errors and histograms should add up per endpoint
+    """
+    metrics = RequestMetrics()
+    metrics.record('register', 'POST', 200, 0.002, 500, 50)
+    metrics.record('register', 'POST', 200, 20.0, 500, 50)
+    metrics.record('register', 'POST', 500, 0.0005)
+    metrics.record('index', 'GET', 200, 0.01)
+
+    totals = metrics.collect()
+    stats = totals[('register', 'POST')]
+    assert stats.count == 3
+    assert stats.statuses == {200: 2, 500: 1}
+    assert stats.errors == 1
+    assert stats.latency_counts[0] == 1
+    assert stats.latency_counts[1] == 1
+    assert stats.latency_counts[len(LATENCY_BUCKETS)] == 1
+    assert stats.request_size_sum == 1000
+    assert totals[('index', 'GET')].count == 1
+
+
+def test_metrics_threads():
+    """
+    Each thread's buckets should be summed, including finished threads
+    """
+    metrics = RequestMetrics()
+
+    def _requests():
+        for _ in range(100):
+            metrics.record('register', 'POST', 200, 0.001)
+
+    threads = [threading.Thread(target=_requests) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.collect()[('register', 'POST')].count == 400
+
+    #finished threads are folded into the retired totals
+    metrics.record('register', 'POST', 200, 0.001)
+    assert metrics.collect()[('register', 'POST')].count == 401
+    assert len(metrics._buckets) == 1 #pylint: disable=protected-access
+    assert metrics.collect()[('register', 'POST')].count == 401
+
+
+def test_metrics_unscraped():
+    """
+    Finished threads should not accumulate when nobody scrapes
+    """
+    metrics = RequestMetrics()
+    no_threads = 3 * RETIRE_EVERY + 5
+    for _ in range(no_threads):
+        thread = threading.Thread(
+            target=metrics.record, args=('register', 'POST', 200, 0.001))
+        thread.start()
+        thread.join()
+    #pylint: disable=protected-access
+    assert len(metrics._buckets) <= RETIRE_EVERY
+    assert metrics.collect()[('register', 'POST')].count == no_threads
+    assert not metrics._buckets
+
+
+def test_metrics_render():
+    """
+    Should render Prometheus text format with cumulative buckets
+    """
+    metrics = RequestMetrics()
+    assert '# TYPE fred_http_requests_total counter' in metrics.render()
+
+    metrics.record('register', 'POST', 200, 0.002, 500, 50)
+    metrics.record('register', 'POST', 503, 0.2, 500, 50)
+    text = metrics.render()
+    assert text.endswith('\n')
+    lines = text.split('\n')
+    assert 'fred_http_requests_total{endpoint="register",method="POST",' \
+           'status="200"} 1' in lines
+    assert 'fred_http_request_errors_total{endpoint="register",' \
+           'method="POST"} 1' in lines
+    assert 'fred_http_request_duration_seconds_bucket{endpoint="register",' \
+           'method="POST",le="0.0025"} 1' in lines
+    assert 'fred_http_request_duration_seconds_bucket{endpoint="register",' \
+           'method="POST",le="+Inf"} 2' in lines
+    assert 'fred_http_request_duration_seconds_count{endpoint="register",' \
+           'method="POST"} 2' in lines
+    assert 'fred_http_response_size_bytes_sum{endpoint="register",' \
+           'method="POST"} 100' in lines
@@ -0,0 +1,98 @@
+# coding=utf-8
+
+"""Fiducial Registration Educational Demonstration tests"""
+import numpy as np
+import pytest
+
+from sksurgeryfred.utilities.sessions import SessionStore, make_session
+
+
+class _FakeTimer():
+    """A clock we can move by hand"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_session_store_lru():
+    """
+    The least recently used session should be evicted when full
+    """
+    with pytest.raises(ValueError):
+        SessionStore(max_sessions=0)
+
+    store = SessionStore(max_sessions=2)
+    store.add('a', 'session a')
+    store.add('b', 'session b')
+    assert len(store) == 2
+
+    #using a makes b the least recently used
+    assert store.get('a') == 'session a'
+    store.add('c', 'session c')
+    assert len(store) == 2
+    assert store.get('b') is None
+    assert store.get('a') == 'session a'
+    assert store.get('c') == 'session c'
+
+    #a session can't be replaced, or evict another
+    with pytest.raises(ValueError):
+        store.add('c', 'new session c')
+    assert len(store) == 2
+    assert store.get('c') == 'session c'
+
+    store.remove('a')
+    store.remove('not there')
+    assert len(store) == 1
+
+
+def test_session_store_ttl():
+    """
+    Sessions should expire when not used for time_to_live seconds
+    """
+    timer = _FakeTimer()
+    store = SessionStore(max_sessions=10, time_to_live=100.0, timer=timer)
+    store.add('a', 'session a')
+    timer.now = 50.0
+    store.add('b', 'session b')
+    timer.now = 99.0
+    assert store.get('a') == 'session a'
+
+    timer.now = 160.0
+    assert store.get('b') is None
+    assert store.get('a') == 'session a'
+    timer.now = 260.0
+    assert store.get('a') is None
+    assert len(store) == 0
+
+    #an expired session's reference can be used again
+    timer.now = 500.0
+    store.add('a', 'new session a')
+    assert store.get('a') == 'new session a'
+
+
+def test_registration_session():
+    """
+    A session should register the fiducials added to it, and stop
+    accepting fiducials when full
+    """
+    session = make_session([10.0, 20.0, 0.0], 0.0, 0.0,
+                           [0.0, 0.0, 0.0], [0.0, 0.0, 0.0],
+                           [1.0, 0.0, 0.0], [0.0, 0.0, 0.0],
+                           max_fiducials=3)
+    assert not session.register()[0]
+
+    positions = [[0.0, 0.0, 0.0], [100.0, 0.0, 0.0], [0.0, 100.0, 0.0]]
+    for position in positions:
+        fixed_fid, moving_fid, registration = session.add_fiducial(position)
+        assert np.array_equal(fixed_fid, np.add(position, [1.0, 0.0, 0.0]))
+        assert np.array_equal(moving_fid, position)
+
+    assert registration[0]
+    assert registration[7] == 3
+    assert np.isclose(registration[6], 1.0)
+    assert np.isclose(registration[1], 0.0, atol=1e-4)
+
+    assert session.add_fiducial([50.0, 50.0, 0.0]) == (None, None, None)
+    assert session.register()[7] == 3